@@ -0,0 +1,350 @@
+"""Micro-benchmarks for the protocol, persistence, inventory and client hot paths, with a baseline comparison"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+# =========================
+# CONFIG
+# =========================
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORLD_SIZES = [(100, 30), (1000, 100), (10000, 500)]
+QUICK_WORLD_SIZES = [(100, 30), (1000, 100)]
+PLAYER_COUNTS = [10, 100, 1000]
+FANOUT_SIZES = [10, 100, 1000]
+PHYSICS_STEPS = 120  # One second of simulation at the client's fixed rate
+DEFAULT_THRESHOLD = 0.05  # Changes smaller than this are noise
+
+# The server and client write their config, world and settings files into the
+# current directory on import, so both get loaded inside a scratch directory
+# and the client never opens a window.
+os.environ["NIGHTTREE_HEADLESS"] = "1"
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# =========================
+# TIMING
+# =========================
+
+def measure(fn, repeat, min_time):
+    """Median and best microseconds per call of fn()"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    # autorange aims for 0.2s per run, scale it to the requested run length
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number * 1e6 for t in timer.repeat(repeat, number)]
+    return {
+        "us": round(statistics.median(runs), 3),
+        "best_us": round(min(runs), 3),
+        "number": number,
+        "repeat": repeat,
+    }
+
+def make_world(width, height):
+    """Same terrain layers as a freshly created server world"""
+    world = []
+    for y in range(height):
+        if y < 5:
+            row = ["air"] * width
+        elif y == 5:
+            row = ["grass"] * width
+        elif y < 10:
+            row = ["dirt"] * width
+        elif y < 15:
+            row = ["sand" if x % 7 == 0 or x % 11 == 0 else "dirt" for x in range(width)]
+        elif y < height - 1:
+            row = ["stone"] * width
+        else:
+            row = ["dirt"] * width
+        world.append(row)
+    return world
+
+def make_player(rng):
+    blocks = ["dirt", "grass", "stone", "sand", "wood", "ladder"]
+
+    def slot():
+        if rng.random() < 0.6:
+            return {"block": rng.choice(blocks), "count": rng.randint(1, 64)}
+        return None
+
+    return {
+        "x": rng.uniform(0, 100),
+        "y": rng.uniform(0, 30),
+        "hotbar": [slot() for _ in range(7)],
+        "inventory": [slot() for _ in range(21)],
+        "color": "blue",
+    }
+
+class NullSocket:
+    """Stands in for a client socket, sends succeed without going anywhere"""
+    def sendmsg(self, buffers):
+        return sum(len(b) for b in buffers)
+
+# =========================
+# CASES
+# =========================
+
+def protocol_cases(server, client):
+    """send_msg + recv_msg round trips for each message type over a socketpair"""
+    rng = random.Random(1)
+    world = make_world(100, 30)
+    to_client = {
+        "player_move": {"type": "player_move", "id": "player123", "x": 41.25, "y": 6.0},
+        "chat": {"type": "chat", "from": "player123", "level": 0, "message": "anyone got spare wood near spawn?"},
+        "update_block": {"type": "update_block", "x": 57, "y": 9, "block": "air", "v": 1234},
+        "block_ack": {"type": "block_ack", "seq": 88, "ok": True, "x": 57, "y": 9, "block": "air"},
+        "slot_update": {"type": "slot_update", "seq": 12, "slots": {"h2": {"block": "dirt", "count": 33}}, "edit": 88},
+        "player_pings": {"type": "player_pings", "pings": {f"player{i:03d}": rng.randint(5, 200) for i in range(20)}},
+        "welcome": {
+            "type": "welcome", "id": "player123", "motd": "hi", "server": "bench", "world_version": 0,
+            "world_name": "world", "x": 10, "y": 3, "hotbar": make_player(rng)["hotbar"],
+            "inventory": make_player(rng)["inventory"], "level": 0, "color": "blue", "max_players": 20,
+            "current_players": 1, "features": sorted(server.SERVER_FEATURES), "resume_token": "x" * 32,
+            "world": world,
+        },
+    }
+    to_server = {
+        "move": {"type": "move", "x": 41.25, "y": 6.0},
+        "chat": {"type": "chat", "message": "anyone got spare wood near spawn?"},
+        "break_block": {"type": "break_block", "x": 57, "y": 9, "seq": 88},
+        "place_block": {"type": "place_block", "x": 57, "y": 9, "slot": 2, "seq": 89},
+    }
+    cases = {}
+    for mode in ("plain", "zlib"):
+        server_sock, client_sock = socket.socketpair()
+        server_codec = server.codecs[server_sock] = server.StreamCodec()
+        client_codec = client.StreamCodec()
+        if mode == "zlib":
+            server_codec.enable()
+            client_codec.enable()
+        server_reader = server.FrameReader(server_sock)
+        client_reader = client.FrameReader(client_sock)
+        for kind, msg in to_client.items():
+            def run(msg=msg, server_sock=server_sock, client_reader=client_reader, client_codec=client_codec):
+                server.send_msg(server_sock, msg)
+                client.recv_msg(client_reader, codec=client_codec)
+            cases[f"protocol/{mode}/to_client/{kind}"] = run
+        for kind, msg in to_server.items():
+            def run(msg=msg, client_sock=client_sock, server_reader=server_reader, client_codec=client_codec):
+                client.send_msg(client_sock, msg, codec=client_codec)
+                server.recv_msg(server_reader)
+            cases[f"protocol/{mode}/to_server/{kind}"] = run
+    return cases
+
+def persistence_cases(server, quick):
+    """save_world and save_players at growing sizes"""
+    cases = {}
+    for width, height in QUICK_WORLD_SIZES if quick else WORLD_SIZES:
+        world = make_world(width, height)
+        def run(world=world):
+            server.world = world
+            server.save_world()
+        cases[f"persistence/save_world/{width}x{height}"] = run
+    rng = random.Random(2)
+    for count in PLAYER_COUNTS:
+        players = {f"player{i:04d}": make_player(rng) for i in range(count)}
+        def run(players=players):
+            server.player_data = players
+            server.save_players()
+        cases[f"persistence/save_players/{count}"] = run
+    return cases
+
+def inventory_cases(server):
+    """The add_items loops behind break_block and /give"""
+    pid = "bench_inventory"
+    cases = {}
+
+    def full_of(block):
+        return {"block": block, "count": 64}
+
+    # break_block: the broken block stacks onto the first hotbar slot
+    def run_first():
+        server.player_data = {pid: {
+            "hotbar": [{"block": "dirt", "count": 1}] + [None] * 6,
+            "inventory": [None] * 21,
+        }}
+        server.add_items(pid, "dirt", 1)
+    cases["inventory/break_block/stack_first_slot"] = run_first
+
+    # break_block: every slot is full of something else except the last inventory stack
+    def run_last():
+        server.player_data = {pid: {
+            "hotbar": [full_of("stone") for _ in range(7)],
+            "inventory": [full_of("stone") for _ in range(20)] + [{"block": "dirt", "count": 1}],
+        }}
+        server.add_items(pid, "dirt", 1)
+    cases["inventory/break_block/stack_last_slot"] = run_last
+
+    # /give stone 448 into an empty hotbar fills all 7 slots
+    def run_give():
+        server.player_data = {pid: {"hotbar": [None] * 7, "inventory": [None] * 21}}
+        server.add_items(pid, "stone", 448, kinds=("hotbar",))
+    cases["inventory/give/fill_hotbar"] = run_give
+    return cases
+
+def broadcast_cases(server):
+    """broadcast() fan-out to connected clients whose sockets discard everything"""
+    cases = {}
+    msg = {"type": "update_block", "x": 57, "y": 9, "block": "air", "v": 1234}
+    for count in FANOUT_SIZES:
+        clients = {}
+        for i in range(count):
+            sock = NullSocket()
+            server.codecs[sock] = server.StreamCodec()
+            clients[f"player{i:04d}"] = sock
+        def run(clients=clients):
+            server.clients = clients
+            server.broadcast(msg)
+        cases[f"broadcast/fanout/{count}"] = run
+    return cases
+
+def client_cases(client, physics):
+    """Fixed-step collision and world drawing, as the game loop runs them"""
+    import pygame
+    cases = {}
+    world = make_world(100, 30)
+    # Some walls and a ladder so the sweeps actually hit things
+    for y in range(2, 5):
+        world[y][30] = "stone"
+        world[y][70] = "stone"
+    for y in range(0, 5):
+        world[y][50] = "ladder"
+    tiles = physics.TileMap(world)
+    inputs = [
+        physics.Inputs(right=True),
+        physics.Inputs(right=True, jump=True),
+        physics.Inputs(left=True),
+        physics.Inputs(climb_up=True),
+    ]
+
+    def run_physics():
+        state = physics.PlayerState(10, 3)
+        for i in range(PHYSICS_STEPS):
+            physics.step(state, inputs[(i // 30) % len(inputs)], 1.0 / physics.PHYSICS_HZ, tiles)
+    cases[f"client/physics/steps_{PHYSICS_STEPS}"] = run_physics
+
+    surface = pygame.Surface((client.SCREEN_WIDTH, client.SCREEN_HEIGHT))
+    for width, height in [(100, 30), (1000, 100)]:
+        world = make_world(width, height)
+        camera_x = width * client.BLOCK_SIZE // 2 - client.SCREEN_WIDTH // 2
+        camera_y = 0
+        def run(world=world, camera_x=camera_x):
+            client.draw_world(surface, world, camera_x, camera_y)
+        cases[f"client/draw_world/{width}x{height}"] = run
+    return cases
+
+# =========================
+# REPORT
+# =========================
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare(results, baseline, threshold):
+    """Print a table against a baseline run, returns the names that got slower"""
+    slower = []
+    print(f"{'benchmark':<50} {'baseline us':>12} {'now us':>12} {'change':>8}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<50} {'-':>12} {result['us']:>12.3f} {'new':>8}")
+            continue
+        ratio = result["us"] / old["us"] if old["us"] else 1.0
+        change = f"{(ratio - 1) * 100:+.1f}%"
+        if ratio > 1 + threshold:
+            slower.append(name)
+            change += " slower"
+        elif ratio < 1 - threshold:
+            change += " faster"
+        print(f"{name:<50} {old['us']:>12.3f} {result['us']:>12.3f} {change:>8}")
+    for name in baseline:
+        if name not in results:
+            print(f"{name:<50} {baseline[name]['us']:>12.3f} {'-':>12} {'gone':>8}")
+    return slower
+
+# =========================
+# RUN
+# =========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Night Tree server and client hot paths")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark, the median is reported")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed run")
+    parser.add_argument("--quick", action="store_true", help="skip the 10000x500 world")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --out to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change counted as faster/slower")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if anything got slower")
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    sys.path.insert(0, REPO_DIR)
+    scratch = tempfile.TemporaryDirectory(prefix="nighttree-bench-")
+    os.chdir(scratch.name)
+    # Keep the server's startup lines out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        import moddedserver as server
+        import moddedclient as client
+        import physics
+
+    cases = {}
+    cases.update(protocol_cases(server, client))
+    cases.update(persistence_cases(server, args.quick))
+    cases.update(inventory_cases(server))
+    cases.update(broadcast_cases(server))
+    cases.update(client_cases(client, physics))
+
+    results = {}
+    for name, fn in cases.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(fn, args.repeat, args.min_time)
+        print(f"{name:<50} {results[name]['us']:>12.3f} us", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    os.chdir(REPO_DIR)
+    scratch.cleanup()
+
+    if out_path:
+        with open(out_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline is not None:
+        baseline = {name: result for name, result in baseline.items() if args.filter in name}
+        slower = compare(results, baseline, args.threshold)
+        if slower and args.fail_on_regression:
+            sys.exit(1)
+    elif not out_path:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,380 @@
+"""Bot swarm load generator for moddedserver.py, speaks the game protocol over plain TCP"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import zlib
+
+# =========================
+# CONFIG
+# =========================
+
+COMPRESSED = 0x80000000  # Length prefix flag for zlib frames, same as the server
+FEATURES = ["slot_delta", "block_ack", "zlib"]  # What a current client offers at login
+MOVE_INTERVAL = 0.05  # Real clients send at most 20 moves per second
+BEHAVIORS = ("wanderer", "builder", "chatter", "reconnect")
+DEFAULT_MIX = "wanderer=70,builder=20,chatter=10"
+
+# =========================
+# STATS
+# =========================
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+class Stats:
+    """Counters shared by every bot, plus latencies since the last report"""
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.logins = 0
+        self.failed_logins = 0
+        self.reconnects = 0
+        self.disconnects = {}  # reason -> count, for connections we did not close ourselves
+        self.server_errors = 0  # Chat lines from SERVER (rejected commands and such)
+        self.rejected_edits = 0
+        self.chat_latency = []  # Seconds from a chat send to each bot receiving the broadcast
+        self.edit_latency = []  # Seconds from break/place to the builder seeing the update_block
+        self.all_chat = []
+        self.all_edit = []
+
+    def lost(self, reason):
+        self.disconnects[reason] = self.disconnects.get(reason, 0) + 1
+
+    def take_window(self):
+        """Latencies since the last call, also kept for the final summary"""
+        chat, edit = self.chat_latency, self.edit_latency
+        self.chat_latency, self.edit_latency = [], []
+        self.all_chat += chat
+        self.all_edit += edit
+        return chat, edit
+
+# =========================
+# BOT
+# =========================
+
+class Bot:
+    """One simulated player"""
+    def __init__(self, player_id, behavior, args, stats):
+        self.player_id = player_id
+        self.behavior = behavior
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(player_id)
+        self.reader = None
+        self.writer = None
+        self.decompressor = None
+        self.connected = False
+        self.world = []
+        self.hotbar = [None] * 7
+        self.x = 10.0
+        self.y = 3.0
+        self.pending_edits = {}  # (x, y) -> time the edit was sent
+
+    async def connect(self):
+        """Log in and read the welcome, returns True once in the world"""
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.args.host, self.args.port), timeout=10)
+            self.decompressor = zlib.decompressobj()
+            await self.send({
+                "type": "login",
+                "id": self.player_id,
+                "password": self.args.password,
+                "color": self.rng.choice(["blue", "red", "green", "yellow"]),
+                "features": [] if self.args.legacy else FEATURES,
+            })
+            msg = await asyncio.wait_for(self.recv(), timeout=30)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            self.stats.failed_logins += 1
+            self.stats.lost(f"login failed: {type(e).__name__}")
+            await self.close(leave=False)
+            return False
+        if not msg or msg.get("type") != "welcome":
+            self.stats.failed_logins += 1
+            self.stats.lost(msg.get("reason", "no welcome") if msg else "no welcome")
+            await self.close(leave=False)
+            return False
+        self.world = msg.get("world", [])
+        self.hotbar = msg.get("hotbar", [None] * 7)
+        self.x = float(msg.get("x", 10))
+        self.y = float(msg.get("y", 3))
+        self.connected = True
+        self.stats.logins += 1
+        return True
+
+    async def close(self, leave=True):
+        """Quit like the client does, or just drop the socket when leave is False"""
+        was_connected = self.connected
+        self.connected = False
+        if self.writer is None:
+            return
+        try:
+            if leave and was_connected:
+                await self.send({"type": "leave"})
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (OSError, ConnectionError):
+            pass
+        self.writer = None
+
+    async def send(self, msg):
+        data = json.dumps(msg).encode('utf-8')
+        self.writer.write(struct.pack('!I', len(data)) + data)
+        await self.writer.drain()
+        self.stats.sent += 1
+        self.stats.bytes_out += 4 + len(data)
+
+    async def recv(self):
+        header = await self.reader.readexactly(4)
+        length = struct.unpack('!I', header)[0]
+        payload = await self.reader.readexactly(length & ~COMPRESSED)
+        self.stats.received += 1
+        self.stats.bytes_in += 4 + len(payload)
+        if length & COMPRESSED:
+            payload = self.decompressor.decompress(payload)
+        return json.loads(payload.decode('utf-8'))
+
+    async def listen(self):
+        """Read until the connection ends, answering pings and timing broadcasts"""
+        try:
+            while self.connected:
+                self.handle(await self.recv())
+        except (OSError, asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            if self.connected:
+                self.stats.lost(f"connection lost: {type(e).__name__}")
+        self.connected = False
+
+    def handle(self, msg):
+        kind = msg.get("type")
+        now = time.perf_counter()
+        if kind == "ping":
+            self.writer.write(self.frame({"type": "pong", "t": msg.get("t")}))
+        elif kind == "chat":
+            text = msg.get("message", "")
+            if msg.get("from") == "SERVER":
+                self.stats.server_errors += 1
+            elif text.startswith("lg "):
+                self.stats.chat_latency.append(now - float(text.split()[1]))
+        elif kind == "update_block":
+            x, y = msg.get("x"), msg.get("y")
+            if 0 <= y < len(self.world) and 0 <= x < len(self.world[0]):
+                self.world[y][x] = msg.get("block")
+            sent = self.pending_edits.pop((x, y), None)
+            if sent is not None:
+                self.stats.edit_latency.append(now - sent)
+        elif kind == "block_ack":
+            if not msg.get("ok"):
+                self.stats.rejected_edits += 1
+                self.pending_edits.pop((msg.get("x"), msg.get("y")), None)
+        elif kind == "slot_update":
+            for ref, item in msg.get("slots", {}).items():
+                if ref.startswith("h") and ref[1:].isdigit() and int(ref[1:]) < len(self.hotbar):
+                    self.hotbar[int(ref[1:])] = item
+        elif kind == "hotbar_update":
+            self.hotbar = msg.get("hotbar", self.hotbar)
+        elif kind == "disconnect":
+            self.stats.lost(msg.get("reason", "disconnected"))
+            self.connected = False
+
+    def frame(self, msg):
+        """Encode a packet for a fire-and-forget write (pongs from the read loop)"""
+        data = json.dumps(msg).encode('utf-8')
+        self.stats.sent += 1
+        self.stats.bytes_out += 4 + len(data)
+        return struct.pack('!I', len(data)) + data
+
+    async def wander(self):
+        self.x = max(1.0, min(self.x + self.rng.uniform(-0.5, 0.5), len(self.world[0]) - 2 if self.world else 90))
+        await self.send({"type": "move", "x": round(self.x, 2), "y": self.y})
+
+    def surface(self, x):
+        """Topmost solid block in a column"""
+        for y, row in enumerate(self.world):
+            if row[x] not in ("air", "ladder"):
+                return y
+        return None
+
+    async def build(self):
+        """Dig out the surface block in a random column, or put one back"""
+        if not self.world:
+            return
+        x = self.rng.randrange(1, len(self.world[0]) - 1)
+        y = self.surface(x)
+        if y is None:
+            return
+        slot = next((i for i, item in enumerate(self.hotbar) if item), None)
+        if slot is not None and y > 0 and self.rng.random() < 0.5:
+            self.pending_edits[(x, y - 1)] = time.perf_counter()
+            await self.send({"type": "place_block", "x": x, "y": y - 1, "slot": slot, "seq": 0})
+        elif self.world[y][x] != "bedrock":
+            self.pending_edits[(x, y)] = time.perf_counter()
+            await self.send({"type": "break_block", "x": x, "y": y, "seq": 0})
+        if self.rng.random() < 0.1:
+            # What a drag and drop used to send
+            await self.send({"type": "sync_inventory", "hotbar": self.hotbar, "inventory": [None] * 21})
+
+    async def act(self, until):
+        """Play according to the behavior until the deadline or the connection ends"""
+        next_action = time.perf_counter()
+        while self.connected and time.perf_counter() < until:
+            await self.wander()
+            now = time.perf_counter()
+            if now >= next_action:
+                if self.behavior == "builder":
+                    await self.build()
+                    next_action = now + self.args.build_interval
+                elif self.behavior == "chatter":
+                    await self.send({"type": "chat", "message": f"lg {time.perf_counter():.6f}"})
+                    next_action = now + self.rng.uniform(0.5, 1.5) * self.args.chat_interval
+            await asyncio.sleep(MOVE_INTERVAL)
+
+    async def run(self, deadline):
+        """Connect and play until the deadline, reconnect bots keep dropping and coming back"""
+        first = True
+        while time.perf_counter() < deadline:
+            if not first:
+                self.stats.reconnects += 1
+            first = False
+            if not await self.connect():
+                await asyncio.sleep(1)
+                continue
+            listener = asyncio.ensure_future(self.listen())
+            try:
+                if self.behavior == "reconnect":
+                    stay = self.rng.uniform(0.5, 1.5) * self.args.reconnect_interval
+                    await self.act(min(deadline, time.perf_counter() + stay))
+                    # Half of them vanish without saying goodbye, like a crashed client
+                    await self.close(leave=self.rng.random() < 0.5)
+                else:
+                    await self.act(deadline)
+                    await self.close()
+            except (OSError, ConnectionError) as e:
+                if self.connected:
+                    self.stats.lost(f"send failed: {type(e).__name__}")
+                await self.close(leave=False)
+            await listener
+            if self.behavior != "reconnect":
+                if time.perf_counter() < deadline:
+                    await asyncio.sleep(1)  # Lost the connection, try again like a player would
+                else:
+                    break
+
+# =========================
+# SWARM
+# =========================
+
+def parse_mix(text):
+    """"wanderer=70,builder=30" -> [(behavior, weight), ...]"""
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in BEHAVIORS:
+            raise SystemExit(f"Unknown behavior '{name}', pick from {', '.join(BEHAVIORS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+def report_line(stats, bots, elapsed, window, last):
+    """One progress line, rates cover the time since the previous line"""
+    chat, edit = stats.take_window()
+    counts = (stats.sent, stats.received, stats.bytes_out, stats.bytes_in)
+    rates = [(new - old) / window for new, old in zip(counts, last)]
+    connected = sum(1 for bot in bots if bot.connected)
+    errors = sum(stats.disconnects.values())
+    print(f"[{elapsed:6.1f}s] bots {connected}/{len(bots)}  "
+          f"out {rates[0]:.0f} msg/s {rates[2] / 1024:.1f} KB/s  in {rates[1]:.0f} msg/s {rates[3] / 1024:.1f} KB/s  "
+          f"chat p50/p99 {percentile(chat, 50) * 1000:.1f}/{percentile(chat, 99) * 1000:.1f} ms  "
+          f"edit p50/p99 {percentile(edit, 50) * 1000:.1f}/{percentile(edit, 99) * 1000:.1f} ms  "
+          f"lost {errors}", flush=True)
+    return counts
+
+async def swarm(args):
+    stats = Stats()
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    bots = []
+    tasks = []
+    last = (0, 0, 0, 0)
+    last_report = start
+    step = args.ramp or args.bots
+    next_step = start
+
+    while time.perf_counter() < deadline:
+        now = time.perf_counter()
+        if now >= next_step and len(bots) < args.bots:
+            # Add the next batch of players, all at once without --ramp
+            for _ in range(min(step, args.bots - len(bots))):
+                behavior = rng.choices([name for name, _ in mix], [weight for _, weight in mix])[0]
+                bot = Bot(f"{args.prefix}{len(bots):04d}", behavior, args, stats)
+                bots.append(bot)
+                tasks.append(asyncio.ensure_future(bot.run(deadline)))
+            next_step = now + args.step_seconds
+        if now - last_report >= args.report_interval:
+            last = report_line(stats, bots, now - start, now - last_report, last)
+            last_report = now
+        await asyncio.sleep(0.1)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stats.take_window()
+    elapsed = time.perf_counter() - start
+    return {
+        "bots": len(bots),
+        "behaviors": {name: sum(1 for bot in bots if bot.behavior == name) for name, _ in mix},
+        "seconds": round(elapsed, 1),
+        "messages_out_per_s": round(stats.sent / elapsed, 1),
+        "messages_in_per_s": round(stats.received / elapsed, 1),
+        "kb_out_per_s": round(stats.bytes_out / elapsed / 1024, 1),
+        "kb_in_per_s": round(stats.bytes_in / elapsed / 1024, 1),
+        "chat_latency_ms": {"p50": round(percentile(stats.all_chat, 50) * 1000, 2),
+                            "p99": round(percentile(stats.all_chat, 99) * 1000, 2),
+                            "samples": len(stats.all_chat)},
+        "edit_latency_ms": {"p50": round(percentile(stats.all_edit, 50) * 1000, 2),
+                            "p99": round(percentile(stats.all_edit, 99) * 1000, 2),
+                            "samples": len(stats.all_edit)},
+        "logins": stats.logins,
+        "failed_logins": stats.failed_logins,
+        "reconnects": stats.reconnects,
+        "rejected_edits": stats.rejected_edits,
+        "server_errors": stats.server_errors,
+        "disconnects": stats.disconnects,
+    }
+
+# =========================
+# RUN
+# =========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a Night Tree server with simulated players")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--password", default="0")
+    parser.add_argument("--bots", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"behavior weights, e.g. \"{DEFAULT_MIX},reconnect=5\"")
+    parser.add_argument("--ramp", type=int, default=0, help="add this many bots per step instead of all at once")
+    parser.add_argument("--step-seconds", type=float, default=10.0, help="seconds between ramp steps")
+    parser.add_argument("--build-interval", type=float, default=0.5, help="seconds between a builder's edits")
+    parser.add_argument("--chat-interval", type=float, default=2.0, help="average seconds between a chatter's lines")
+    parser.add_argument("--reconnect-interval", type=float, default=3.0, help="average seconds a reconnect bot stays")
+    parser.add_argument("--report-interval", type=float, default=2.0)
+    parser.add_argument("--prefix", default="lg", help="player id prefix, ids are <prefix>0000, <prefix>0001, ...")
+    parser.add_argument("--legacy", action="store_true", help="offer no protocol features, like an old client")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = asyncio.run(swarm(args))
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            print(f"{key}: {value}")
@@ -8,41 +8,173 @@ import socket
 import threading
 import time
 import struct
+import zlib
+import sys
+import random
+import argparse
+import array
+import csv
+import cProfile
+import physics
+
+try:
+    # Only used to read the socket's inbound queue for the debug overlay
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
 
 # =========================
 # HELPER FUNCTIONS
 # =========================
 
-def send_msg(sock, msg_dict):
+class NetStats:
+    """Packet and byte counters for one connection"""
+    def __init__(self):
+        self.packets_in = 0
+        self.packets_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Sizes before compression, and the CPU time it cost
+        self.raw_bytes_in = 0
+        self.raw_bytes_out = 0
+        self.codec_seconds = 0.0
+        self.recv_calls = 0  # recv syscalls on the current socket
+    
+    def compression_ratio(self):
+        """Bytes before compression per byte on the wire, both directions"""
+        return (self.raw_bytes_in + self.raw_bytes_out) / max(self.bytes_in + self.bytes_out, 1)
+
+COMPRESSED = 0x80000000  # Length prefix flag for zlib frames
+COMPRESS_THRESHOLD = 48  # Smaller frames gain less than the sync flush costs
+
+class StreamCodec:
+    """zlib streams for one connection, each frame is sync-flushed so it decodes on arrival"""
+    def __init__(self):
+        self.compressor = None  # Set once the server agreed to compression
+        self.decompressor = zlib.decompressobj()
+    
+    def enable(self):
+        self.compressor = zlib.compressobj(6)
+
+IOV_MAX = 512  # Buffers per sendmsg call, well under the usual OS limit
+
+def send_frames(sock, buffers):
+    """Write buffers in order with scatter/gather sends, returns the number of syscalls"""
+    if not hasattr(sock, "sendmsg"):
+        # No sendmsg on Windows
+        sock.sendall(b"".join(buffers))
+        return 1
+    calls = 0
+    i = 0
+    while i < len(buffers):
+        sent = sock.sendmsg(buffers[i:i + IOV_MAX])
+        calls += 1
+        # Skip what went out, keep the unsent tail of a partly written buffer
+        while i < len(buffers) and sent >= len(buffers[i]):
+            sent -= len(buffers[i])
+            i += 1
+        if sent:
+            buffers[i] = memoryview(buffers[i])[sent:]
+    return calls
+
+def send_msg(sock, msg_dict, stats=None, codec=None):
     """Send a length-prefixed JSON message"""
     msg_json = json.dumps(msg_dict)
     msg_bytes = msg_json.encode('utf-8')
     msg_len = len(msg_bytes)
+    data = msg_bytes
+    prefix = msg_len
+    start = time.perf_counter()
+    if codec and codec.compressor and msg_len >= COMPRESS_THRESHOLD:
+        data = codec.compressor.compress(msg_bytes) + codec.compressor.flush(zlib.Z_SYNC_FLUSH)
+        prefix = len(data) | COMPRESSED
     # Send 4-byte length prefix, then the message
-    sock.sendall(struct.pack('!I', msg_len) + msg_bytes)
-
-def recv_msg(sock):
+    send_frames(sock, [struct.pack('!I', prefix), data])
+    if stats:
+        stats.packets_out += 1
+        stats.bytes_out += 4 + len(data)
+        stats.raw_bytes_out += 4 + msg_len
+        if data is not msg_bytes:
+            stats.codec_seconds += time.perf_counter() - start
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # A bigger length prefix is a broken or hostile peer
+MAX_WELCOME_SIZE = 512 * 1024 * 1024  # The welcome may carry a whole uncompressed world
+READ_BUFFER_SIZE = 64 * 1024
+
+class FrameReader:
+    """Reads length-prefixed frames for one socket through a reusable buffer, several frames per recv when queued"""
+    def __init__(self, sock, max_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.max_size = max_size
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not handed out yet
+        self.end = 0  # End of the received bytes
+        self.recv_calls = 0
+
+    def read_frame(self):
+        """(compressed, payload memoryview) or None at EOF, the view is only valid until the next call"""
+        while True:
+            available = self.end - self.start
+            needed = 4
+            if available >= 4:
+                length = struct.unpack_from('!I', self.buffer, self.start)[0]
+                compressed = length & COMPRESSED
+                length &= ~COMPRESSED
+                if length > self.max_size:
+                    raise ValueError(f"Frame of {length} bytes is over the {self.max_size} byte limit")
+                needed = 4 + length
+                if available >= needed:
+                    begin = self.start + 4
+                    self.start = begin + length
+                    return compressed, self.view[begin:self.start]
+            self.make_room(available, needed)
+            received = self.sock.recv_into(self.view[self.end:])
+            self.recv_calls += 1
+            if not received:
+                return None
+            self.end += received
+
+    def make_room(self, available, needed):
+        """Move the partial frame to the front, in a fresh buffer if it does not fit (views handed out stay intact)"""
+        size = max(needed, READ_BUFFER_SIZE)
+        if size > len(self.buffer) or (available == 0 and len(self.buffer) > READ_BUFFER_SIZE):
+            # Grow for a big frame, or drop back to the normal size once it is consumed
+            buffer = bytearray(size)
+            buffer[:available] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif self.start:
+            self.buffer[:available] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = available
+
+def recv_msg(reader, stats=None, codec=None):
     """Receive a length-prefixed JSON message"""
-    # Read 4-byte length prefix
-    raw_msglen = recv_all(sock, 4)
-    if not raw_msglen:
+    calls = reader.recv_calls
+    frame = reader.read_frame()
+    if stats:
+        stats.recv_calls += reader.recv_calls - calls
+    if not frame or not frame[1]:
         return None
-    msglen = struct.unpack('!I', raw_msglen)[0]
-    # Read the message data
-    msg_bytes = recv_all(sock, msglen)
-    if not msg_bytes:
-        return None
-    return json.loads(msg_bytes.decode('utf-8'))
-
-def recv_all(sock, n):
-    """Helper to receive exactly n bytes"""
-    data = bytearray()
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data.extend(packet)
-    return bytes(data)
+    compressed, payload = frame
+    wire_size = 4 + len(payload)
+    start = time.perf_counter()
+    if compressed:
+        if codec is None:
+            raise ValueError("Compressed frame on a connection without compression")
+        # Bounded like a plain frame, a tiny frame can inflate a thousandfold
+        payload = codec.decompressor.decompress(payload, reader.max_size)
+        if codec.decompressor.unconsumed_tail:
+            raise ValueError(f"Compressed frame inflates past the {reader.max_size} byte limit")
+    if stats:
+        stats.packets_in += 1
+        stats.bytes_in += wire_size
+        stats.raw_bytes_in += 4 + len(payload)
+        if compressed:
+            stats.codec_seconds += time.perf_counter() - start
+    return json.loads(str(payload, 'utf-8'))
 
 # =========================
 # TEXTURE SYSTEM
@@ -52,6 +184,7 @@ import os as os_module
 # Default texture pack
 current_texture_pack = "default"
 block_textures = {}
+scaled_textures = {}  # (block_type, size) -> texture scaled for slots and icons
 
 def load_texture_pack(pack_name):
     """Load texture pack from textures folder"""
@@ -61,6 +194,7 @@ def load_texture_pack(pack_name):
     pack_dir = os_module.path.join(textures_dir, pack_name)
     
     block_textures = {}
+    scaled_textures.clear()
     
     # List of block types to load
     block_types = ["dirt", "grass", "stone", "sand", "wood", "bedrock", "ladder"]
@@ -101,6 +235,14 @@ def get_available_texture_packs():
     
     return packs
 
+def get_scaled_texture(block_type, size):
+    """Texture of a block scaled to size x size, scaled once per texture pack"""
+    key = (block_type, size)
+    if key not in scaled_textures:
+        texture = block_textures.get(block_type)
+        scaled_textures[key] = pygame.transform.scale(texture, (size, size)) if texture else None
+    return scaled_textures[key]
+
 def draw_block(surface, block_type, x, y):
     """Draw a block with texture or fallback to color"""
     texture = block_textures.get(block_type)
@@ -114,16 +256,43 @@ def draw_block(surface, block_type, x, y):
         pygame.draw.rect(surface, color, (x, y, BLOCK_SIZE, BLOCK_SIZE))
         pygame.draw.rect(surface, BLACK, (x, y, BLOCK_SIZE, BLOCK_SIZE), 1)
 
+
+def draw_world(surface, world, camera_x, camera_y):
+    """Draw every non-air block that is on screen"""
+    for y, row in enumerate(world):
+        for x, block in enumerate(row):
+            screen_x = x * BLOCK_SIZE - camera_x
+            screen_y = y * BLOCK_SIZE - camera_y
+            
+            if -BLOCK_SIZE < screen_x < SCREEN_WIDTH and -BLOCK_SIZE < screen_y < SCREEN_HEIGHT:
+                if block != "air":
+                    draw_block(surface, block, screen_x, screen_y)
+
 # =========================
 # CONFIG
 # =========================
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 700
 FPS = 60
+MENU_WAKE_MS = 500  # Idle menus wake up this often even without input
+REFRESH_POLL_MS = 50  # Server list wake-up rate while a refresh is running
+REFRESH_TIMEOUT = 7.0  # Seconds a server gets to answer a refresh before it counts as offline
+BACKGROUND_FPS = 10  # Game loop rate while the window is unfocused or minimized
 PLAYER_FILE = "player.dat"
 SECRET_KEY = "awesome_secret_people_key2026"
 SERVERS_FILE = "servers.json"
 SETTINGS_FILE = "settings.json"
+PING_INTERVAL = 1.0  # Seconds between pings to the server
+PING_TIMEOUT = 15  # Seconds without a pong before the server counts as dead
+RESUME_TIMEOUT = 10  # Seconds spent trying to resume a dropped session
+RESUME_RETRY = 0.5  # Seconds between resume attempts
+PROFILES_DIR = "profiles"
+WORLD_CACHE_DIR = "world_cache"  # Last seen world of every server, so rejoining only downloads changed chunks
+CHUNK_SIZE = 16  # Must match the server
+CLIENT_FEATURES = ["slot_delta", "block_ack", "world_chunks", "zlib", "udp"]  # Optional protocol extensions offered at login
+UDP_HELLO_INTERVAL = 0.5  # Seconds between UDP hellos until the server answers
+UDP_HELLO_TRIES = 10  # Stay on TCP for movement if none of them get through
+UDP_SIMULATED_LOSS = 0.0  # Fraction of datagrams dropped on purpose, for testing (--udp-loss)
 
 BLOCK_SIZE = 32
 PLAYER_WIDTH = 28
@@ -168,6 +337,13 @@ PLAYER_COLORS = {
     "pink": (255, 105, 180),
 }
 
+# Headless mode: no window, no textures, no menus (bots, CI, benchmarks)
+HEADLESS = "--headless" in sys.argv or os.environ.get("NIGHTTREE_HEADLESS", "0") != "0"
+if HEADLESS:
+    # The dummy drivers keep pygame.time and pygame.event working without a display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
 pygame.init()
 
 # Screen will be initialized after loading settings
@@ -175,6 +351,9 @@ screen = None
 clock = pygame.time.Clock()
 font = pygame.font.SysFont("Arial", 18)
 small_font = pygame.font.SysFont("Arial", 14)
+title_font = pygame.font.SysFont("Arial", 36, bold=True)
+big_title_font = pygame.font.SysFont("Arial", 48, bold=True)
+dialog_title_font = pygame.font.SysFont("Arial", 28, bold=True)
 
 # =========================
 # DEFAULT CONTROLS
@@ -190,6 +369,8 @@ DEFAULT_CONTROLS = {
     "player_list": pygame.K_TAB,
     "climb_up": pygame.K_w,
     "climb_down": pygame.K_s,
+    "debug_overlay": pygame.K_F3,
+    "profiler_dump": pygame.K_F4,
 }
 
 DEFAULT_APPEARANCE = {
@@ -207,6 +388,11 @@ DEFAULT_MODIFICATION = {
     "enabled": True
 }
 
+DEFAULT_PROFILER = {
+    "format": "csv",  # "csv" or "jsonl"
+    "cprofile_frames": 0  # Frames to run under cProfile after each dump, 0 = off
+}
+
 # =========================
 # TRANSLATIONS
 # =========================
@@ -237,6 +423,8 @@ TRANSLATIONS = {
         "player_list": "Player List",
         "climb_up": "Climb Up",
         "climb_down": "Climb Down",
+        "debug_overlay": "Debug Overlay",
+        "profiler_dump": "Save Profile",
         "press_key": "Press a key...",
         "press_esc_cancel": "Press ESC to cancel",
         
@@ -273,11 +461,15 @@ TRANSLATIONS = {
         "position": "Position",
         "players": "Players",
         "level": "Level",
+        "ping": "Ping",
+        "reconnecting": "Reconnecting...",
         "press_enter_send": "Press Enter to send, ESC to close",
         
         # Messages
         "connection_failed": "Connection Failed",
         "ok": "OK",
+        "connecting": "Connecting to",
+        "cancel": "Cancel",
         "yes": "Yes",
         "no": "No",
         
@@ -326,6 +518,8 @@ TRANSLATIONS = {
         "player_list": "Lista Giocatori",
         "climb_up": "Scala Su",
         "climb_down": "Scala Giù",
+        "debug_overlay": "Overlay Debug",
+        "profiler_dump": "Salva Profilo",
         "press_key": "Premi un tasto...",
         "press_esc_cancel": "Premi ESC per annullare",
         
@@ -362,11 +556,15 @@ TRANSLATIONS = {
         "position": "Posizione",
         "players": "Giocatori",
         "level": "Livello",
+        "ping": "Ping",
+        "reconnecting": "Riconnessione...",
         "press_enter_send": "Premi Invio per inviare, ESC per chiudere",
         
         # Messages
         "connection_failed": "Connessione Fallita",
         "ok": "OK",
+        "connecting": "Connessione a",
+        "cancel": "Annulla",
         "yes": "Sì",
         "no": "No",
         
@@ -425,6 +623,8 @@ TRANSLATIONS = {
         "player_list": "Lista de jugadores",
         "climb_up": "Subir",
         "climb_down": "Subir hacia abajo",
+        "debug_overlay": "Superposición de depuración",
+        "profiler_dump": "Guardar perfil",
         "press_key": "Presione una tecla...",
         "press_esc_cancel": "Presione ESC para cancelar",
         
@@ -461,6 +661,8 @@ TRANSLATIONS = {
         "posistion": "Posición",
         "players": "Jugadores",
         "level": "Nivel",
+        "ping": "Ping",
+        "reconnecting": "Reconectando...",
         "press_enter_send": "Presione Enter para enviar, ESC para cerrar",
         
         # Mensajes
@@ -506,6 +708,7 @@ def load_settings():
             "language": DEFAULT_LANGUAGE,
             "video": DEFAULT_VIDEO.copy(),
             "modification": DEFAULT_MODIFICATION.copy(),
+            "profiler": DEFAULT_PROFILER.copy(),
             "texture_pack": "default"
              }
         with open(SETTINGS_FILE, "w") as f:
@@ -521,6 +724,8 @@ def load_settings():
             loaded["video"] = DEFAULT_VIDEO.copy()
         if "texture_pack" not in loaded:
             loaded["texture_pack"] = "default"
+        if "profiler" not in loaded:
+            loaded["profiler"] = DEFAULT_PROFILER.copy()
         return loaded
 
 def save_settings(settings):
@@ -536,31 +741,37 @@ saved_video = settings.get("video", DEFAULT_VIDEO)
 saved_resolution = saved_video.get("resolution", "1200x700")
 saved_fullscreen = saved_video.get("fullscreen", False)
 
-if saved_fullscreen:
-    screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-    # Get actual fullscreen resolution
-    info = pygame.display.Info()
-    SCREEN_WIDTH = info.current_w
-    SCREEN_HEIGHT = info.current_h
-else:
+if HEADLESS:
+    # Bots never draw, so skip the window and the texture pack
     w, h = map(int, saved_resolution.split('x'))
     SCREEN_WIDTH = w
     SCREEN_HEIGHT = h
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+else:
+    if saved_fullscreen:
+        screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        # Get actual fullscreen resolution
+        info = pygame.display.Info()
+        SCREEN_WIDTH = info.current_w
+        SCREEN_HEIGHT = info.current_h
+    else:
+        w, h = map(int, saved_resolution.split('x'))
+        SCREEN_WIDTH = w
+        SCREEN_HEIGHT = h
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 
-pygame.display.set_caption("NightTree Client - AuguPlatformer")
+    pygame.display.set_caption("NightTree Client - AuguPlatformer")
 
-# Load texture pack
-try:
-    load_texture_pack(settings.get("texture_pack", "default"))
-except:
-    print("Could not load texture pack, using colors")
+    # Load texture pack
+    try:
+        load_texture_pack(settings.get("texture_pack", "default"))
+    except:
+        print("Could not load texture pack, using colors")
 
     # Load the Modifications
-try:
-    load_texture_pack(settings.get("modified_files", "default"))
-except:
-    print("Could not load the modifications, using default files")
+    try:
+        load_texture_pack(settings.get("modified_files", "default"))
+    except:
+        print("Could not load the modifications, using default files")
 
 # =========================
 # PLAYER ID SAFE
@@ -610,20 +821,44 @@ def save_servers(servers):
 
 servers = load_servers()
 
+# =========================
+# WORLD CACHE
+# =========================
+def safe_filename(name):
+    """Keep a server address or world name usable as a file name"""
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+def world_chunk_hashes(world):
+    """{"cx,cy": crc32} for every chunk, hashed the same way as the server"""
+    hashes = {}
+    height = len(world)
+    width = len(world[0]) if world else 0
+    for cy in range(0, height, CHUNK_SIZE):
+        for cx in range(0, width, CHUNK_SIZE):
+            rows = [row[cx:cx + CHUNK_SIZE] for row in world[cy:cy + CHUNK_SIZE]]
+            data = "\n".join(",".join(row) for row in rows).encode()
+            hashes[f"{cx // CHUNK_SIZE},{cy // CHUNK_SIZE}"] = zlib.crc32(data)
+    return hashes
+
 # =========================
 # TCP CLIENT
 # =========================
 class ServerConnection:
-    def __init__(self, ip, port, password=""):
+    def __init__(self, ip, port, password="", player_id=None, color=None):
         self.ip = ip
         self.port = port
         self.password = password
+        self.player_id = player_id or PLAYER_ID
+        self.color = color
         self.sock = None
+        self.codec = StreamCodec()  # Fresh for every socket, compression state does not survive a reconnect
+        self.reader = None  # FrameReader for sock
         self.connected = False
         self.player_level = 0
         self.server_name = ""
         self.motd = ""
         self.world = []
+        self.tiles = None  # physics.TileMap kept in sync with world
         self.players = {}  # other_pid -> (x, y)
         self.player_colors = {}  # other_pid -> color
         self.player_x = 10
@@ -636,54 +871,97 @@ class ServerConnection:
         self.respawn_flag = False
         self.max_players = 10
         self.current_players = 0
+        self.stats = NetStats()
+        self.send_lock = threading.Lock()
+        # Latency, in seconds (None until the server answers a ping)
+        self.rtt = None
+        self.rtt_jitter = 0.0
+        self.last_pong = 0
+        self.player_pings = {}  # pid -> RTT in ms, as measured by the server
+        self.players_version = 0  # Bumped whenever the TAB list would look different
+        self.features = set()  # Protocol extensions the server agreed to
+        self.slot_seq = 0  # Last move_slot we sent
+        self.slot_update_seq = 0  # Last slot_update we applied
+        self.edit_seq = 0  # Last break/place we predicted
+        self.pending_edits = {}  # seq -> what to undo if the server rejects the edit
+        # Session resume after a dropped connection
+        self.resume_token = None
+        self.world_version = 0  # Version of the last block change we have seen
+        self.reconnecting = False
+        # On-disk world cache, see load_world_cache
+        self.world_name = None
+        self.cached_world = None  # (world name, rows) loaded for the current login
+        # Set once the welcome arrived or the connection ended, whichever comes first
+        self.ready = threading.Event()
+        self.closed = False  # close() was called, a connect still in flight should give up
+        # UDP side channel for movement, see start_udp
+        self.udp_sock = None
+        self.udp_offer = None  # (token, port) from the welcome, used once we start moving
+        self.udp_token = None
+        self.udp_ready = False  # The server answered our hello, moves go over UDP
+        self.udp_seq_out = 0
+        self.udp_seq_in = 0
+        self.udp_stale = 0  # Datagrams dropped because a newer one already arrived
 
     def connect(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(5)
             self.sock.connect((self.ip, self.port))
+            # Every packet is a whole message already, don't let Nagle hold it back
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.codec = StreamCodec()
+            self.reader = FrameReader(self.sock, MAX_WELCOME_SIZE)
             
             # Send login packet with password and color
-            send_msg(self.sock, {
-                "type": "login",
-                "id": PLAYER_ID,
-                "password": self.password,
-                "color": appearance.get("player_color", "blue")
-            })
+            send_msg(self.sock, self.login_packet(), self.stats, self.codec)
             
             # Remove timeout for ongoing communication
             self.sock.settimeout(None)
             
             self.connected = True
+            if self.closed:
+                # Cancelled while we were connecting, close() may have run before connected was set
+                self.close()
+                self.ready.set()
+                return False
             threading.Thread(target=self.listen_server, daemon=True).start()
+            threading.Thread(target=self.heartbeat, daemon=True).start()
             return True
         except Exception as e:
             print(f"Connection error: {e}")
             self.connected = False
+            self.ready.set()
             return False
+    
+    def connect_async(self):
+        """Connect and log in on a background thread, wait on self.ready for the result"""
+        threading.Thread(target=self.connect, daemon=True).start()
 
     def listen_server(self):
         while self.connected:
             try:
-                msg = recv_msg(self.sock)
+                msg = recv_msg(self.reader, self.stats, self.codec)
                 if not msg:
-                    print("Connection closed by server")
+                    if self.resume_session():
+                        continue
+                    if self.connected:
+                        print("Connection closed by server")
                     self.connected = False
                     break
                 
+                # Latency probes skip the rest of the dispatch
+                if msg.get("type") == "ping":
+                    self.send({"type": "pong", "t": msg.get("t")})
+                    continue
+                elif msg.get("type") == "pong":
+                    self.update_rtt(time.monotonic() - msg.get("t", 0))
+                    continue
+                
                 # Process the message
                 if msg.get("type") == "welcome":
-                    self.server_name = msg.get("server", "")
-                    self.motd = msg.get("motd", "")
-                    self.world = msg.get("world", [])
-                    self.player_x = msg.get("x", 10)
-                    self.player_y = msg.get("y", 3)
-                    self.hotbar = msg.get("hotbar", [None] * 7)
-                    self.inventory = msg.get("inventory", [None] * 21)  # Receive inventory!
-                    self.player_level = msg.get("level", 0)
-                    self.max_players = msg.get("max_players", 10)
-                    self.current_players = msg.get("current_players", 1)
-                    print(f"Received welcome: world size {len(self.world)}x{len(self.world[0]) if self.world else 0}")
+                    self.apply_welcome(msg)
+                    self.reader.max_size = MAX_FRAME_SIZE
                 
                 elif msg.get("type") == "respawn":
                     self.player_x = msg.get("x", 10)
@@ -702,9 +980,8 @@ class ServerConnection:
                 
                 elif msg.get("type") == "update_block":
                     x, y = msg.get("x"), msg.get("y")
-                    block = msg.get("block")
-                    if 0 <= y < len(self.world) and 0 <= x < len(self.world[0]):
-                        self.world[y][x] = block
+                    self.world_version = max(self.world_version, msg.get("v", 0))
+                    self.set_block(x, y, msg.get("block"))
                 
                 elif msg.get("type") == "player_join":
                     pid = msg.get("id")
@@ -712,17 +989,21 @@ class ServerConnection:
                     color = msg.get("color", "blue")
                     self.players[pid] = (x, y)
                     self.player_colors[pid] = color
+                    self.players_version += 1
                     print(f"Player {pid} joined at ({x}, {y}) with color {color}")
                 
                 elif msg.get("type") == "player_move":
                     pid = msg.get("id")
                     x, y = msg.get("x"), msg.get("y")
+                    if pid not in self.players:
+                        self.players_version += 1
                     self.players[pid] = (x, y)
                 
                 elif msg.get("type") == "player_color":
                     pid = msg.get("id")
                     color = msg.get("color", "blue")
                     self.player_colors[pid] = color
+                    self.players_version += 1
                     print(f"Player {pid} changed color to {color}")
                 
                 elif msg.get("type") == "player_leave":
@@ -731,14 +1012,41 @@ class ServerConnection:
                         del self.players[pid]
                     if pid in self.player_colors:
                         del self.player_colors[pid]
+                    self.players_version += 1
                     print(f"Player {pid} left")
                 
+                elif msg.get("type") == "player_pings":
+                    self.player_pings = msg.get("pings", {})
+                
                 elif msg.get("type") == "hotbar_update":
                     self.hotbar = msg.get("hotbar", [None] * 7)
                 
                 elif msg.get("type") == "inventory_update":
                     self.inventory = msg.get("inventory", [None] * 21)
                 
+                elif msg.get("type") == "slot_update":
+                    # Only the slots that changed, newest first wins
+                    if msg.get("seq", 0) > self.slot_update_seq:
+                        self.slot_update_seq = msg.get("seq", 0)
+                        self.apply_slots(msg.get("slots", {}))
+                        # The server has not seen our newer edits yet, predict them again
+                        for seq, edit in list(self.pending_edits.items()):
+                            if seq > msg.get("edit", 0) and edit["slot"] is not None and "h" + str(edit["slot"]) in msg.get("slots", {}):
+                                self.predict_slot_use(edit["slot"])
+                
+                elif msg.get("type") == "block_ack":
+                    edit = self.pending_edits.pop(msg.get("seq"), None)
+                    if edit is not None and not msg.get("ok"):
+                        # Misprediction: put back what the server says is there
+                        print(f"Server rejected block edit {msg.get('seq')} at ({edit['x']}, {edit['y']})")
+                        self.set_block(edit["x"], edit["y"], msg.get("block", edit["block"]))
+                        self.apply_slots(msg.get("slots", {}))
+                
+                elif msg.get("type") == "slot_ack":
+                    if not msg.get("ok"):
+                        print(f"Server rejected slot move {msg.get('seq')}")
+                        self.apply_slots(msg.get("slots", {}))
+                
                 elif msg.get("type") == "disconnect":
                     reason = msg.get("reason", "Disconnected")
                     self.disconnect_reason = reason
@@ -747,52 +1055,423 @@ class ServerConnection:
                     break
                     
             except Exception as e:
-                print(f"Listen error: {e}")
+                if self.connected and self.resume_session():
+                    continue
+                if self.connected:
+                    print(f"Listen error: {e}")
                 self.connected = False
                 break
+        
+        # Nobody should keep waiting for a welcome that will never come
+        self.ready.set()
+
+    def login_packet(self, resume=False):
+        packet = {
+            "type": "login",
+            "id": self.player_id,
+            "password": self.password,
+            "color": self.color or appearance.get("player_color", "blue"),
+            "features": CLIENT_FEATURES
+        }
+        if resume:
+            packet["resume"] = {"token": self.resume_token, "world_version": self.world_version}
+        else:
+            self.cached_world = self.load_world_cache()
+            if self.cached_world:
+                name, rows = self.cached_world
+                packet["chunk_cache"] = {"world": name, "hashes": world_chunk_hashes(rows)}
+        return packet
+    
+    def apply_welcome(self, msg):
+        """Take over the state from a welcome packet, full or resumed"""
+        self.server_name = msg.get("server", "")
+        self.motd = msg.get("motd", "")
+        if msg.get("resumed"):
+            # Undo predictions the old connection never got answers for, then catch up
+            for seq in sorted(self.pending_edits, reverse=True):
+                edit = self.pending_edits[seq]
+                self.set_block(edit["x"], edit["y"], edit["block"])
+            self.pending_edits.clear()
+            for x, y, block in msg.get("edits", []):
+                self.set_block(x, y, block)
+            # The server sends everyone again right after the welcome
+            self.players.clear()
+            self.player_colors.clear()
+            self.players_version += 1
+            print(f"Resumed session: {len(msg.get('edits', []))} block changes missed")
+        else:
+            if "chunks" in msg:
+                world = self.world_from_chunks(msg)
+            else:
+                world = msg.get("world", [])
+            self.cached_world = None
+            self.tiles = physics.TileMap(world)
+            self.world = world
+            print(f"Received welcome: world size {len(self.world)}x{len(self.world[0]) if self.world else 0}")
+        self.world_version = msg.get("world_version", 0)
+        self.world_name = msg.get("world_name")
+        self.resume_token = msg.get("resume_token")
+        self.slot_update_seq = 0
+        self.player_x = msg.get("x", 10)
+        self.player_y = msg.get("y", 3)
+        self.hotbar = msg.get("hotbar", [None] * 7)
+        self.inventory = msg.get("inventory", [None] * 21)  # Receive inventory!
+        self.player_level = msg.get("level", 0)
+        self.max_players = msg.get("max_players", 10)
+        self.current_players = msg.get("current_players", 1)
+        self.features = set(msg.get("features", []))
+        if "zlib" in self.features:
+            self.codec.enable()
+        self.udp_ready = False
+        if "udp" in self.features and msg.get("udp_token"):
+            self.udp_offer = (msg["udp_token"], msg.get("udp_port", self.port))
+        self.ready.set()
+    
+    def world_cache_path(self, world_name=None):
+        """world_cache/<ip>_<port>/<world>.json, or the server's folder without a world name"""
+        folder = os.path.join(WORLD_CACHE_DIR, safe_filename(f"{self.ip}_{self.port}"))
+        if world_name is None:
+            return folder
+        return os.path.join(folder, safe_filename(world_name) + ".json")
+    
+    def load_world_cache(self):
+        """Most recently saved world for this server as (world name, rows), or None"""
+        folder = self.world_cache_path()
+        try:
+            names = [n for n in os.listdir(folder) if n.endswith(".json")]
+            newest = max(names, key=lambda n: os.path.getmtime(os.path.join(folder, n)))
+            with open(os.path.join(folder, newest)) as f:
+                data = json.load(f)
+            return data["name"], data["world"]
+        except:
+            return None
+    
+    def save_world_cache(self):
+        """Write the current world to disk for the next join"""
+        if not self.world or not self.world_name or "world_chunks" not in self.features:
+            return
+        path = self.world_cache_path(self.world_name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"name": self.world_name, "world": self.world}, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save world cache: {e}")
+    
+    def world_from_chunks(self, msg):
+        """Rebuild the world from the cached copy plus the chunks the server sent"""
+        width, height = msg.get("world_size", [0, 0])
+        cached = self.cached_world[1] if self.cached_world else []
+        if len(cached) == height and all(len(row) == width for row in cached):
+            world = [list(row) for row in cached]
+        else:
+            # The world was resized: chunks whose hash matched are not sent, so keep the cached
+            # blocks where the old and new grids overlap (stale chunks are overwritten below)
+            world = [["air"] * width for _ in range(height)]
+            for y, row in enumerate(cached[:height]):
+                overlap = row[:width]
+                world[y][:len(overlap)] = overlap
+        chunks = msg["chunks"]
+        for key, rows in chunks.items():
+            cx, cy = (int(n) for n in key.split(","))
+            x0 = cx * CHUNK_SIZE
+            for dy, row in enumerate(rows):
+                world[cy * CHUNK_SIZE + dy][x0:x0 + len(row)] = row
+        total = ((width + CHUNK_SIZE - 1) // CHUNK_SIZE) * ((height + CHUNK_SIZE - 1) // CHUNK_SIZE)
+        print(f"World cache: {total - len(chunks)}/{total} chunks up to date")
+        return world
+    
+    def resume_session(self):
+        """Reconnect after the connection dropped, returns True once we are back in"""
+        if not self.resume_token or not self.connected:
+            return False
+        print("Connection lost, trying to resume the session...")
+        self.reconnecting = True
+        try:
+            self.sock.close()
+        except:
+            pass
+        
+        deadline = time.monotonic() + RESUME_TIMEOUT
+        while self.connected and time.monotonic() < deadline:
+            try:
+                sock = socket.create_connection((self.ip, self.port), timeout=2)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                codec = StreamCodec()
+                send_msg(sock, self.login_packet(resume=True), self.stats, codec)
+                reader = FrameReader(sock, MAX_WELCOME_SIZE)
+                msg = recv_msg(reader, self.stats, codec)
+                if msg and msg.get("type") == "welcome":
+                    reader.max_size = MAX_FRAME_SIZE
+                    sock.settimeout(None)
+                    with self.send_lock:
+                        self.sock = sock
+                        self.codec = codec
+                        self.reader = reader
+                    self.apply_welcome(msg)
+                    self.last_pong = time.monotonic()
+                    self.reconnecting = False
+                    return True
+                sock.close()
+                if msg and msg.get("type") == "disconnect":
+                    self.disconnect_reason = msg.get("reason", "Disconnected")
+                    break
+            except OSError:
+                pass
+            time.sleep(RESUME_RETRY)
+        
+        self.reconnecting = False
+        self.disconnect_reason = self.disconnect_reason or "Connection lost"
+        return False
+
+    def send(self, packet):
+        """Send one packet, serialized with the other sending threads"""
+        if self.reconnecting:
+            return False  # Dropped, listen_server is busy resuming
+        try:
+            with self.send_lock:
+                send_msg(self.sock, packet, self.stats, self.codec)
+            return True
+        except:
+            if self.resume_token:
+                # Wake listen_server, which tries to resume before giving up
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            else:
+                self.connected = False
+            return False
 
     def send_chat(self, message):
         if self.connected:
             packet = {"type": "chat", "message": message}
-            try:
-                send_msg(self.sock, packet)
-            except:
-                self.connected = False
+            self.send(packet)
 
     def send_position(self, x, y):
         if self.connected:
             current_time = time.time()
             if current_time - self.last_position_send > 0.05:  # Send max 20 times per second
                 packet = {"type": "move", "x": x, "y": y}
-                try:
-                    send_msg(self.sock, packet)
+                if self.udp_ready and not self.reconnecting:
+                    sent = self.send_udp(packet)
+                else:
+                    sent = self.send(packet)
+                if sent:
                     self.last_position_send = current_time
-                except:
-                    self.connected = False
+                if self.udp_offer:
+                    # After the first move so the server counts us as playing, and server list pings never open it
+                    self.start_udp(*self.udp_offer)
+                    self.udp_offer = None
 
     def break_block(self, x, y):
         if self.connected:
             packet = {"type": "break_block", "x": x, "y": y}
-            try:
-                send_msg(self.sock, packet)
-            except:
-                self.connected = False
+            if "block_ack" in self.features:
+                # Same rule as the server: air and bedrock cannot be broken
+                if self.world[y][x] in ("air", "bedrock"):
+                    return
+                packet["seq"] = self.predict_edit(x, y, "air")
+            self.send(packet)
 
     def place_block(self, x, y, slot):
         if self.connected:
             packet = {"type": "place_block", "x": x, "y": y, "slot": slot}
-            try:
-                send_msg(self.sock, packet)
-            except:
-                self.connected = False
+            if "block_ack" in self.features:
+                # Same rules as the server: only into air or ladders, from a filled slot
+                if self.world[y][x] not in ("air", "ladder") or self.hotbar[slot] is None:
+                    return
+                packet["seq"] = self.predict_edit(x, y, self.hotbar[slot]["block"], slot)
+            self.send(packet)
+    
+    def set_block(self, x, y, block):
+        """Change one block in the world and the collision map"""
+        if 0 <= y < len(self.world) and 0 <= x < len(self.world[0]):
+            self.world[y][x] = block
+            self.tiles.set_block(x, y, block)
+    
+    def predict_edit(self, x, y, block, slot=None):
+        """Apply a break/place locally before the server confirms it, returns its seq"""
+        self.edit_seq += 1
+        self.pending_edits[self.edit_seq] = {"x": x, "y": y, "block": self.world[y][x], "slot": slot}
+        self.set_block(x, y, block)
+        if slot is not None:
+            self.predict_slot_use(slot)
+        return self.edit_seq
+    
+    def predict_slot_use(self, slot):
+        """Take one item out of a hotbar slot"""
+        item = self.hotbar[slot]
+        if item is None:
+            return
+        # Copy so the server's item (and any undo) is left alone
+        item = dict(item, count=item["count"] - 1)
+        self.hotbar[slot] = item if item["count"] > 0 else None
 
     def update_color(self, color):
         if self.connected:
             packet = {"type": "update_color", "color": color}
+            self.send(packet)
+    
+    def heartbeat(self):
+        """Ping the server every PING_INTERVAL and drop it if pongs stop coming"""
+        while self.connected:
+            self.send({"type": "ping", "t": time.monotonic()})
+            # Older servers never answer, so only time out once a pong was seen
+            if self.rtt is not None and not self.reconnecting and time.monotonic() - self.last_pong > PING_TIMEOUT:
+                print("Server stopped answering pings")
+                self.disconnect_reason = "Timed out"
+                self.last_pong = time.monotonic()
+                # Wakes listen_server, which tries to resume before giving up
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            time.sleep(PING_INTERVAL)
+    
+    def start_udp(self, token, port):
+        """Open the movement side channel and say hello until the server answers"""
+        self.udp_token = token
+        self.udp_ready = False
+        self.udp_seq_in = 0  # The server counts from zero for every token
+        try:
+            if self.udp_sock is None:
+                self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.udp_sock.connect((self.ip, port))
+                threading.Thread(target=self.listen_udp, daemon=True).start()
+        except OSError as e:
+            print(f"UDP channel unavailable: {e}")
+            return
+        threading.Thread(target=self.udp_hello, args=(token,), daemon=True).start()
+    
+    def udp_hello(self, token):
+        for _ in range(UDP_HELLO_TRIES):
+            if self.udp_ready or token != self.udp_token or not self.connected:
+                return
+            self.send_udp({"type": "hello"})
+            time.sleep(UDP_HELLO_INTERVAL)
+        if not self.udp_ready and token == self.udp_token:
+            print("No answer over UDP, movement stays on TCP")
+    
+    def send_udp(self, packet):
+        """Send one sequence-numbered datagram, lost ones are simply superseded by the next"""
+        self.udp_seq_out += 1
+        if random.random() < UDP_SIMULATED_LOSS:
+            return True
+        data = json.dumps(dict(packet, t=self.udp_token, s=self.udp_seq_out)).encode('utf-8')
+        try:
+            self.udp_sock.send(data)
+            return True
+        except OSError:
+            return False
+    
+    def listen_udp(self):
+        while not self.closed:
+            try:
+                data = self.udp_sock.recv(2048)
+            except ConnectionResetError:
+                continue  # ICMP port unreachable on Windows, the server may come back
+            except OSError:
+                break
+            if random.random() < UDP_SIMULATED_LOSS:
+                continue
+            try:
+                msg = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            seq = msg.get("s", 0)
+            if seq <= self.udp_seq_in:
+                self.udp_stale += 1
+                continue
+            self.udp_seq_in = seq
+            
+            if msg.get("type") == "hello":
+                if not self.udp_ready:
+                    print("UDP channel open, movement goes over UDP")
+                self.udp_ready = True
+            elif msg.get("type") == "player_move":
+                # Joins and leaves stay on TCP, a late datagram must not bring back a player who left
+                pid = msg.get("id")
+                if pid in self.players:
+                    self.players[pid] = (msg.get("x"), msg.get("y"))
+    
+    def update_rtt(self, sample):
+        """Smooth RTT and jitter the way TCP does (RFC 6298)"""
+        self.last_pong = time.monotonic()
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_jitter = sample / 2
+        else:
+            self.rtt_jitter += (abs(self.rtt - sample) - self.rtt_jitter) / 4
+            self.rtt += (sample - self.rtt) / 8
+    
+    def ping_ms(self):
+        """Smoothed RTT in whole milliseconds, or None"""
+        return None if self.rtt is None else int(self.rtt * 1000)
+    
+    def pending_bytes(self):
+        """Bytes the OS has received but listen_server has not read yet"""
+        if fcntl is None or not self.connected:
+            return None
+        try:
+            raw = fcntl.ioctl(self.sock.fileno(), termios.FIONREAD, b"\0\0\0\0")
+            return struct.unpack("I", raw)[0]
+        except OSError:
+            return None
+    
+    def close(self):
+        """Drop the connection to the server"""
+        self.closed = True
+        if self.connected:
+            # Clear the flag first so listen_server treats the close as expected
+            self.connected = False
+            # Tell the server this is a real quit, not a dropped connection
+            self.send({"type": "leave"})
+        if self.sock:
+            # Also unblocks a connect or login still in flight
             try:
-                send_msg(self.sock, packet)
+                self.sock.close()
             except:
-                self.connected = False
+                pass
+        self.udp_ready = False
+        if self.udp_sock:
+            self.udp_sock.close()
+    
+    def slot_list(self, kind):
+        """The hotbar or inventory list for a slot kind ('hotbar' / 'inventory')"""
+        if kind == 'hotbar':
+            return self.hotbar
+        if not hasattr(self, 'inventory'):
+            self.inventory = [None] * 21
+        return self.inventory
+    
+    def apply_slots(self, slots):
+        """Overwrite slots from a {"h3": item, "i12": None} delta"""
+        for ref, item in slots.items():
+            try:
+                slot_list = self.slot_list('hotbar' if ref[0] == 'h' else 'inventory')
+                index = int(ref[1:])
+                if 0 <= index < len(slot_list):
+                    slot_list[index] = item
+            except (ValueError, IndexError):
+                pass
+    
+    def move_slot(self, src, dst):
+        """Tell the server about a drag&drop swap, already applied locally"""
+        if src == dst or not self.connected:
+            return
+        if "slot_delta" not in self.features:
+            # Old servers only understand the full lists
+            self.sync_inventory()
+            return
+        self.slot_seq += 1
+        self.send({
+            "type": "move_slot",
+            "seq": self.slot_seq,
+            "from": src[0][0] + str(src[1]),
+            "to": dst[0][0] + str(dst[1]),
+        })
     
     def sync_inventory(self):
         """Sync inventory and hotbar to server after drag&drop"""
@@ -802,10 +1481,7 @@ class ServerConnection:
                 "hotbar": self.hotbar,
                 "inventory": self.inventory
             }
-            try:
-                send_msg(self.sock, packet)
-            except:
-                self.connected = False
+            self.send(packet)
 
 # =========================
 # BUTTON CLASS
@@ -831,6 +1507,20 @@ class Button:
     def is_clicked(self, pos):
         return self.rect.collidepoint(pos)
 
+# =========================
+# MENU LOOP HELPERS
+# =========================
+def wait_menu_events(timeout=MENU_WAKE_MS):
+    """Sleep until there is input or the timeout passes, returns every pending event"""
+    event = pygame.event.wait(timeout)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+def menu_layout():
+    """Changes whenever menu buttons have to be rebuilt (resolution or language)"""
+    return (SCREEN_WIDTH, SCREEN_HEIGHT, settings.get("language", DEFAULT_LANGUAGE))
+
 # =========================
 # MESSAGE BOX
 # =========================
@@ -838,24 +1528,32 @@ def show_message(title, message):
     """Show a message box"""
     ok_btn = Button((SCREEN_WIDTH//2 - 50, SCREEN_HEIGHT//2 + 50, 100, 40), "OK")
     
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        screen.fill((30, 30, 30))
-        
-        # Title
-        title_surf = pygame.font.SysFont("Arial", 28, bold=True).render(title, True, WHITE)
-        screen.blit(title_surf, (SCREEN_WIDTH//2 - title_surf.get_width()//2, SCREEN_HEIGHT//2 - 80))
-        
-        # Message
-        msg_surf = font.render(message, True, WHITE)
-        screen.blit(msg_surf, (SCREEN_WIDTH//2 - msg_surf.get_width()//2, SCREEN_HEIGHT//2 - 20))
-        
-        ok_btn.update(mouse_pos)
-        ok_btn.draw(screen)
+        if dirty:
+            profiler.begin_frame("show_message")
+            ok_btn.update(pygame.mouse.get_pos())
+            
+            screen.fill((30, 30, 30))
+            
+            # Title
+            title_surf = dialog_title_font.render(title, True, WHITE)
+            screen.blit(title_surf, (SCREEN_WIDTH//2 - title_surf.get_width()//2, SCREEN_HEIGHT//2 - 80))
+            
+            # Message
+            msg_surf = font.render(message, True, WHITE)
+            screen.blit(msg_surf, (SCREEN_WIDTH//2 - msg_surf.get_width()//2, SCREEN_HEIGHT//2 - 20))
+            
+            ok_btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -864,42 +1562,58 @@ def show_message(title, message):
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN or event.key == pygame.K_ESCAPE:
                     running = False
+
+# =========================
+# CONNECTING SCREEN
+# =========================
+def connecting_screen(conn, address):
+    """Wait for a connect_async() to finish. Returns 'ok', 'failed' or 'cancelled'"""
+    cancel_btn = Button((SCREEN_WIDTH//2 - 60, SCREEN_HEIGHT//2 + 50, 120, 40), t("cancel"))
+    started = time.time()
+    
+    while True:
+        profiler.begin_frame("connecting_screen")
+        cancel_btn.update(pygame.mouse.get_pos())
+        
+        screen.fill((30, 30, 30))
+        
+        # Title with animated dots
+        dots = "." * (int((time.time() - started) * 3) % 4)
+        title_surf = dialog_title_font.render(f"{t('connecting')} {address}{dots}", True, WHITE)
+        screen.blit(title_surf, (SCREEN_WIDTH//2 - title_surf.get_width()//2, SCREEN_HEIGHT//2 - 40))
+        
+        cancel_btn.draw(screen)
         
+        profiler.mark("draw")
         pygame.display.flip()
-        clock.tick(FPS)
+        profiler.mark("flip")
+        
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                conn.close()
+                return "cancelled"
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if cancel_btn.is_clicked(event.pos):
+                    conn.close()
+                    return "cancelled"
+        
+        # Sleeps like clock.tick, but returns the moment the welcome (or a failure) arrives
+        if conn.ready.wait(1 / 30):
+            return "ok" if conn.connected and conn.world else "failed"
 
 # =========================
 # TEXT INPUT BOX
 # =========================
 def text_input_box(prompt, width=400, height=35):
     input_text = ""
-    active = True
     box_rect = pygame.Rect(SCREEN_WIDTH//2 - width//2, SCREEN_HEIGHT//2, width, height)
     ok_btn = Button((SCREEN_WIDTH//2 - 110, SCREEN_HEIGHT//2 + 60, 100, 40), t("ok"))
     cancel_btn = Button((SCREEN_WIDTH//2 + 10, SCREEN_HEIGHT//2 + 60, 100, 40), t("back"))
     
-    while active:
+    while True:
+        profiler.begin_frame("text_input_box")
         mouse_pos = pygame.mouse.get_pos()
         
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return None
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RETURN:
-                    return input_text
-                elif event.key == pygame.K_ESCAPE:
-                    return None
-                elif event.key == pygame.K_BACKSPACE:
-                    input_text = input_text[:-1]
-                else:
-                    if len(input_text) < 50:
-                        input_text += event.unicode
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if ok_btn.is_clicked(event.pos):
-                    return input_text
-                elif cancel_btn.is_clicked(event.pos):
-                    return None
-        
         screen.fill((50,50,50))
         
         # Draw prompt
@@ -925,42 +1639,76 @@ def text_input_box(prompt, width=400, height=35):
         ok_btn.draw(screen)
         cancel_btn.draw(screen)
         
+        profiler.mark("draw")
         pygame.display.flip()
-        clock.tick(FPS)
+        profiler.mark("flip")
+        
+        # Always redraw after waking up, the cursor blinks on the timeout
+        for event in wait_menu_events():
+            if event.type == pygame.QUIT:
+                return None
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_RETURN:
+                    return input_text
+                elif event.key == pygame.K_ESCAPE:
+                    return None
+                elif event.key == pygame.K_BACKSPACE:
+                    input_text = input_text[:-1]
+                else:
+                    if len(input_text) < 50:
+                        input_text += event.unicode
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if ok_btn.is_clicked(event.pos):
+                    return input_text
+                elif cancel_btn.is_clicked(event.pos):
+                    return None
 
 # =========================
 # MAIN MENU
 # =========================
 def main_menu():
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Create buttons dynamically centered
-        play_btn = Button((SCREEN_WIDTH//2-75, 250, 150, 50), t("play"))
-        mod_btn = Button((SCREEN_WIDTH//2-75, 290, 150, 50), t("mods"))
-        settings_btn = Button((SCREEN_WIDTH//2-75, 320, 150, 50), t("settings"))
-        exit_btn = Button((SCREEN_WIDTH//2-75, 390, 150, 50), t("exit"))
-        
-        screen.fill((0, 0, 26))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 48, bold=True).render(t("title"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 120))
-        
-        # Player ID
-        id_text = font.render(f"{t('your_id')}: {PLAYER_ID}", True, (255, 255, 100))
-        screen.blit(id_text, (SCREEN_WIDTH//2 - id_text.get_width()//2, 180))
-        
-        play_btn.update(mouse_pos)
-        settings_btn.update(mouse_pos)
-        exit_btn.update(mouse_pos)
-        
-        play_btn.draw(screen)
-        settings_btn.draw(screen)
-        exit_btn.draw(screen)
+        # Create buttons centered for the current resolution and language
+        if layout != menu_layout():
+            layout = menu_layout()
+            play_btn = Button((SCREEN_WIDTH//2-75, 250, 150, 50), t("play"))
+            mod_btn = Button((SCREEN_WIDTH//2-75, 290, 150, 50), t("mods"))
+            settings_btn = Button((SCREEN_WIDTH//2-75, 320, 150, 50), t("settings"))
+            exit_btn = Button((SCREEN_WIDTH//2-75, 390, 150, 50), t("exit"))
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("main_menu")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            screen.fill((0, 0, 26))
+            
+            # Title
+            title = big_title_font.render(t("title"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 120))
+            
+            # Player ID
+            id_text = font.render(f"{t('your_id')}: {PLAYER_ID}", True, (255, 255, 100))
+            screen.blit(id_text, (SCREEN_WIDTH//2 - id_text.get_width()//2, 180))
+            
+            play_btn.update(mouse_pos)
+            settings_btn.update(mouse_pos)
+            exit_btn.update(mouse_pos)
+            
+            play_btn.draw(screen)
+            settings_btn.draw(screen)
+            exit_btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 return False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -970,9 +1718,6 @@ def main_menu():
                     settings_screen()
                 elif exit_btn.is_clicked(event.pos):
                     return False
-        
-        pygame.display.flip()
-        clock.tick(FPS)
     
     return False
 
@@ -980,39 +1725,43 @@ def main_menu():
 # SETTINGS SCREEN
 # =========================
 def settings_screen():
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Create buttons dynamically centered
-        controls_btn = Button((SCREEN_WIDTH//2-100, 150, 200, 50), t("controls"))
-        appearance_btn = Button((SCREEN_WIDTH//2-100, 210, 200, 50), t("appearance"))
-        video_btn = Button((SCREEN_WIDTH//2-100, 270, 200, 50), t("video"))
-        texture_btn = Button((SCREEN_WIDTH//2-100, 330, 200, 50), t("texture_packs"))
-        language_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("language"))
-        back_btn = Button((50, 30, 100, 40), t("back"))
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("settings"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        controls_btn.update(mouse_pos)
-        appearance_btn.update(mouse_pos)
-        video_btn.update(mouse_pos)
-        texture_btn.update(mouse_pos)
-        language_btn.update(mouse_pos)
-        back_btn.update(mouse_pos)
-        
-        controls_btn.draw(screen)
-        appearance_btn.draw(screen)
-        video_btn.draw(screen)
-        texture_btn.draw(screen)
-        language_btn.draw(screen)
-        back_btn.draw(screen)
+        # Create buttons centered for the current resolution and language
+        if layout != menu_layout():
+            layout = menu_layout()
+            controls_btn = Button((SCREEN_WIDTH//2-100, 150, 200, 50), t("controls"))
+            appearance_btn = Button((SCREEN_WIDTH//2-100, 210, 200, 50), t("appearance"))
+            video_btn = Button((SCREEN_WIDTH//2-100, 270, 200, 50), t("video"))
+            texture_btn = Button((SCREEN_WIDTH//2-100, 330, 200, 50), t("texture_packs"))
+            language_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("language"))
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            buttons = [controls_btn, appearance_btn, video_btn, texture_btn, language_btn, back_btn]
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("settings_screen")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            screen.fill((30,30,30))
+            
+            # Title
+            title = title_font.render(t("settings"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            for btn in buttons:
+                btn.update(mouse_pos)
+                btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1028,9 +1777,6 @@ def settings_screen():
                     texture_packs_screen()
                 elif language_btn.is_clicked(event.pos):
                     language_screen()
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # CONTROLS SCREEN
@@ -1045,9 +1791,6 @@ def get_key_name(key):
 def controls_screen():
     global controls
     
-    back_btn = Button((50, 30, 100, 40), t("back"))
-    reset_btn = Button((SCREEN_WIDTH - 150, 30, 100, 40), t("reset"))
-    
     control_actions = [
         ("move_left", "move_left"),
         ("move_right", "move_right"),
@@ -1059,60 +1802,72 @@ def controls_screen():
         ("place_block", "place_block"),
         ("inventory", "inventory"),
         ("player_list", "player_list"),
+        ("debug_overlay", "debug_overlay"),
+        ("profiler_dump", "profiler_dump"),
     ]
     
     waiting_for_key = None
     
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Update button texts
-        back_btn.text = t("back")
-        reset_btn.text = t("reset")
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("controls"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        back_btn.update(mouse_pos)
-        reset_btn.update(mouse_pos)
-        
-        back_btn.draw(screen)
-        reset_btn.draw(screen)
-        
-        # Draw controls
-        y = 180
-        control_btns = []
-        for action, translation_key in control_actions:
-            # Action name (translated)
-            action_text = font.render(t(translation_key) + ":", True, WHITE)
-            screen.blit(action_text, (200, y))
-            
-            # Current key button
-            current_key = controls.get(action, DEFAULT_CONTROLS[action])
-            key_name = get_key_name(current_key)
-            
-            if waiting_for_key == action:
-                key_name = t("press_key")
-                color = (255, 200, 100)
-            else:
-                color = (150, 150, 200)
+        if layout != menu_layout():
+            layout = menu_layout()
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            reset_btn = Button((SCREEN_WIDTH - 150, 30, 100, 40), t("reset"))
+            # One key button per action, texts are filled in when drawing
+            control_btns = []
+            y = 180
+            for action, translation_key in control_actions:
+                control_btns.append((Button((500, y - 5, 150, 35), ""), action, translation_key, y))
+                y += 45
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("controls_screen")
+            mouse_pos = pygame.mouse.get_pos()
             
-            key_btn = Button((500, y - 5, 150, 35), key_name, color)
-            key_btn.update(mouse_pos)
-            key_btn.draw(screen)
-            control_btns.append((key_btn, action))
+            screen.fill((30,30,30))
             
-            y += 60
-        
-        if waiting_for_key:
-            info_text = small_font.render(t("press_esc_cancel"), True, (255, 255, 100))
-            screen.blit(info_text, (SCREEN_WIDTH//2 - info_text.get_width()//2, SCREEN_HEIGHT - 50))
+            # Title
+            title = title_font.render(t("controls"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            back_btn.update(mouse_pos)
+            reset_btn.update(mouse_pos)
+            
+            back_btn.draw(screen)
+            reset_btn.draw(screen)
+            
+            # Draw controls
+            for key_btn, action, translation_key, y in control_btns:
+                # Action name (translated)
+                action_text = font.render(t(translation_key) + ":", True, WHITE)
+                screen.blit(action_text, (200, y))
+                
+                # Current key button
+                if waiting_for_key == action:
+                    key_btn.text = t("press_key")
+                    key_btn.color = (255, 200, 100)
+                else:
+                    key_btn.text = get_key_name(controls.get(action, DEFAULT_CONTROLS[action]))
+                    key_btn.color = (150, 150, 200)
+                
+                key_btn.update(mouse_pos)
+                key_btn.draw(screen)
+            
+            if waiting_for_key:
+                info_text = small_font.render(t("press_esc_cancel"), True, (255, 255, 100))
+                screen.blit(info_text, (SCREEN_WIDTH//2 - info_text.get_width()//2, SCREEN_HEIGHT - 50))
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1130,7 +1885,7 @@ def controls_screen():
                         settings["controls"] = controls
                         save_settings(settings)
                     else:
-                        for btn, action in control_btns:
+                        for btn, action, _, _ in control_btns:
                             if btn.is_clicked(event.pos):
                                 waiting_for_key = action
                                 break
@@ -1143,9 +1898,6 @@ def controls_screen():
                         settings["controls"] = controls
                         save_settings(settings)
                         waiting_for_key = None
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # LANGUAGE SCREEN
@@ -1153,47 +1905,57 @@ def controls_screen():
 def language_screen():
     global settings
     
-    back_btn = Button((50, 30, 100, 40), t("back"))
-    
     languages = [
         ("english", "English"),
         ("italiano", "Italiano"),
         ("espanol", "Español"),
     ]
     
-    lang_buttons = []
-    start_y = 200
-    for i, (lang_code, lang_name) in enumerate(languages):
-        btn = Button((SCREEN_WIDTH//2 - 150, start_y + i * 80, 300, 60), lang_name)
-        lang_buttons.append((lang_code, lang_name, btn))
-    
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        back_btn.text = t("back")
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("language"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        back_btn.update(mouse_pos)
-        back_btn.draw(screen)
-        
-        # Draw language buttons
-        current_lang = settings.get("language", DEFAULT_LANGUAGE)
-        for lang_code, lang_name, btn in lang_buttons:
-            # Highlight selected language
-            if lang_code == current_lang:
-                highlight = pygame.Rect(btn.rect.x - 5, btn.rect.y - 5, btn.rect.width + 10, btn.rect.height + 10)
-                pygame.draw.rect(screen, (255, 255, 100), highlight, 4)
+        if layout != menu_layout():
+            layout = menu_layout()
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            lang_buttons = []
+            start_y = 200
+            for i, (lang_code, lang_name) in enumerate(languages):
+                btn = Button((SCREEN_WIDTH//2 - 150, start_y + i * 80, 300, 60), lang_name)
+                lang_buttons.append((lang_code, lang_name, btn))
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("language_screen")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            screen.fill((30,30,30))
+            
+            # Title
+            title = title_font.render(t("language"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            back_btn.update(mouse_pos)
+            back_btn.draw(screen)
             
-            btn.update(mouse_pos)
-            btn.draw(screen)
+            # Draw language buttons
+            current_lang = settings.get("language", DEFAULT_LANGUAGE)
+            for lang_code, lang_name, btn in lang_buttons:
+                # Highlight selected language
+                if lang_code == current_lang:
+                    highlight = pygame.Rect(btn.rect.x - 5, btn.rect.y - 5, btn.rect.width + 10, btn.rect.height + 10)
+                    pygame.draw.rect(screen, (255, 255, 100), highlight, 4)
+                
+                btn.update(mouse_pos)
+                btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1204,9 +1966,6 @@ def language_screen():
                         if btn.is_clicked(event.pos):
                             settings["language"] = lang_code
                             save_settings(settings)
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # VIDEO SETTINGS SCREEN
@@ -1227,54 +1986,66 @@ def video_settings_screen():
     current_res = settings.get("video", DEFAULT_VIDEO).get("resolution", "1200x700")
     current_fullscreen = settings.get("video", DEFAULT_VIDEO).get("fullscreen", False)
     
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Create buttons dynamically centered
-        back_btn = Button((50, 30, 100, 40), t("back"))
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("video"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        back_btn.update(mouse_pos)
-        back_btn.draw(screen)
-        
-        # Resolution selection - centered
-        y = 180
-        res_label = font.render(t("resolution") + ":", True, WHITE)
-        screen.blit(res_label, (SCREEN_WIDTH//2 - 200, y))
-        
-        res_buttons = []
-        for i, res in enumerate(resolutions):
-            btn_y = y + 40 + i * 45
-            is_current = (res == current_res)
-            color = (100, 255, 100) if is_current else (200, 200, 200)
-            btn = Button((SCREEN_WIDTH//2 - 75, btn_y, 150, 35), res, color)
-            btn.update(mouse_pos)
-            btn.draw(screen)
-            res_buttons.append((btn, res))
-        
-        # Fullscreen toggle - centered
-        fs_y = y + 40 + len(resolutions) * 45 + 20
-        fs_label = font.render(t("fullscreen") + ":", True, WHITE)
-        screen.blit(fs_label, (SCREEN_WIDTH//2 - 200, fs_y))
-        
-        fs_text = t("fullscreen") if current_fullscreen else t("windowed")
-        fs_color = (100, 255, 100) if current_fullscreen else (255, 200, 100)
-        fs_btn = Button((SCREEN_WIDTH//2 - 75, fs_y - 5, 150, 35), fs_text, fs_color)
-        fs_btn.update(mouse_pos)
-        fs_btn.draw(screen)
-        
-        # Apply button - centered
-        apply_btn = Button((SCREEN_WIDTH//2 - 75, SCREEN_HEIGHT - 100, 150, 50), t("apply"), (100, 200, 255))
-        apply_btn.update(mouse_pos)
-        apply_btn.draw(screen)
+        # Create buttons centered for the current resolution and language
+        if layout != menu_layout():
+            layout = menu_layout()
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            y = 180
+            res_buttons = []
+            for i, res in enumerate(resolutions):
+                btn_y = y + 40 + i * 45
+                res_buttons.append((Button((SCREEN_WIDTH//2 - 75, btn_y, 150, 35), res), res))
+            fs_y = y + 40 + len(resolutions) * 45 + 20
+            fs_btn = Button((SCREEN_WIDTH//2 - 75, fs_y - 5, 150, 35), "")
+            apply_btn = Button((SCREEN_WIDTH//2 - 75, SCREEN_HEIGHT - 100, 150, 50), t("apply"), (100, 200, 255))
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("video_settings_screen")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            screen.fill((30,30,30))
+            
+            # Title
+            title = title_font.render(t("video"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            back_btn.update(mouse_pos)
+            back_btn.draw(screen)
+            
+            # Resolution selection - centered
+            res_label = font.render(t("resolution") + ":", True, WHITE)
+            screen.blit(res_label, (SCREEN_WIDTH//2 - 200, y))
+            
+            for btn, res in res_buttons:
+                btn.color = (100, 255, 100) if res == current_res else (200, 200, 200)
+                btn.update(mouse_pos)
+                btn.draw(screen)
+            
+            # Fullscreen toggle - centered
+            fs_label = font.render(t("fullscreen") + ":", True, WHITE)
+            screen.blit(fs_label, (SCREEN_WIDTH//2 - 200, fs_y))
+            
+            fs_btn.text = t("fullscreen") if current_fullscreen else t("windowed")
+            fs_btn.color = (100, 255, 100) if current_fullscreen else (255, 200, 100)
+            fs_btn.update(mouse_pos)
+            fs_btn.draw(screen)
+            
+            # Apply button - centered
+            apply_btn.update(mouse_pos)
+            apply_btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1307,9 +2078,6 @@ def video_settings_screen():
                     for btn, res in res_buttons:
                         if btn.is_clicked(event.pos):
                             current_res = res
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # TEXTURE PACKS SCREEN
@@ -1317,48 +2085,55 @@ def video_settings_screen():
 def texture_packs_screen():
     global settings, current_texture_pack
     
-    back_btn = Button((50, 30, 100, 40), t("back"))
-    
     # Get available packs
-    packs = get_available_texture_packs()
-    if not packs:
-        packs = ["default"]  # At least show default
+    found_packs = get_available_texture_packs()
+    packs = found_packs or ["default"]  # At least show default
     
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        back_btn.text = t("back")
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("texture_packs"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        back_btn.update(mouse_pos)
-        back_btn.draw(screen)
-        
-        # Pack buttons
-        y = 180
-        pack_buttons = []
-        for pack_name in packs:
-            is_current = (pack_name == current_texture_pack)
-            color = (100, 255, 100) if is_current else (200, 200, 200)
+        if layout != menu_layout():
+            layout = menu_layout()
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            pack_buttons = []
+            y = 180
+            for pack_name in packs:
+                pack_buttons.append((Button((SCREEN_WIDTH//2 - 150, y, 300, 50), pack_name.capitalize()), pack_name))
+                y += 60
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("texture_packs_screen")
+            mouse_pos = pygame.mouse.get_pos()
             
-            btn = Button((SCREEN_WIDTH//2 - 150, y, 300, 50), pack_name.capitalize(), color)
-            btn.update(mouse_pos)
-            btn.draw(screen)
-            pack_buttons.append((btn, pack_name))
+            screen.fill((30,30,30))
             
-            y += 60
-        
-        # Info text
-        if not get_available_texture_packs():
-            info_text = small_font.render("if you want more textures grab your /textures folder and shove yo textures in it", True, (255, 200, 100))
-            screen.blit(info_text, (SCREEN_WIDTH//2 - info_text.get_width()//2, y + 20))
+            # Title
+            title = title_font.render(t("texture_packs"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            back_btn.update(mouse_pos)
+            back_btn.draw(screen)
+            
+            # Pack buttons
+            for btn, pack_name in pack_buttons:
+                btn.color = (100, 255, 100) if pack_name == current_texture_pack else (200, 200, 200)
+                btn.update(mouse_pos)
+                btn.draw(screen)
+            
+            # Info text
+            if not found_packs:
+                info_text = small_font.render("if you want more textures grab your /textures folder and shove yo textures in it", True, (255, 200, 100))
+                screen.blit(info_text, (SCREEN_WIDTH//2 - info_text.get_width()//2, y + 20))
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1368,9 +2143,6 @@ def texture_packs_screen():
                     for btn, pack_name in pack_buttons:
                         if btn.is_clicked(event.pos):
                             load_texture_pack(pack_name)
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # APPEARANCE SCREEN
@@ -1378,63 +2150,74 @@ def texture_packs_screen():
 def appearance_screen(active_connection=None):
     global appearance
     
-    back_btn = Button((50, 30, 100, 40), t("back"))
-    
-    color_buttons = []
-    colors = list(PLAYER_COLORS.keys())
-    cols = 4
-    start_x = SCREEN_WIDTH // 2 - (cols * 100) // 2
-    start_y = 200
-    
-    for i, color_name in enumerate(colors):
-        row = i // cols
-        col = i % cols
-        x = start_x + col * 100
-        y = start_y + row * 100  # Increased from 80 to 100 for more spacing
-        color_buttons.append((color_name, pygame.Rect(x, y, 80, 60)))
-    
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        back_btn.text = t("back")
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("player_appearance"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        back_btn.update(mouse_pos)
-        back_btn.draw(screen)
-        
-        # Draw color selection buttons with preview
-        for color_name, rect in color_buttons:
-            # Draw button background
-            if appearance.get("player_color") == color_name:
-                pygame.draw.rect(screen, (255, 255, 100), rect.inflate(6, 6))
+        if layout != menu_layout():
+            layout = menu_layout()
+            back_btn = Button((50, 30, 100, 40), t("back"))
             
-            # Draw player preview
-            body_color = PLAYER_COLORS[color_name]
-            head_color = PINK
+            color_buttons = []
+            colors = list(PLAYER_COLORS.keys())
+            cols = 4
+            start_x = SCREEN_WIDTH // 2 - (cols * 100) // 2
+            start_y = 200
             
-            # Body (bottom half)
-            body_rect = pygame.Rect(rect.x + 20, rect.y + 30, 40, 30)
-            pygame.draw.rect(screen, body_color, body_rect)
-            pygame.draw.rect(screen, BLACK, body_rect, 2)
+            for i, color_name in enumerate(colors):
+                row = i // cols
+                col = i % cols
+                x = start_x + col * 100
+                y = start_y + row * 100  # Increased from 80 to 100 for more spacing
+                color_buttons.append((color_name, pygame.Rect(x, y, 80, 60)))
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("appearance_screen")
+            mouse_pos = pygame.mouse.get_pos()
             
-            # Head (top half)
-            head_rect = pygame.Rect(rect.x + 20, rect.y, 40, 30)
-            pygame.draw.rect(screen, head_color, head_rect)
-            pygame.draw.rect(screen, BLACK, head_rect, 2)
+            screen.fill((30,30,30))
             
-            # Color name (translated if available)
-            translated_name = t(color_name) if t(color_name) != color_name else color_name.capitalize()
-            name_text = small_font.render(translated_name, True, WHITE)
-            name_rect = name_text.get_rect(center=(rect.centerx, rect.bottom + 18))  # Increased spacing
-            screen.blit(name_text, name_rect)
+            # Title
+            title = title_font.render(t("player_appearance"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            back_btn.update(mouse_pos)
+            back_btn.draw(screen)
+            
+            # Draw color selection buttons with preview
+            for color_name, rect in color_buttons:
+                # Draw button background
+                if appearance.get("player_color") == color_name:
+                    pygame.draw.rect(screen, (255, 255, 100), rect.inflate(6, 6))
+                
+                # Draw player preview
+                body_color = PLAYER_COLORS[color_name]
+                head_color = PINK
+                
+                # Body (bottom half)
+                body_rect = pygame.Rect(rect.x + 20, rect.y + 30, 40, 30)
+                pygame.draw.rect(screen, body_color, body_rect)
+                pygame.draw.rect(screen, BLACK, body_rect, 2)
+                
+                # Head (top half)
+                head_rect = pygame.Rect(rect.x + 20, rect.y, 40, 30)
+                pygame.draw.rect(screen, head_color, head_rect)
+                pygame.draw.rect(screen, BLACK, head_rect, 2)
+                
+                # Color name (translated if available)
+                translated_name = t(color_name) if t(color_name) != color_name else color_name.capitalize()
+                name_text = small_font.render(translated_name, True, WHITE)
+                name_rect = name_text.get_rect(center=(rect.centerx, rect.bottom + 18))  # Increased spacing
+                screen.blit(name_text, name_rect)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1450,70 +2233,81 @@ def appearance_screen(active_connection=None):
                             # If connected to a server, send color update
                             if active_connection and active_connection.connected:
                                 active_connection.update_color(color_name)
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # SERVER LIST SCREEN
 # =========================
 def server_list_screen():
-    add_btn = Button((SCREEN_WIDTH-220, 30, 150, 40), t("add_server"))
-    refresh_btn = Button((SCREEN_WIDTH-220, 80, 150, 40), t("refresh"))
-    back_btn = Button((50, 30, 100, 40), t("back"))
-    
+    layout = None
+    dirty = True
     running = True
+    refreshing = []  # Servers still being refreshed, see poll_refresh
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Update button texts
-        add_btn.text = t("add_server")
-        refresh_btn.text = t("refresh")
-        back_btn.text = t("back")
-        
-        screen.fill((50,50,80))
-        
-        # Player ID
-        id_label = font.render(f"{t('your_id')}: {PLAYER_ID}", True, (255,255,100))
-        screen.blit(id_label, (SCREEN_WIDTH//2 - id_label.get_width()//2, 10))
-        
-        add_btn.update(mouse_pos)
-        refresh_btn.update(mouse_pos)
-        back_btn.update(mouse_pos)
-        
-        add_btn.draw(screen)
-        refresh_btn.draw(screen)
-        back_btn.draw(screen)
-
-        # Lista server
-        y = 150
-        server_buttons = []
-        for s in servers:
-            name = s.get('name', '???')
-            motd = s.get('motd', '???')
-            current = s.get('current', 0)
-            max_p = s.get('max', 10)
+        if refreshing:
+            refreshing, changed = poll_refresh(refreshing)
+            dirty = dirty or changed
+        
+        # Rebuild buttons when the resolution, language or server count changes
+        if layout != (menu_layout(), len(servers)):
+            layout = (menu_layout(), len(servers))
+            add_btn = Button((SCREEN_WIDTH-220, 30, 150, 40), t("add_server"))
+            refresh_btn = Button((SCREEN_WIDTH-220, 80, 150, 40), t("refresh"))
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            server_buttons = []
+            y = 150
+            for s in servers:
+                join_btn = Button((SCREEN_WIDTH-380, y-3, 70, 30), t("join"), (100, 200, 100))
+                modify_btn = Button((SCREEN_WIDTH-300, y-3, 70, 30), t("modify"), (200, 200, 100))
+                delete_btn = Button((SCREEN_WIDTH-220, y-3, 70, 30), t("delete"), (200, 100, 100))
+                server_buttons.append((join_btn, modify_btn, delete_btn, s, y))
+                y += 40
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("server_list_screen")
+            mouse_pos = pygame.mouse.get_pos()
             
-            text = f"{s['ip']}:{s['port']} - {name} - {motd} - {current}/{max_p}"
-            label = small_font.render(text, True, WHITE)
-            screen.blit(label, (50, y))
+            screen.fill((50,50,80))
             
-            join_btn = Button((SCREEN_WIDTH-380, y-3, 70, 30), t("join"), (100, 200, 100))
-            modify_btn = Button((SCREEN_WIDTH-300, y-3, 70, 30), t("modify"), (200, 200, 100))
-            delete_btn = Button((SCREEN_WIDTH-220, y-3, 70, 30), t("delete"), (200, 100, 100))
+            # Player ID
+            id_label = font.render(f"{t('your_id')}: {PLAYER_ID}", True, (255,255,100))
+            screen.blit(id_label, (SCREEN_WIDTH//2 - id_label.get_width()//2, 10))
             
-            join_btn.update(mouse_pos)
-            modify_btn.update(mouse_pos)
-            delete_btn.update(mouse_pos)
+            add_btn.update(mouse_pos)
+            refresh_btn.update(mouse_pos)
+            back_btn.update(mouse_pos)
             
-            join_btn.draw(screen)
-            modify_btn.draw(screen)
-            delete_btn.draw(screen)
+            add_btn.draw(screen)
+            refresh_btn.draw(screen)
+            back_btn.draw(screen)
             
-            server_buttons.append((join_btn, modify_btn, delete_btn, s))
-            y += 40
-
-        for event in pygame.event.get():
+            # Lista server
+            for join_btn, modify_btn, delete_btn, s, y in server_buttons:
+                name = s.get('name', '???')
+                motd = s.get('motd', '???')
+                current = s.get('current', 0)
+                max_p = s.get('max', 10)
+                
+                text = f"{s['ip']}:{s['port']} - {name} - {motd} - {current}/{max_p}"
+                label = small_font.render(text, True, WHITE)
+                screen.blit(label, (50, y))
+                
+                join_btn.update(mouse_pos)
+                modify_btn.update(mouse_pos)
+                delete_btn.update(mouse_pos)
+                
+                join_btn.draw(screen)
+                modify_btn.draw(screen)
+                delete_btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
+        
+        # Wake up often enough to show refresh results as they come in
+        for event in wait_menu_events(REFRESH_POLL_MS if refreshing else MENU_WAKE_MS):
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1522,21 +2316,22 @@ def server_list_screen():
                 elif add_btn.is_clicked(event.pos):
                     add_server_dialog()
                 elif refresh_btn.is_clicked(event.pos):
-                    refresh_servers()
+                    if not refreshing:
+                        refreshing = refresh_servers()
                 else:
-                    for join_btn, modify_btn, delete_btn, s in server_buttons:
+                    for join_btn, modify_btn, delete_btn, s, _ in server_buttons:
                         if join_btn.is_clicked(event.pos):
                             try:
                                 conn = ServerConnection(s['ip'], s['port'], s.get('password', '0'))
-                                if conn.connect():
-                                    # Wait a bit to see if we get disconnected
-                                    time.sleep(0.3)
-                                    if not conn.connected:
-                                        # We were disconnected, show reason
-                                        reason = conn.disconnect_reason or t("connection_failed")
-                                        show_message(t("connection_failed"), reason)
-                                    else:
-                                        game_screen(conn)
+                                conn.connect_async()
+                                result = connecting_screen(conn, f"{s['ip']}:{s['port']}")
+                                if result == "ok":
+                                    game_screen(conn)
+                                elif result == "cancelled":
+                                    pass
+                                elif conn.disconnect_reason:
+                                    # We were disconnected, show reason
+                                    show_message(t("connection_failed"), conn.disconnect_reason)
                                 else:
                                     s['name'] = t("offline")
                                     s['motd'] = t("server_offline")
@@ -1553,9 +2348,9 @@ def server_list_screen():
                         elif delete_btn.is_clicked(event.pos):
                             servers.remove(s)
                             save_servers(servers)
-
-        pygame.display.flip()
-        clock.tick(FPS)
+    
+    for _, conn, _ in refreshing:
+        conn.close()
 
 def add_server_dialog():
     ip = text_input_box(t("enter_ip"))
@@ -1595,38 +2390,36 @@ def modify_server_dialog(s):
     save_servers(servers)
 
 def refresh_servers():
+    """Start logging in to every saved server in the background, returns [(server, conn, deadline)] to poll"""
+    pending = []
     for s in servers:
-        try:
-            conn = ServerConnection(s['ip'], s['port'], s.get('password', ''))
-            if conn.connect():
-                # Wait for welcome packet with server info
-                max_wait = 2.0
-                elapsed = 0
-                while (not conn.server_name or not conn.motd) and elapsed < max_wait:
-                    time.sleep(0.1)
-                    elapsed += 0.1
-                
-                s['name'] = conn.server_name if conn.server_name else "???"
-                s['motd'] = conn.motd if conn.motd else "???"
-                s['current'] = conn.current_players
-                s['max'] = conn.max_players
-                try:
-                    conn.sock.close()
-                except:
-                    pass
-                conn.connected = False
-            else:
-                s['name'] = "Offline"
-                s['motd'] = "Server is offline"
-                s['current'] = 0
-                s['max'] = 0
-        except Exception as e:
-            print(f"Refresh error for {s['ip']}:{s['port']}: {e}")
-            s['name'] = "Offline"
-            s['motd'] = "Server is offline"
+        conn = ServerConnection(s['ip'], s['port'], s.get('password', ''))
+        conn.connect_async()
+        pending.append((s, conn, time.monotonic() + REFRESH_TIMEOUT))
+    return pending
+
+def poll_refresh(pending):
+    """Fill in the servers whose refresh finished, returns (still pending, whether anything changed)"""
+    waiting = []
+    for s, conn, deadline in pending:
+        if not conn.ready.is_set() and time.monotonic() < deadline:
+            waiting.append((s, conn, deadline))
+            continue
+        if conn.connected:
+            s['name'] = conn.server_name if conn.server_name else "???"
+            s['motd'] = conn.motd if conn.motd else "???"
+            s['current'] = conn.current_players
+            s['max'] = conn.max_players
+        else:
+            s['name'] = t("offline")
+            s['motd'] = t("server_offline")
             s['current'] = 0
             s['max'] = 0
-    save_servers(servers)
+        conn.close()
+    changed = len(waiting) != len(pending)
+    if changed and not waiting:
+        save_servers(servers)
+    return waiting, changed
 
 # =========================
 # IN-GAME MENU
@@ -1636,33 +2429,49 @@ def ingame_menu(conn):
     running = True
     result = "resume"
     
+    # Keep the last game frame so the overlay does not stack up on every redraw
+    background = screen.copy()
+    
+    layout = None
+    dirty = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Create buttons dynamically
-        resume_btn = Button((SCREEN_WIDTH//2-100, 250, 200, 50), t("resume"))
-        settings_btn = Button((SCREEN_WIDTH//2-100, 320, 200, 50), t("settings"))
-        quit_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("disconnect"))
-        
-        # Just draw overlay - game frame should still be visible
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-        overlay.set_alpha(180)  # Semi-transparent
-        overlay.fill((0, 0, 0))
-        screen.blit(overlay, (0, 0))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 48, bold=True).render(t("paused"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 150))
-        
-        resume_btn.update(mouse_pos)
-        settings_btn.update(mouse_pos)
-        quit_btn.update(mouse_pos)
-        
-        resume_btn.draw(screen)
-        settings_btn.draw(screen)
-        quit_btn.draw(screen)
+        if layout != menu_layout():
+            layout = menu_layout()
+            resume_btn = Button((SCREEN_WIDTH//2-100, 250, 200, 50), t("resume"))
+            settings_btn = Button((SCREEN_WIDTH//2-100, 320, 200, 50), t("settings"))
+            quit_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("disconnect"))
+            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            overlay.set_alpha(180)  # Semi-transparent
+            overlay.fill((0, 0, 0))
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("ingame_menu")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            # Game frame should still be visible under the overlay
+            screen.blit(background, (0, 0))
+            screen.blit(overlay, (0, 0))
+            
+            # Title
+            title = big_title_font.render(t("paused"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 150))
+            
+            resume_btn.update(mouse_pos)
+            settings_btn.update(mouse_pos)
+            quit_btn.update(mouse_pos)
+            
+            resume_btn.draw(screen)
+            settings_btn.draw(screen)
+            quit_btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 result = "quit"
                 running = False
@@ -1681,47 +2490,48 @@ def ingame_menu(conn):
                 elif quit_btn.is_clicked(event.pos):
                     result = "quit"
                     running = False
-        
-        pygame.display.flip()
-        clock.tick(FPS)
     
     return result
 
 def ingame_settings(conn):
     """Settings menu accessible during gameplay"""
+    layout = None
+    dirty = True
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        # Create buttons dynamically centered
-        controls_btn = Button((SCREEN_WIDTH//2-100, 150, 200, 50), t("controls"))
-        appearance_btn = Button((SCREEN_WIDTH//2-100, 210, 200, 50), t("appearance"))
-        video_btn = Button((SCREEN_WIDTH//2-100, 270, 200, 50), t("video"))
-        texture_btn = Button((SCREEN_WIDTH//2-100, 330, 200, 50), t("texture_packs"))
-        language_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("language"))
-        back_btn = Button((50, 30, 100, 40), t("back"))
-        
-        screen.fill((30,30,30))
-        
-        # Title
-        title = pygame.font.SysFont("Arial", 36, bold=True).render(t("settings"), True, WHITE)
-        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
-        
-        controls_btn.update(mouse_pos)
-        appearance_btn.update(mouse_pos)
-        video_btn.update(mouse_pos)
-        texture_btn.update(mouse_pos)
-        language_btn.update(mouse_pos)
-        back_btn.update(mouse_pos)
-        
-        controls_btn.draw(screen)
-        appearance_btn.draw(screen)
-        video_btn.draw(screen)
-        texture_btn.draw(screen)
-        language_btn.draw(screen)
-        back_btn.draw(screen)
+        # Create buttons centered for the current resolution and language
+        if layout != menu_layout():
+            layout = menu_layout()
+            controls_btn = Button((SCREEN_WIDTH//2-100, 150, 200, 50), t("controls"))
+            appearance_btn = Button((SCREEN_WIDTH//2-100, 210, 200, 50), t("appearance"))
+            video_btn = Button((SCREEN_WIDTH//2-100, 270, 200, 50), t("video"))
+            texture_btn = Button((SCREEN_WIDTH//2-100, 330, 200, 50), t("texture_packs"))
+            language_btn = Button((SCREEN_WIDTH//2-100, 390, 200, 50), t("language"))
+            back_btn = Button((50, 30, 100, 40), t("back"))
+            buttons = [controls_btn, appearance_btn, video_btn, texture_btn, language_btn, back_btn]
+            dirty = True
+        
+        if dirty:
+            profiler.begin_frame("ingame_settings")
+            mouse_pos = pygame.mouse.get_pos()
+            
+            screen.fill((30,30,30))
+            
+            # Title
+            title = title_font.render(t("settings"), True, WHITE)
+            screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 80))
+            
+            for btn in buttons:
+                btn.update(mouse_pos)
+                btn.draw(screen)
+            
+            profiler.mark("draw")
+            pygame.display.flip()
+            profiler.mark("flip")
+            dirty = False
         
-        for event in pygame.event.get():
+        for event in wait_menu_events():
+            dirty = True
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.KEYDOWN:
@@ -1740,26 +2550,19 @@ def ingame_settings(conn):
                     texture_packs_screen()
                 elif language_btn.is_clicked(event.pos):
                     language_screen()
-        
-        pygame.display.flip()
-        clock.tick(FPS)
 
 # =========================
 # INVENTORY HUD
 # =========================
-def draw_inventory_hud(screen, conn, appearance_color, selected_slot, mouse_pos):
-    """Draw compact inventory HUD above hotbar with drag & drop"""
-    
-    # Inventory: 3 rows of 7 = 21 slots
-    if not hasattr(conn, 'inventory'):
-        conn.inventory = [None] * 21
-    
+# Slot rects are laid out once per resolution, the surface is rebuilt when what it shows changes
+inventory_hud_cache = {"layout": None, "rect": None, "slots": [], "key": None, "surface": None}
+
+def layout_inventory_hud():
+    """Screen rect of the HUD and (kind, index, rect) for every slot"""
     slot_size = 40
     spacing = 5
     
     # Calculate HUD position - same X as hotbar, extended upwards
-    hotbar_width = 7 * 50 + 20
-    hotbar_x = SCREEN_WIDTH // 2 - hotbar_width // 2
     hotbar_y = SCREEN_HEIGHT - 70
     
     # HUD dimensions
@@ -1770,121 +2573,142 @@ def draw_inventory_hud(screen, conn, appearance_color, selected_slot, mouse_pos)
     hud_x = SCREEN_WIDTH // 2 - hud_width // 2
     hud_y = hotbar_y - hud_height + 50  # Position so it ends where hotbar begins
     
+    # Start of slots
+    slots_start_y = hud_y + 30
+    slots_start_x = hud_x + 10
+    
+    # 3 rows of inventory
+    slots = []
+    for row in range(3):
+        for col in range(7):
+            slot_x = slots_start_x + col * (slot_size + spacing)
+            slot_y = slots_start_y + row * (slot_size + spacing)
+            slots.append(('inventory', row * 7 + col, pygame.Rect(slot_x, slot_y, slot_size, slot_size)))
+    
+    # Hotbar below inventory (integrated)
+    hotbar_y = slots_start_y + 3 * (slot_size + spacing) + 10
+    for i in range(7):
+        slot_x = slots_start_x + i * (slot_size + spacing)
+        slots.append(('hotbar', i, pygame.Rect(slot_x, hotbar_y, slot_size, slot_size)))
+    
+    return pygame.Rect(hud_x, hud_y, hud_width, hud_height), slots
+
+def render_inventory_hud(hud_rect, slots, items, appearance_color, selected_slot, hover):
+    """Composite the whole HUD into one surface"""
+    hud_width, hud_height = hud_rect.size
+    
     # Semi-transparent background
-    bg_surface = pygame.Surface((hud_width, hud_height))
-    bg_surface.set_alpha(220)
-    bg_surface.fill((40, 40, 40))
-    screen.blit(bg_surface, (hud_x, hud_y))
+    surf = pygame.Surface((hud_width, hud_height), pygame.SRCALPHA)
+    surf.fill((40, 40, 40, 220))
     
     # Border
-    pygame.draw.rect(screen, (200, 200, 200), (hud_x, hud_y, hud_width, hud_height), 2)
+    pygame.draw.rect(surf, (200, 200, 200), (0, 0, hud_width, hud_height), 2)
     
     # Header with player info
-    header_y = hud_y + 5
+    header_y = 5
     
     # Player ID (smaller)
     id_text = small_font.render(f"{PLAYER_ID}", True, (255, 255, 100))
-    screen.blit(id_text, (hud_x + 10, header_y))
+    surf.blit(id_text, (10, header_y))
     
     # Player preview (small)
-    preview_x = hud_x + hud_width - 40
+    preview_x = hud_width - 40
     preview_y = header_y
     body_color = PLAYER_COLORS.get(appearance_color, (0, 255, 255))
     
     # Tiny player preview
-    pygame.draw.rect(screen, body_color, (preview_x, preview_y + 10, 15, 10))
-    pygame.draw.rect(screen, BLACK, (preview_x, preview_y + 10, 15, 10), 1)
-    pygame.draw.rect(screen, PINK, (preview_x, preview_y, 15, 10))
-    pygame.draw.rect(screen, BLACK, (preview_x, preview_y, 15, 10), 1)
+    pygame.draw.rect(surf, body_color, (preview_x, preview_y + 10, 15, 10))
+    pygame.draw.rect(surf, BLACK, (preview_x, preview_y + 10, 15, 10), 1)
+    pygame.draw.rect(surf, PINK, (preview_x, preview_y, 15, 10))
+    pygame.draw.rect(surf, BLACK, (preview_x, preview_y, 15, 10), 1)
     
     # Inventory title
     inv_title = small_font.render(t("inventory"), True, WHITE)
-    screen.blit(inv_title, (hud_x + hud_width//2 - inv_title.get_width()//2, header_y))
-    
-    # Start of slots
-    slots_start_y = hud_y + 30
-    slots_start_x = hud_x + 10
-    
-    # Draw 3 rows of inventory
-    inventory_slots = []
-    for row in range(3):
-        for col in range(7):
-            idx = row * 7 + col
-            slot_x = slots_start_x + col * (slot_size + spacing)
-            slot_y = slots_start_y + row * (slot_size + spacing)
-            slot_rect = pygame.Rect(slot_x, slot_y, slot_size, slot_size)
-            
-            # Draw slot
-            pygame.draw.rect(screen, (60, 60, 60), slot_rect)
-            pygame.draw.rect(screen, (150, 150, 150), slot_rect, 1)
-            
-            # Draw item if exists
-            if conn.inventory[idx] is not None:
-                block_type = conn.inventory[idx]["block"]
-                count = conn.inventory[idx]["count"]
-                
-                # Draw block texture or color
-                texture = block_textures.get(block_type)
-                if texture:
-                    scaled_texture = pygame.transform.scale(texture, (slot_size - 6, slot_size - 6))
-                    screen.blit(scaled_texture, (slot_x + 3, slot_y + 3))
-                else:
-                    block_color = BLOCK_COLORS.get(block_type, GRAY)
-                    pygame.draw.rect(screen, block_color, (slot_x + 3, slot_y + 3, slot_size - 6, slot_size - 6))
-                
-                # Draw count
-                count_text = small_font.render(str(count), True, WHITE)
-                screen.blit(count_text, (slot_x + slot_size - 15, slot_y + slot_size - 15))
-            
-            inventory_slots.append(('inventory', idx, slot_rect))
-    
-    # Draw hotbar below inventory (integrated)
-    hotbar_y = slots_start_y + 3 * (slot_size + spacing) + 10
-    hotbar_slots = []
-    for i in range(7):
-        slot_x = slots_start_x + i * (slot_size + spacing)
-        slot_y = hotbar_y
-        slot_rect = pygame.Rect(slot_x, slot_y, slot_size, slot_size)
-        
-        # Draw slot with highlight if selected
-        if i == selected_slot:
-            pygame.draw.rect(screen, (255, 255, 100), slot_rect)
-            pygame.draw.rect(screen, (255, 200, 0), slot_rect, 2)
+    surf.blit(inv_title, (hud_width//2 - inv_title.get_width()//2, header_y))
+    
+    for (kind, idx, rect), item in zip(slots, items):
+        slot_rect = rect.move(-hud_rect.x, -hud_rect.y)
+        slot_size = slot_rect.width
+        
+        # Draw slot, hotbar slots are highlighted if selected
+        if kind == 'inventory':
+            pygame.draw.rect(surf, (60, 60, 60), slot_rect)
+            pygame.draw.rect(surf, (150, 150, 150), slot_rect, 1)
+        elif idx == selected_slot:
+            pygame.draw.rect(surf, (255, 255, 100), slot_rect)
+            pygame.draw.rect(surf, (255, 200, 0), slot_rect, 2)
         else:
-            pygame.draw.rect(screen, (80, 80, 50), slot_rect)
-            pygame.draw.rect(screen, (200, 200, 100), slot_rect, 1)
+            pygame.draw.rect(surf, (80, 80, 50), slot_rect)
+            pygame.draw.rect(surf, (200, 200, 100), slot_rect, 1)
+        
+        if (kind, idx) == hover:
+            pygame.draw.rect(surf, WHITE, slot_rect, 2)
         
         # Draw item if exists
-        if conn.hotbar[i] is not None:
-            block_type = conn.hotbar[i]["block"]
-            count = conn.hotbar[i]["count"]
+        if item is not None:
+            block_type, count = item
             
             # Draw block texture or color
-            texture = block_textures.get(block_type)
+            texture = get_scaled_texture(block_type, slot_size - 6)
             if texture:
-                scaled_texture = pygame.transform.scale(texture, (slot_size - 6, slot_size - 6))
-                screen.blit(scaled_texture, (slot_x + 3, slot_y + 3))
+                surf.blit(texture, (slot_rect.x + 3, slot_rect.y + 3))
             else:
                 block_color = BLOCK_COLORS.get(block_type, GRAY)
-                pygame.draw.rect(screen, block_color, (slot_x + 3, slot_y + 3, slot_size - 6, slot_size - 6))
+                pygame.draw.rect(surf, block_color, (slot_rect.x + 3, slot_rect.y + 3, slot_size - 6, slot_size - 6))
             
             # Draw count
             count_text = small_font.render(str(count), True, WHITE)
-            screen.blit(count_text, (slot_x + slot_size - 15, slot_y + slot_size - 15))
-        
-        hotbar_slots.append(('hotbar', i, slot_rect))
+            surf.blit(count_text, (slot_rect.x + slot_size - 15, slot_rect.y + slot_size - 15))
+    
+    return surf
+
+def draw_inventory_hud(screen, conn, appearance_color, selected_slot, mouse_pos):
+    """Draw compact inventory HUD above hotbar with drag & drop"""
+    
+    # Inventory: 3 rows of 7 = 21 slots
+    if not hasattr(conn, 'inventory'):
+        conn.inventory = [None] * 21
+    
+    cache = inventory_hud_cache
+    layout = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    if cache["layout"] != layout:
+        cache["rect"], cache["slots"] = layout_inventory_hud()
+        cache["layout"] = layout
+        cache["key"] = None
+    
+    # Snapshot of what the slots show, the lists are edited in place by drag & drop
+    items = tuple(
+        None if item is None else (item["block"], item["count"])
+        for item in conn.inventory[:21] + conn.hotbar[:7]
+    )
+    hover = None
+    for kind, idx, rect in cache["slots"]:
+        if rect.collidepoint(mouse_pos):
+            hover = (kind, idx)
+            break
+    
+    key = (items, appearance_color, selected_slot, hover, current_texture_pack, settings.get("language", DEFAULT_LANGUAGE))
+    if cache["key"] != key:
+        cache["surface"] = render_inventory_hud(cache["rect"], cache["slots"], items, appearance_color, selected_slot, hover)
+        cache["key"] = key
     
-    return inventory_slots + hotbar_slots
+    screen.blit(cache["surface"], cache["rect"])
+    return cache["slots"]
 
 # =========================
 # TAB PLAYER LIST
 # =========================
-def draw_player_list(screen, conn, local_player_id, appearance_color):
-    """Draw Minecraft-style player list when TAB is held"""
+# Composited pages of the list, rebuilt only when what they show changes
+# Pings change every few seconds, so they are drawn over the cached pages
+player_list_cache = {"key": None, "pages": [], "ping_texts": {}}
+PLAYER_LIST_PAGE_SECONDS = 3  # Lists taller than the screen flip pages this often
+
+def build_player_list_pages(conn, local_player_id, appearance_color):
+    """Render the player list into one (surface, ping slots) pair per page"""
     
     # Get all players (including self)
     all_players = [(local_player_id, appearance_color)]
-    for pid in conn.players.keys():
+    for pid in list(conn.players.keys()):
         player_color = conn.player_colors.get(pid, "blue")
         all_players.append((pid, player_color))
     
@@ -1901,104 +2725,325 @@ def draw_player_list(screen, conn, local_player_id, appearance_color):
     spacing_between = 5
     
     list_width = player_width + padding * 2
-    # Total height: title + players + footer + padding
-    list_height = title_height + (player_height + spacing_between) * player_count + footer_height + padding
-    
-    # Position: very high up (20px from top) and centered horizontally
-    list_x = SCREEN_WIDTH // 2 - list_width // 2
-    list_y = 20
     
-    # Semi-transparent background
-    bg_surface = pygame.Surface((list_width, list_height))
-    bg_surface.set_alpha(220)
-    bg_surface.fill((40, 40, 40))
-    screen.blit(bg_surface, (list_x, list_y))
+    # As many players per page as fit on screen (the list starts 20px from the top)
+    free_height = SCREEN_HEIGHT - 40 - title_height - footer_height - padding
+    per_page = max(1, free_height // (player_height + spacing_between))
+    page_count = (player_count + per_page - 1) // per_page
     
-    # Border
-    pygame.draw.rect(screen, (200, 200, 200), (list_x, list_y, list_width, list_height), 3)
+    # Entry backgrounds used to be blitted at alpha 150 over the list background
+    local_bg = (64, 87, 64)  # Green tint
+    other_bg = (52, 52, 52)
     
-    # Title
-    title_text = font.render(f"{t('players_online')} ({player_count})", True, WHITE)
-    screen.blit(title_text, (list_x + list_width // 2 - title_text.get_width() // 2, list_y + 10))
+    key_name = get_key_name(controls.get("player_list", pygame.K_TAB))
+    instr_text = small_font.render(f"{t('hold_to_view')} {key_name}", True, (180, 180, 180))
+    you_text = small_font.render(f"({t('you')})", True, (100, 255, 100))
     
-    # Draw each player
-    y_offset = list_y + title_height
+    # Mini player preview size, slightly smaller to fit better
+    preview_scale = 1.3
+    preview_height = 32 * preview_scale  # Total height (head + body)
     
-    for pid, color in all_players:
-        player_x = list_x + padding
-        player_y = y_offset
+    pages = []
+    for page in range(page_count):
+        entries = all_players[page * per_page:(page + 1) * per_page]
         
-        # Background for player entry
-        entry_bg = pygame.Surface((player_width, player_height))
-        entry_bg.set_alpha(150)
+        # Total height: title + players + footer + padding
+        list_height = title_height + (player_height + spacing_between) * len(entries) + footer_height + padding
         
-        # Highlight local player
-        if pid == local_player_id:
-            entry_bg.fill((80, 120, 80))  # Green tint
-        else:
-            entry_bg.fill((60, 60, 60))
+        # Semi-transparent background
+        surf = pygame.Surface((list_width, list_height), pygame.SRCALPHA)
+        surf.fill((40, 40, 40, 220))
         
-        screen.blit(entry_bg, (player_x, player_y))
-        pygame.draw.rect(screen, (150, 150, 150), (player_x, player_y, player_width, player_height), 1)
+        # Border
+        pygame.draw.rect(surf, (200, 200, 200), (0, 0, list_width, list_height), 3)
         
-        # Draw mini player preview (left side) - CENTERED VERTICALLY
-        preview_scale = 1.3  # Slightly smaller to fit better
-        preview_width = 13 * preview_scale
-        preview_height = 32 * preview_scale  # Total height (head + body)
-        
-        # Center the preview vertically in the entry box
-        preview_x = player_x + 10
-        preview_y = player_y + (player_height - preview_height) // 2
-        
-        body_color = PLAYER_COLORS.get(color, (0, 255, 255))
-        
-        # Body (lower half)
-        body_rect = pygame.Rect(preview_x, preview_y + 16*preview_scale, 13*preview_scale, 16*preview_scale)
-        pygame.draw.rect(screen, body_color, body_rect)
-        pygame.draw.rect(screen, BLACK, body_rect, 1)
-        
-        # Head (upper half)
-        head_rect = pygame.Rect(preview_x, preview_y, 13*preview_scale, 16*preview_scale)
-        pygame.draw.rect(screen, PINK, head_rect)
-        pygame.draw.rect(screen, BLACK, head_rect, 1)
-        
-        # Player ID (right side)
-        id_text = font.render(pid, True, WHITE)
-        text_x = player_x + 50
-        text_y = player_y + player_height // 2 - id_text.get_height() // 2
-        screen.blit(id_text, (text_x, text_y))
-        
-        # "YOU" indicator for local player
-        if pid == local_player_id:
-            you_text = small_font.render(f"({t('you')})", True, (100, 255, 100))
-            screen.blit(you_text, (player_x + player_width - 50, text_y + 3))
+        # Title
+        title = f"{t('players_online')} ({player_count})"
+        if page_count > 1:
+            title += f"  {page + 1}/{page_count}"
+        title_text = font.render(title, True, WHITE)
+        surf.blit(title_text, (list_width // 2 - title_text.get_width() // 2, 10))
+        
+        # Draw each player
+        player_y = title_height
+        ping_slots = []  # (pid, right edge, y) of each ping, relative to the page
+        for pid, color in entries:
+            player_x = padding
+            
+            # Background for player entry, highlight local player
+            entry_rect = (player_x, player_y, player_width, player_height)
+            surf.fill(local_bg if pid == local_player_id else other_bg, entry_rect)
+            pygame.draw.rect(surf, (150, 150, 150), entry_rect, 1)
+            
+            # Center the preview vertically in the entry box
+            preview_x = player_x + 10
+            preview_y = player_y + (player_height - preview_height) // 2
+            
+            body_color = PLAYER_COLORS.get(color, (0, 255, 255))
+            
+            # Body (lower half)
+            body_rect = pygame.Rect(preview_x, preview_y + 16*preview_scale, 13*preview_scale, 16*preview_scale)
+            pygame.draw.rect(surf, body_color, body_rect)
+            pygame.draw.rect(surf, BLACK, body_rect, 1)
+            
+            # Head (upper half)
+            head_rect = pygame.Rect(preview_x, preview_y, 13*preview_scale, 16*preview_scale)
+            pygame.draw.rect(surf, PINK, head_rect)
+            pygame.draw.rect(surf, BLACK, head_rect, 1)
+            
+            # Player ID (right side)
+            id_text = font.render(pid, True, WHITE)
+            text_y = player_y + player_height // 2 - id_text.get_height() // 2
+            surf.blit(id_text, (player_x + 50, text_y))
+            
+            # "YOU" indicator for local player
+            if pid == local_player_id:
+                surf.blit(you_text, (player_x + player_width - 50, text_y + 3))
+            
+            ping_slots.append((pid, player_x + player_width - 5, player_y + player_height - 16))
+            
+            player_y += player_height + spacing_between
         
-        y_offset += player_height + spacing_between
+        # Instructions at bottom - properly spaced below last player
+        surf.blit(instr_text, (list_width // 2 - instr_text.get_width() // 2, player_y + 3))
+        pages.append((surf, ping_slots))
     
-    # Instructions at bottom - properly spaced below last player
-    key_name = get_key_name(controls.get("player_list", pygame.K_TAB))
-    instr_text = small_font.render(f"{t('hold_to_view')} {key_name}", True, (180, 180, 180))
-    # Position footer text with proper spacing from last player
-    footer_y = list_y + title_height + (player_height + spacing_between) * player_count + 8
-    screen.blit(instr_text, (list_x + list_width // 2 - instr_text.get_width() // 2, footer_y))
+    return pages
+
+def draw_player_list(screen, conn, local_player_id, appearance_color):
+    """Draw Minecraft-style player list when TAB is held"""
+    key = (
+        conn.players_version, local_player_id, appearance_color,
+        SCREEN_WIDTH, SCREEN_HEIGHT, settings.get("language", DEFAULT_LANGUAGE),
+        controls.get("player_list", pygame.K_TAB),
+    )
+    if player_list_cache["key"] != key:
+        player_list_cache["pages"] = build_player_list_pages(conn, local_player_id, appearance_color)
+        player_list_cache["key"] = key
+    
+    pages = player_list_cache["pages"]
+    page, ping_slots = pages[int(time.time() / PLAYER_LIST_PAGE_SECONDS) % len(pages)]
+    
+    # Position: very high up (20px from top) and centered horizontally
+    page_x = SCREEN_WIDTH // 2 - page.get_width() // 2
+    screen.blit(page, (page_x, 20))
+    
+    # Ping (our own is measured locally, the others come from the server)
+    ping_texts = player_list_cache["ping_texts"]
+    if len(ping_texts) > 1000:
+        ping_texts.clear()
+    for pid, right, y in ping_slots:
+        ping = conn.ping_ms() if pid == local_player_id else conn.player_pings.get(pid)
+        if ping is None:
+            continue
+        ping_text = ping_texts.get(ping)
+        if ping_text is None:
+            ping_text = ping_texts[ping] = small_font.render(f"{ping} ms", True, (180, 180, 180))
+        screen.blit(ping_text, (page_x + right - ping_text.get_width(), 20 + y))
+
+# =========================
+# DEBUG OVERLAY
+# =========================
+class FrameProfiler:
+    """Per-frame section timings in a preallocated ring buffer, with CSV/JSONL export"""
+    MAX_SECTIONS = 16
+    
+    def __init__(self, size=1024):
+        self.size = size
+        # Section and loop names get a column/id the first time they are seen
+        self.sections = []
+        self.section_ids = {}
+        self.loops = []
+        self.loop_ids = {}
+        self.starts = array.array('d', bytes(8 * size))  # Wall clock start of each frame
+        self.frame_times = array.array('d', bytes(8 * size))  # Seconds
+        self.frame_loops = array.array('B', bytes(size))
+        self.samples = array.array('d', bytes(8 * size * self.MAX_SECTIONS))
+        self.smoothed = [0.0] * self.MAX_SECTIONS
+        self.empty_row = array.array('d', bytes(8 * self.MAX_SECTIONS))
+        self.index = 0
+        self.count = 0
+        self.frame_start = time.perf_counter()
+        self.last_mark = self.frame_start
+        self.cprofile = None
+        self.cprofile_frames_left = 0
+    
+    def begin_frame(self, loop="game"):
+        """Close the current frame and start a new row for the given loop"""
+        now = time.perf_counter()
+        self.frame_times[self.index] = now - self.frame_start
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size - 1)
+        
+        row = self.index * self.MAX_SECTIONS
+        self.samples[row:row + self.MAX_SECTIONS] = self.empty_row
+        if loop not in self.loop_ids:
+            self.loop_ids[loop] = len(self.loops)
+            self.loops.append(loop)
+        self.frame_loops[self.index] = self.loop_ids[loop]
+        self.starts[self.index] = time.time()
+        self.frame_start = now
+        self.last_mark = now
+        
+        if self.cprofile:
+            self.cprofile_frames_left -= 1
+            if self.cprofile_frames_left <= 0:
+                self.stop_cprofile()
+    
+    def mark(self, section):
+        """Close the section that started at the previous mark"""
+        now = time.perf_counter()
+        column = self.section_ids.get(section)
+        if column is None:
+            if len(self.sections) >= self.MAX_SECTIONS:
+                self.last_mark = now
+                return
+            column = self.section_ids[section] = len(self.sections)
+            self.sections.append(section)
+        elapsed = now - self.last_mark
+        self.samples[self.index * self.MAX_SECTIONS + column] += elapsed
+        self.smoothed[column] += (elapsed - self.smoothed[column]) * 0.1
+        self.last_mark = now
+    
+    def section_time(self, section):
+        """Smoothed time of a section, in seconds"""
+        column = self.section_ids.get(section)
+        return self.smoothed[column] if column is not None else 0.0
+    
+    def completed_rows(self, window=None):
+        """Ring indices of finished frames, oldest first"""
+        count = self.count if window is None else min(window, self.count)
+        return [(self.index - count + i) % self.size for i in range(count)]
+    
+    def percentiles(self, points, window=240):
+        """Frame time percentiles over the most recent frames, in seconds"""
+        times = sorted(self.frame_times[i] for i in self.completed_rows(window))
+        if not times:
+            return [0.0 for _ in points]
+        return [times[min(len(times) - 1, int(len(times) * p / 100))] for p in points]
+    
+    def dump(self, path):
+        """Write every recorded frame to a .csv or .jsonl file"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        rows = self.completed_rows()
+        with open(path, "w", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["time", "loop", "frame_ms"] + [f"{name}_ms" for name in self.sections])
+                for i in rows:
+                    base = i * self.MAX_SECTIONS
+                    writer.writerow(
+                        [f"{self.starts[i]:.4f}", self.loops[self.frame_loops[i]], f"{self.frame_times[i] * 1000:.3f}"]
+                        + [f"{self.samples[base + c] * 1000:.3f}" for c in range(len(self.sections))]
+                    )
+            else:
+                for i in rows:
+                    base = i * self.MAX_SECTIONS
+                    f.write(json.dumps({
+                        "time": round(self.starts[i], 4),
+                        "loop": self.loops[self.frame_loops[i]],
+                        "frame_ms": round(self.frame_times[i] * 1000, 3),
+                        "sections": {
+                            name: round(self.samples[base + c] * 1000, 3)
+                            for c, name in enumerate(self.sections) if self.samples[base + c]
+                        },
+                    }) + "\n")
+        return len(rows)
+    
+    def start_cprofile(self, frames):
+        """Run cProfile over the next frames, written out by stop_cprofile"""
+        if self.cprofile or frames <= 0:
+            return
+        self.cprofile = cProfile.Profile()
+        self.cprofile_frames_left = frames
+        self.cprofile.enable()
+    
+    def stop_cprofile(self):
+        if not self.cprofile:
+            return None
+        self.cprofile.disable()
+        path = os.path.join(PROFILES_DIR, time.strftime("cprofile-%Y%m%d-%H%M%S.prof"))
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        self.cprofile.dump_stats(path)
+        self.cprofile = None
+        print(f"Wrote cProfile stats to {path}")
+        return path
+    
+    def dump_on_demand(self):
+        """Profiler hotkey: dump section timings and optionally start a cProfile capture"""
+        options = settings.get("profiler", DEFAULT_PROFILER)
+        extension = "csv" if options.get("format", "csv") == "csv" else "jsonl"
+        path = os.path.join(PROFILES_DIR, time.strftime(f"frames-%Y%m%d-%H%M%S.{extension}"))
+        frames = self.dump(path)
+        print(f"Wrote {frames} frames of section timings to {path}")
+        self.start_cprofile(options.get("cprofile_frames", 0))
+
+profiler = FrameProfiler()
+
+# Sections marked by game_screen, in frame order
+GAME_SECTIONS = ("events", "physics", "world", "hud", "flip")
+
+class DebugOverlay:
+    """Toggleable performance readout, re-rendered twice a second and blitted in between"""
+    REFRESH = 0.5
+    
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.surface = None
+        self.last_refresh = 0
+        self.last_counts = None
+    
+    def draw(self, surf, conn):
+        now = time.perf_counter()
+        if self.surface is None or now - self.last_refresh >= self.REFRESH:
+            self.surface = self.render(conn, now)
+        surf.blit(self.surface, (SCREEN_WIDTH - self.surface.get_width() - 10, 10))
+    
+    def render(self, conn, now):
+        stats = conn.stats
+        counts = (stats.packets_in, stats.bytes_in, stats.packets_out, stats.bytes_out)
+        rates = (0, 0, 0, 0)
+        if self.last_counts:
+            elapsed = max(now - self.last_refresh, 1e-6)
+            rates = tuple((new - old) / elapsed for new, old in zip(counts, self.last_counts))
+        self.last_counts = counts
+        self.last_refresh = now
+        
+        p50, p95, p99 = (v * 1000 for v in self.profiler.percentiles((50, 95, 99)))
+        pending = conn.pending_bytes()
+        lines = [
+            f"FPS: {clock.get_fps():.0f}",
+            f"Frame ms p50/p95/p99: {p50:.1f} / {p95:.1f} / {p99:.1f}",
+            "Phase ms: " + "  ".join(f"{name} {self.profiler.section_time(name) * 1000:.2f}" for name in GAME_SECTIONS),
+            f"In: {rates[0]:.0f} pkt/s  {rates[1] / 1024:.1f} KB/s",
+            f"Out: {rates[2]:.0f} pkt/s  {rates[3] / 1024:.1f} KB/s",
+            f"Inbound queue: {pending if pending is not None else 'n/a'} bytes",
+            f"UDP: {'on' if conn.udp_ready else 'off'}  {conn.udp_stale} stale dropped",
+            f"recv calls per packet: {stats.recv_calls / max(stats.packets_in, 1):.2f}",
+            f"Compression: {stats.compression_ratio():.1f}x  {stats.codec_seconds * 1000:.0f} ms CPU",
+        ]
+        
+        rendered = [small_font.render(line, True, WHITE) for line in lines]
+        width = max(r.get_width() for r in rendered) + 10
+        surface = pygame.Surface((width, len(rendered) * 18 + 8), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 180))
+        y = 4
+        for r in rendered:
+            surface.blit(r, (5, y))
+            y += 18
+        return surface
 
 # =========================
 # GAME SCREEN
 # =========================
 def game_screen(conn: ServerConnection):
-    # Wait for welcome packet with world data
-    print("Waiting for server welcome packet...")
-    wait_time = 0
-    max_wait = 5
-    while wait_time < max_wait:
-        if conn.world and len(conn.world) > 0:
-            print(f"World received! Size: {len(conn.world)}x{len(conn.world[0])}")
-            break
-        if not conn.connected:
-            print("Connection lost while waiting for world data")
-            return
-        time.sleep(0.1)
-        wait_time += 0.1
+    # Wait for welcome packet with world data (connecting_screen usually already did)
+    if not conn.ready.wait(5):
+        print("Timed out waiting for server welcome packet")
+    
+    if not conn.connected:
+        print("Connection lost while waiting for world data")
+        return
     
     if not conn.world or len(conn.world) == 0:
         print("Failed to receive world data from server")
@@ -2039,9 +3084,9 @@ def game_screen(conn: ServerConnection):
     
     print(f"Safe spawn position: ({player_x}, {player_y})")
     
-    player_vx = 0
-    player_vy = 0
-    on_ground = False
+    player = physics.PlayerState(player_x, player_y)
+    inputs = physics.Inputs()
+    stepper = physics.FixedStepper(player)
     
     # Camera
     camera_x = 0
@@ -2059,25 +3104,41 @@ def game_screen(conn: ServerConnection):
     chat_open = False
     chat_input = ""
     
+    # Debug overlay
+    show_debug = False
+    debug_overlay = DebugOverlay(profiler)
+    
+    # Window state, the loop slows down in the background and stops drawing when minimized
+    window_focused = True
+    window_minimized = False
+    clock_last_tick = pygame.time.get_ticks()
+    
     running = True
     frame_count = 0
     
     while running and conn.connected:
-        delta_time = clock.tick(FPS) / 1000.0
-        
-        # CRITICAL: Limit delta_time to prevent physics bugs when window is moved/minimized
-        # If delta_time is too large (>0.1s), the player teleports due to huge velocity jumps
-        delta_time = min(delta_time, 0.1)  # Max 100ms per frame
+        # FPS only caps rendering, physics runs at physics.PHYSICS_HZ
+        # (the stepper also caps how much time a long frame can catch up on)
+        if window_focused and not window_minimized:
+            delta_time = clock.tick(FPS) / 1000.0
+        else:
+            # Sleep until the next background frame, any event (refocus) wakes us early
+            wait_ms = int(1000 / BACKGROUND_FPS) - (pygame.time.get_ticks() - clock_last_tick)
+            if wait_ms > 0:
+                event = pygame.event.wait(wait_ms)
+                if event.type != pygame.NOEVENT:
+                    pygame.event.post(event)
+            delta_time = clock.tick() / 1000.0
+        clock_last_tick = pygame.time.get_ticks()
+        profiler.begin_frame("game")
         frame_count += 1
         
         # Check if we got a respawn command from server
         if conn.respawn_flag:
-            player_x = float(conn.player_x)
-            player_y = float(conn.player_y)
-            player_vx = 0
-            player_vy = 0
+            player.teleport(conn.player_x, conn.player_y)
+            stepper.reset()
             conn.respawn_flag = False
-            print(f"Respawned to ({player_x}, {player_y})")
+            print(f"Respawned to ({player.x}, {player.y})")
         
         keys = pygame.key.get_pressed()
         mouse_pos = pygame.mouse.get_pos()
@@ -2087,6 +3148,14 @@ def game_screen(conn: ServerConnection):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.WINDOWFOCUSLOST:
+                window_focused = False
+            elif event.type == pygame.WINDOWFOCUSGAINED:
+                window_focused = True
+            elif event.type == pygame.WINDOWMINIMIZED:
+                window_minimized = True
+            elif event.type == pygame.WINDOWRESTORED or event.type == pygame.WINDOWMAXIMIZED:
+                window_minimized = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     if chat_open:
@@ -2117,6 +3186,10 @@ def game_screen(conn: ServerConnection):
                     if event.key == controls.get("chat", pygame.K_t):
                         chat_open = True
                         chat_input = ""
+                    elif event.key == controls.get("debug_overlay", pygame.K_F3):
+                        show_debug = not show_debug
+                    elif event.key == controls.get("profiler_dump", pygame.K_F4):
+                        profiler.dump_on_demand()
                     elif event.key == controls.get("inventory", pygame.K_e):
                         # Toggle inventory
                         inventory_open = not inventory_open
@@ -2148,8 +3221,8 @@ def game_screen(conn: ServerConnection):
                     world_mouse_y = (mouse_pos[1] + camera_y) // BLOCK_SIZE
                     
                     # Check if within 2 blocks distance from player
-                    player_block_x = int(player_x)
-                    player_block_y = int(player_y)
+                    player_block_x = int(player.x)
+                    player_block_y = int(player.y)
                     
                     # Distance check: can interact with blocks 2 blocks away
                     dx = abs(world_mouse_x - player_block_x)
@@ -2177,171 +3250,30 @@ def game_screen(conn: ServerConnection):
                     # Handle inventory drop
                     pass  # Will be implemented with rendering
         
+        profiler.mark("events")
+        
         # Player movement (only if not in chat)
         if not chat_open:
-            move_speed = 100
-            
-            # Check if on ladder
-            player_grid_x = int(player_x)
-            player_grid_y = int(player_y)
-            on_ladder = False
-            
-            for check_y in [player_grid_y, player_grid_y + 1]:
-                if 0 <= check_y < len(conn.world) and 0 <= player_grid_x < len(conn.world[0]):
-                    if conn.world[check_y][player_grid_x] == "ladder":
-                        on_ladder = True
-                        break
-            
-            # Ladder climbing
-            if on_ladder:
-                climb_speed = 189
-                if keys[controls.get("climb_up", pygame.K_w)]:
-                    player_y -= climb_speed * delta_time
-                    player_vy = 0  # Cancel gravity
-                elif keys[controls.get("climb_down", pygame.K_s)]:
-                    player_y += climb_speed * delta_time
-                    player_vy = 0  # Cancel gravity
-                else:
-                    player_vy = 0  # Stay on ladder, no falling
-            
-            if keys[controls.get("move_left", pygame.K_a)]:
-                player_vx = -move_speed
-            elif keys[controls.get("move_right", pygame.K_d)]:
-                player_vx = move_speed
-            else:
-                player_vx = 0
-            
-            # Gravity (not when on ladder)
-            if not on_ladder:
-                player_vy += 25 * delta_time
-                if player_vy > 15:
-                    player_vy = 15
-            
-            # Jump (not when on ladder)
-            if keys[controls.get("jump", pygame.K_SPACE)] and on_ground and not on_ladder:
-                player_vy = -12
-            
-             # Gravity
-            player_vy += 25 * delta_time
-            if player_vy > 15:
-                player_vy = 15
-
-                 # Jump
-            if keys[controls.get("jump", pygame.K_SPACE)] and on_ground:
-                player_vy = -12
-            
-
-            # Apply horizontal velocity first
-            if player_vx != 0:
-                new_x = player_x + player_vx * delta_time
-                
-                # Check horizontal collisions BEFORE moving
-                player_grid_x_new = int(new_x)
-                can_move_x = True
-                
-                for check_y in [player_grid_y, player_grid_y + 1]:
-                    for offset in [-1, 0, 1]:
-                        check_x = player_grid_x_new + offset
-                        if 0 <= check_y < len(conn.world) and 0 <= check_x < len(conn.world[0]):
-                            block_type = conn.world[check_y][check_x]
-                            # Ladder is climbable, not solid
-                            if block_type != "air" and block_type != "ladder":
-                                block_left = check_x
-                                block_right = check_x + 1
-                                block_top = check_y
-                                block_bottom = check_y + 1
-                                
-                                new_player_left = new_x - 0.4
-                                new_player_right = new_x + 0.4
-                                player_top = player_y
-                                player_bottom = player_y + 2
-                                
-                                # Check if we would collide
-                                if (player_bottom > block_top + 0.1 and 
-                                    player_top < block_bottom - 0.1 and
-                                    new_player_right > block_left and 
-                                    new_player_left < block_right):
-                                    can_move_x = False
-                                    break
-                    if not can_move_x:
-                        break
-                
-                if can_move_x:
-                    player_x = new_x
-            
-            # Apply vertical velocity
-            player_y += player_vy * delta_time
-            
-            # Clamp to world bounds to prevent going outside
-            player_x = max(0.5, min(player_x, len(conn.world[0]) - 1.5))
-            player_y = max(0, min(player_y, len(conn.world) - 2.5))
-            
-            # Collision detection
-            player_grid_x = int(player_x)
-            player_grid_y = int(player_y)
-            
-            # Check collisions with blocks - vertical only now
-            on_ground = False
-            
-            # Vertical collision - improved to prevent wall jump bugs
-            for check_y in [player_grid_y, player_grid_y + 1, player_grid_y + 2]:
-                for check_x in [player_grid_x - 1, player_grid_x, player_grid_x + 1]:
-                    if 0 <= check_y < len(conn.world) and 0 <= check_x < len(conn.world[0]):
-                        block_type = conn.world[check_y][check_x]
-                        # Ladder is climbable, not solid
-                        if block_type != "air" and block_type != "ladder":
-                            block_left = check_x
-                            block_right = check_x + 1
-                            block_top = check_y
-                            block_bottom = check_y + 1
-                            
-                            player_left = player_x - 0.4
-                            player_right = player_x + 0.4
-                            player_top = player_y
-                            player_bottom = player_y + 2
-                            
-                            # More precise horizontal overlap check
-                            h_overlap = min(player_right, block_right) - max(player_left, block_left)
-                            
-                            # Only consider vertical collision if there's significant horizontal overlap
-                            if h_overlap > 0.1:
-                                if player_bottom > block_top and player_top < block_bottom:
-                                    # Collision detected
-                                    if player_vy > 0:  # Falling
-                                        # Only snap to ground if bottom is close to block top
-                                        if player_bottom - block_top < 0.5:
-                                            player_y = block_top - 2
-                                            player_vy = 0
-                                            on_ground = True
-                                    elif player_vy < 0:  # Jumping into ceiling
-                                        # Only snap to ceiling if top is close to block bottom
-                                        if block_bottom - player_top < 0.5:
-                                            player_y = block_bottom
-                                            player_vy = 0
-            
-            # Keep player in bounds
-            if player_x < 0.5:
-                player_x = 0.5
-            if player_x > len(conn.world[0]) - 1.5:
-                player_x = len(conn.world[0]) - 1.5
-            if player_y < 0:
-                player_y = 0
-            
-  
-                # Players are 2 blocks tall and ~0.8 blocks wide
-                if dx < 0.8 and dy < 2.0:
-                    # Push players apart horizontally
-                    if player_x < other_x:
-                        player_x -= 0.1
-                    else:
-                        player_x += 0.1
+            inputs.left = keys[controls.get("move_left", pygame.K_a)]
+            inputs.right = keys[controls.get("move_right", pygame.K_d)]
+            inputs.jump = keys[controls.get("jump", pygame.K_SPACE)]
+            inputs.climb_up = keys[controls.get("climb_up", pygame.K_w)]
+            inputs.climb_down = keys[controls.get("climb_down", pygame.K_s)]
+            stepper.advance(delta_time, inputs, conn.tiles)
             
             # Send position to server
-            conn.send_position(player_x, player_y)
+            conn.send_position(player.x, player.y)
         
-        # Update camera
-        camera_x = int(player_x * BLOCK_SIZE - SCREEN_WIDTH // 2)
-        camera_y = int(player_y * BLOCK_SIZE - SCREEN_HEIGHT // 2)
+        profiler.mark("physics")
+        
+        # Nothing is visible while minimized, keep the simulation and heartbeats going only
+        if window_minimized:
+            continue
+        
+        # Update camera (follows the interpolated position, not the last step)
+        render_x, render_y = stepper.render_position()
+        camera_x = int(render_x * BLOCK_SIZE - SCREEN_WIDTH // 2)
+        camera_y = int(render_y * BLOCK_SIZE - SCREEN_HEIGHT // 2)
         
         # Keep camera in bounds
         if camera_x < 0:
@@ -2359,14 +3291,7 @@ def game_screen(conn: ServerConnection):
         screen.fill(SKY_BLUE)
         
         # Draw world
-        for y, row in enumerate(conn.world):
-            for x, block in enumerate(row):
-                screen_x = x * BLOCK_SIZE - camera_x
-                screen_y = y * BLOCK_SIZE - camera_y
-                
-                if -BLOCK_SIZE < screen_x < SCREEN_WIDTH and -BLOCK_SIZE < screen_y < SCREEN_HEIGHT:
-                    if block != "air":
-                        draw_block(screen, block, screen_x, screen_y)
+        draw_world(screen, conn.world, camera_x, camera_y)
         
         # Draw other players
         for other_pid, (ox, oy) in conn.players.items():
@@ -2393,8 +3318,8 @@ def game_screen(conn: ServerConnection):
             screen.blit(name_label, name_rect)
         
         # Draw player
-        screen_x = int(player_x * BLOCK_SIZE - camera_x)
-        screen_y = int(player_y * BLOCK_SIZE - camera_y)
+        screen_x = int(render_x * BLOCK_SIZE - camera_x)
+        screen_y = int(render_y * BLOCK_SIZE - camera_y)
         
         # Get player's chosen color
         player_body_color = PLAYER_COLORS.get(appearance.get("player_color", "blue"), (0, 0, 255))
@@ -2409,6 +3334,8 @@ def game_screen(conn: ServerConnection):
         pygame.draw.rect(screen, PINK, head_rect)
         pygame.draw.rect(screen, BLACK, head_rect, 2)
         
+        profiler.mark("world")
+        
         # Draw inventory HUD or hotbar
         if inventory_open:
             # Initialize inventory if needed
@@ -2460,7 +3387,7 @@ def game_screen(conn: ServerConnection):
                                         conn.hotbar[dragging_from[1]] = old_item
                             
                             # Sync to server after swap
-                            conn.sync_inventory()
+                            conn.move_slot(dragging_from, (slot_type, slot_idx))
                             
                             dropped = True
                             break
@@ -2481,9 +3408,8 @@ def game_screen(conn: ServerConnection):
                 count = dragging_item["count"]
                 slot_size = 40
                 
-                texture = block_textures.get(block_type)
-                if texture:
-                    scaled_texture = pygame.transform.scale(texture, (slot_size - 6, slot_size - 6))
+                scaled_texture = get_scaled_texture(block_type, slot_size - 6)
+                if scaled_texture:
                     screen.blit(scaled_texture, (mouse_pos[0] - (slot_size - 6)//2, mouse_pos[1] - (slot_size - 6)//2))
                 else:
                     block_color = BLOCK_COLORS.get(block_type, GRAY)
@@ -2519,10 +3445,8 @@ def game_screen(conn: ServerConnection):
                     count = conn.hotbar[i]["count"]
                     
                     # Draw block preview with texture
-                    texture = block_textures.get(block_type)
-                    if texture:
-                        # Scale texture to fit slot
-                        scaled_texture = pygame.transform.scale(texture, (30, 30))
+                    scaled_texture = get_scaled_texture(block_type, 30)
+                    if scaled_texture:
                         screen.blit(scaled_texture, (slot_x + 5, slot_y + 5))
                     else:
                         # Fallback to color
@@ -2583,38 +3507,169 @@ def game_screen(conn: ServerConnection):
             draw_player_list(screen, conn, PLAYER_ID, appearance.get("player_color", "blue"))
         
         # Draw HUD
-        info_bg = pygame.Surface((280, 90))
+        info_bg = pygame.Surface((280, 110))
         info_bg.set_alpha(180)
         info_bg.fill((0, 0, 0))
-        screen.blit(info_bg, (10, SCREEN_HEIGHT - 170))
+        screen.blit(info_bg, (10, SCREEN_HEIGHT - 190))
         
+        ping = conn.ping_ms()
         hud_text = [
             f"{t('server')}: {conn.server_name}",
-            f"{t('position')}: ({int(player_x)}, {int(player_y)})",
+            f"{t('position')}: ({int(player.x)}, {int(player.y)})",
             f"{t('players')}: {len(conn.players) + 1}",
             f"{t('level')}: {conn.player_level}",
+            t("reconnecting") if conn.reconnecting else f"{t('ping')}: {'?' if ping is None else ping} ms",
         ]
-        hud_y = SCREEN_HEIGHT - 165
+        hud_y = SCREEN_HEIGHT - 185
         for line in hud_text:
             text_surface = small_font.render(line, True, WHITE)
             screen.blit(text_surface, (15, hud_y))
             hud_y += 20
         
+        if show_debug:
+            debug_overlay.draw(screen, conn)
+        
+        profiler.mark("hud")
         pygame.display.flip()
+        profiler.mark("flip")
     
     # Cleanup
     print("Disconnecting from server...")
-    if conn.connected:
-        try:
-            conn.sock.close()
-        except:
-            pass
-        conn.connected = False
+    conn.save_world_cache()
+    conn.close()
+
+# =========================
+# HEADLESS MODE
+# =========================
+class ScriptedInput:
+    """Replays a looping list of (keys, seconds) moves as physics inputs"""
+    
+    def __init__(self, script):
+        self.script = script  # [(set of key names, seconds), ...]
+        self.total = sum(seconds for _, seconds in script)
+        self.inputs = physics.Inputs()
+    
+    @classmethod
+    def parse(cls, text):
+        """Build a script from text like "right:1,jump+left:0.5,idle:2", ValueError if it is malformed"""
+        script = []
+        for part in text.split(","):
+            keys, _, seconds = part.strip().partition(":")
+            seconds = float(seconds or 1)
+            if seconds < 0:
+                raise ValueError(f"negative duration in {part.strip()!r}")
+            script.append((set(keys.split("+")), seconds))
+        if not sum(seconds for _, seconds in script) > 0:
+            raise ValueError("the script must last longer than 0 seconds")
+        return cls(script)
+    
+    @classmethod
+    def wander(cls, rng, moves=8):
+        """Random walk with the odd jump, different for every seed"""
+        choices = [{"left"}, {"right"}, {"jump", "left"}, {"jump", "right"}, {"idle"}]
+        return cls([(rng.choice(choices), rng.uniform(0.2, 1.5)) for _ in range(moves)])
+    
+    def at(self, elapsed):
+        """Inputs held elapsed seconds into the script"""
+        elapsed %= self.total
+        for keys, seconds in self.script:
+            if elapsed < seconds:
+                break
+            elapsed -= seconds
+        inputs = self.inputs
+        inputs.left = "left" in keys
+        inputs.right = "right" in keys
+        inputs.jump = "jump" in keys
+        inputs.climb_up = "up" in keys
+        inputs.climb_down = "down" in keys
+        return inputs
+
+class HeadlessPlayer:
+    """A ServerConnection moved around by a ScriptedInput, with no rendering"""
+    
+    def __init__(self, conn, driver):
+        self.conn = conn
+        self.driver = driver
+        self.player = None
+        self.stepper = None
+        self.started = 0
+    
+    def tick(self, now, frame_time):
+        conn = self.conn
+        if not conn.connected or not conn.world:
+            return
+        if self.player is None:
+            # First tick after the welcome packet
+            self.player = physics.PlayerState(conn.player_x, conn.player_y)
+            self.stepper = physics.FixedStepper(self.player)
+            self.started = now
+        if conn.respawn_flag:
+            self.player.teleport(conn.player_x, conn.player_y)
+            self.stepper.reset()
+            conn.respawn_flag = False
+        self.stepper.advance(frame_time, self.driver.at(now - self.started), conn.tiles)
+        conn.send_position(self.player.x, self.player.y)
+
+def run_headless(ip, port, password="0", bots=1, duration=10.0, script=None, tick_rate=FPS):
+    """Run simulated players in this process for duration seconds, returns a summary"""
+    players = []
+    for i in range(bots):
+        player_id = PLAYER_ID if bots == 1 else f"bot{i:03d}"
+        conn = ServerConnection(ip, port, password, player_id=player_id)
+        if not conn.connect():
+            print(f"Bot {player_id} could not connect")
+            continue
+        if script:
+            driver = ScriptedInput.parse(script)
+        else:
+            driver = ScriptedInput.wander(random.Random(i))
+        players.append(HeadlessPlayer(conn, driver))
+    
+    ticks = 0
+    busy_time = 0.0
+    start = last = time.perf_counter()
+    while players and time.perf_counter() - start < duration:
+        clock.tick(tick_rate)
+        now = time.perf_counter()
+        for p in players:
+            p.tick(now, now - last)
+        last = now
+        ticks += 1
+        busy_time += time.perf_counter() - now
+    
+    summary = {
+        "bots": bots,
+        "connected": sum(1 for p in players if p.conn.connected),
+        "ticks": ticks,
+        "avg_tick_ms": round(busy_time / ticks * 1000, 3) if ticks else 0,
+    }
+    for p in players:
+        p.conn.close()
+    return summary
 
 # =========================
 # RUN
 # =========================
 if __name__ == "__main__":
-    if main_menu():
+    if HEADLESS:
+        parser = argparse.ArgumentParser(description="Run Night Tree Client players without a window")
+        parser.add_argument("--headless", action="store_true")
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--port", type=int, default=12345)
+        parser.add_argument("--password", default="0")
+        parser.add_argument("--bots", type=int, default=1)
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--script", help='looping moves, e.g. "right:1,jump+left:0.5,idle:2"')
+        parser.add_argument("--udp-loss", type=float, default=0.0, help="fraction of UDP datagrams to drop")
+        args = parser.parse_args()
+        if args.script:
+            try:
+                ScriptedInput.parse(args.script)
+            except ValueError as e:
+                parser.error(f"--script: {e}")
+        UDP_SIMULATED_LOSS = args.udp_loss
+        summary = run_headless(args.host, args.port, args.password, args.bots, args.duration, args.script)
+        print(json.dumps(summary))
+    elif main_menu():
         pass
     pygame.quit()
@@ -5,41 +5,361 @@ import os
 import uuid
 import time
 import struct
+import zlib
+import sys
+import marshal
+import gzip
+import tracemalloc
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    # Only used to read sockets' unsent bytes for the metrics endpoint
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+
+try:
+    # Peak memory for /perf where /proc is missing
+    import resource
+except ImportError:
+    resource = None
+
+# =========================
+# METRICS
+# =========================
+
+class Metrics:
+    """Counters, gauges and latency histograms, rendered in Prometheus text format"""
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}  # name -> (kind, help), in declaration order
+        self.values = {}  # (name, labels) -> number, for counters and set gauges
+        self.histograms = {}  # (name, labels) -> [count per bucket..., sum, count]
+        self.callbacks = {}  # name -> function returning [(labels dict, value), ...]
+
+    def declare(self, name, kind, help_text, callback=None):
+        self.meta[name] = (kind, help_text)
+        if callback:
+            self.callbacks[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def totals(self, name):
+        """{labels: (sum, count)} of one histogram"""
+        with self.lock:
+            return {labels: (hist[-2], hist[-1]) for (key, labels), hist in self.histograms.items() if key == name}
+
+    def values_of(self, name):
+        """{first label value: value} of one counter or gauge"""
+        with self.lock:
+            return {labels[0][1] if labels else "": value for (key, labels), value in self.values.items() if key == name}
+
+    def render(self):
+        """The whole registry as a Prometheus text exposition"""
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: list(hist) for key, hist in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text) in self.meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self.callbacks:
+                for labels, value in self.callbacks[name]():
+                    lines.append(f"{name}{fmt(sorted(labels.items()))} {value}")
+            for (key_name, labels), value in values.items():
+                if key_name == name:
+                    lines.append(f"{name}{fmt(labels)} {value}")
+            for (key_name, labels), hist in histograms.items():
+                if key_name != name:
+                    continue
+                total = 0
+                for bound, count in zip(self.BUCKETS, hist):
+                    total += count
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {total}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist[-1]}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist[-2]:.6f}")
+                lines.append(f"{name}_count{fmt(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.declare("server_messages_total", "counter", "Messages by direction and type")
+metrics.declare("server_bytes_total", "counter", "Bytes on the wire by direction and message type")
+metrics.declare("server_handler_seconds", "histogram", "Time spent handling one client message, by type")
+metrics.declare("server_broadcast_seconds", "histogram", "Time to fan one broadcast out to every client")
+metrics.declare("server_broadcast_recipients_total", "counter", "Messages sent by broadcasts")
+metrics.declare("server_save_seconds", "histogram", "Time to write a data file")
+metrics.declare("server_save_bytes", "gauge", "Size of the last write of a data file")
+metrics.declare("server_lock_wait_seconds", "histogram", "Time spent waiting for the server state lock")
+metrics.declare("server_tick_seconds", "histogram", "Time spent in one heartbeat tick")
+metrics.declare("server_udp_datagrams_total", "counter", "Datagrams on the movement channel by direction")
+metrics.declare("server_rate_limited_total", "counter", "Inbound messages over a client's rate limit, by type")
+
+# Every message type either side sends. Clients pick their own "type", so anything
+# else is counted as "other" instead of growing a new series per made-up value.
+MESSAGE_TYPES = frozenset((
+    "login", "ping", "pong", "leave", "hello", "chat", "move", "update_color", "break_block",
+    "place_block", "sync_inventory", "move_slot", "welcome", "disconnect", "block_ack", "slot_ack",
+    "slot_update", "hotbar_update", "inventory_update", "update_block", "player_join", "player_leave",
+    "player_move", "player_color", "color_updated", "player_pings", "respawn"
+))
+
+def type_label(kind):
+    """Metric label for a message type, bounded whatever the client sent"""
+    return kind if isinstance(kind, str) and kind in MESSAGE_TYPES else "other"
+
+class TimedLock:
+    """threading.Lock that records how long every acquire waited"""
+    def __init__(self, name):
+        self.name = name
+        self.inner = threading.Lock()
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.inner.acquire()
+        metrics.observe("server_lock_wait_seconds", time.perf_counter() - start, lock=self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.inner.release()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown the console
 
 # =========================
 # HELPER FUNCTIONS
 # =========================
 
+COMPRESSED = 0x80000000  # Length prefix flag for zlib frames
+COMPRESS_THRESHOLD = 48  # Smaller frames gain less than the sync flush costs
+
+class StreamCodec:
+    """zlib streams and write buffer for one connection, each frame is sync-flushed so it decodes on arrival"""
+    def __init__(self):
+        self.compressor = None  # Set once the peer agreed to compression
+        self.decompressor = zlib.decompressobj()
+        self.lock = threading.Lock()  # Frames must reach the socket in the order they were compressed
+        self.out = []  # Length prefixes and payloads waiting for flush()
+        self.frames_out = 0
+        self.writes = 0  # Send syscalls
+        self.raw_out = 0
+        self.wire_out = 0
+        self.raw_in = 0
+        self.wire_in = 0
+        self.seconds = 0.0  # CPU time spent compressing and decompressing
+        self.started = time.monotonic()
+
+    def enable(self):
+        self.compressor = zlib.compressobj(6)
+
+    def ratio(self):
+        """Bytes before compression per byte on the wire, both directions"""
+        return (self.raw_out + self.raw_in) / max(self.wire_out + self.wire_in, 1)
+
+codecs = {}  # socket -> StreamCodec
+
+# While a handler or tick runs, its sends are queued and written once per socket at the end
+batch = threading.local()
+
+IOV_MAX = 512  # Buffers per sendmsg call, well under the usual OS limit
+
+def send_frames(sock, buffers):
+    """Write buffers in order with scatter/gather sends, returns the number of syscalls"""
+    if not hasattr(sock, "sendmsg"):
+        # No sendmsg on Windows
+        sock.sendall(b"".join(buffers))
+        return 1
+    calls = 0
+    i = 0
+    while i < len(buffers):
+        sent = sock.sendmsg(buffers[i:i + IOV_MAX])
+        calls += 1
+        # Skip what went out, keep the unsent tail of a partly written buffer
+        while i < len(buffers) and sent >= len(buffers[i]):
+            sent -= len(buffers[i])
+            i += 1
+        if sent:
+            buffers[i] = memoryview(buffers[i])[sent:]
+    return calls
+
 def send_msg(sock, msg_dict):
-    """Send a length-prefixed JSON message"""
+    """Send a length-prefixed JSON message (queued if this thread is batching)"""
     msg_json = json.dumps(msg_dict)
     msg_bytes = msg_json.encode('utf-8')
     msg_len = len(msg_bytes)
-    # Send 4-byte length prefix, then the message
-    sock.sendall(struct.pack('!I', msg_len) + msg_bytes)
-
-def recv_msg(sock):
+    kind = msg_dict.get("type")
+    codec = codecs.get(sock)
+    if codec is None:
+        # Send 4-byte length prefix, then the message
+        send_frames(sock, [struct.pack('!I', msg_len), msg_bytes])
+        metrics.inc("server_messages_total", direction="out", type=type_label(kind))
+        metrics.inc("server_bytes_total", 4 + msg_len, direction="out", type=type_label(kind))
+        return
+    with codec.lock:
+        data = msg_bytes
+        prefix = msg_len
+        if codec.compressor and msg_len >= COMPRESS_THRESHOLD:
+            start = time.perf_counter()
+            data = codec.compressor.compress(msg_bytes) + codec.compressor.flush(zlib.Z_SYNC_FLUSH)
+            codec.seconds += time.perf_counter() - start
+            prefix = len(data) | COMPRESSED
+        codec.out += (struct.pack('!I', prefix), data)
+        codec.frames_out += 1
+        codec.raw_out += 4 + msg_len
+        codec.wire_out += 4 + len(data)
+    metrics.inc("server_messages_total", direction="out", type=type_label(kind))
+    metrics.inc("server_bytes_total", 4 + len(data), direction="out", type=type_label(kind))
+    pending = getattr(batch, "sockets", None)
+    if pending is None:
+        flush(sock)
+    else:
+        pending.add(sock)
+
+def flush(sock):
+    """Write everything queued for one socket"""
+    codec = codecs.get(sock)
+    if codec is None:
+        return
+    with codec.lock:
+        if codec.out:
+            frames, codec.out = codec.out, []
+            codec.writes += send_frames(sock, frames)
+
+def begin_batch():
+    """Queue this thread's sends until flush_batch()"""
+    batch.sockets = set()
+
+def flush_batch():
+    """Write out everything queued since begin_batch(), one send per socket"""
+    sockets = getattr(batch, "sockets", None) or ()
+    batch.sockets = None
+    for sock in sockets:
+        try:
+            flush(sock)
+        except OSError:
+            pass  # The reading side notices dead sockets
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # A bigger length prefix is a broken or hostile peer
+READ_BUFFER_SIZE = 64 * 1024
+
+class FrameReader:
+    """Reads length-prefixed frames for one socket through a reusable buffer, several frames per recv when queued"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not handed out yet
+        self.end = 0  # End of the received bytes
+        self.recv_calls = 0
+
+    def read_frame(self):
+        """(compressed, payload memoryview) or None at EOF, the view is only valid until the next call"""
+        while True:
+            available = self.end - self.start
+            needed = 4
+            if available >= 4:
+                length = struct.unpack_from('!I', self.buffer, self.start)[0]
+                compressed = length & COMPRESSED
+                length &= ~COMPRESSED
+                if length > MAX_FRAME_SIZE:
+                    raise ValueError(f"Frame of {length} bytes is over the {MAX_FRAME_SIZE} byte limit")
+                needed = 4 + length
+                if available >= needed:
+                    begin = self.start + 4
+                    self.start = begin + length
+                    return compressed, self.view[begin:self.start]
+            self.make_room(available, needed)
+            received = self.sock.recv_into(self.view[self.end:])
+            self.recv_calls += 1
+            if not received:
+                return None
+            self.end += received
+
+    def make_room(self, available, needed):
+        """Move the partial frame to the front, in a fresh buffer if it does not fit (views handed out stay intact)"""
+        size = max(needed, READ_BUFFER_SIZE)
+        if size > len(self.buffer) or (available == 0 and len(self.buffer) > READ_BUFFER_SIZE):
+            # Grow for a big frame, or drop back to the normal size once it is consumed
+            buffer = bytearray(size)
+            buffer[:available] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif self.start:
+            self.buffer[:available] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = available
+
+def recv_msg(reader):
     """Receive a length-prefixed JSON message"""
-    # Read 4-byte length prefix
-    raw_msglen = recv_all(sock, 4)
-    if not raw_msglen:
-        return None
-    msglen = struct.unpack('!I', raw_msglen)[0]
-    # Read the message data
-    msg_bytes = recv_all(sock, msglen)
-    if not msg_bytes:
+    frame = reader.read_frame()
+    if not frame or not frame[1]:
         return None
-    return json.loads(msg_bytes.decode('utf-8'))
-
-def recv_all(sock, n):
-    """Helper to receive exactly n bytes"""
-    data = bytearray()
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data.extend(packet)
-    return bytes(data)
+    compressed, payload = frame
+    wire_size = 4 + len(payload)
+    codec = codecs.get(reader.sock)
+    if codec:
+        codec.wire_in += wire_size
+        if compressed:
+            start = time.perf_counter()
+            # Bounded like a plain frame, a tiny frame can inflate a thousandfold
+            payload = codec.decompressor.decompress(payload, MAX_FRAME_SIZE)
+            if codec.decompressor.unconsumed_tail:
+                raise ValueError(f"Compressed frame inflates past the {MAX_FRAME_SIZE} byte limit")
+            codec.seconds += time.perf_counter() - start
+        codec.raw_in += 4 + len(payload)
+    elif compressed:
+        raise ValueError("Compressed frame on a connection without compression")
+    if capture:
+        capture.frame(reader.sock, payload)
+    msg = json.loads(str(payload, 'utf-8'))
+    kind = type_label(msg.get("type") if isinstance(msg, dict) else None)
+    metrics.inc("server_messages_total", direction="in", type=kind)
+    metrics.inc("server_bytes_total", wire_size, direction="in", type=kind)
+    return msg
 
 # =========================
 # DEFAULT FILES
@@ -53,7 +373,28 @@ DEFAULT_CONFIG = {
     "world-name": "world",
     "server-motd": "server made with Night Tree!",
     "server-name": "My server",
-    "console_mode": "interactive"  # "interactive" or "pterodactyl"
+    "console_mode": "interactive",  # "interactive" or "pterodactyl"
+    "ping_interval": 2,  # Seconds between latency probes to each player
+    "ping_timeout": 60,  # Seconds of silence before a player is dropped
+    "resume_grace": 30,  # Seconds a dropped player can reconnect without a full login
+    "compression": True,  # Offer zlib compression to clients that support it
+    "udp": True,  # Offer a UDP side channel for movement, on the same port number
+    "metrics_port": 0,  # Serve Prometheus metrics on this port (0 = off)
+    "metrics_host": "127.0.0.1",
+    "capture": False,  # Record all inbound traffic from startup for replay.py, see /capture
+    # Per-client token buckets: on average "rate" messages per second, in bursts of up to "burst".
+    # Types not listed are not limited. Over the limit moves and inventory syncs are held back and
+    # the newest one is applied as soon as the bucket refills, everything else is dropped.
+    "rate_limits": {
+        "move": {"rate": 25, "burst": 50},
+        "break_block": {"rate": 15, "burst": 30},
+        "place_block": {"rate": 15, "burst": 30},
+        "chat": {"rate": 2, "burst": 8},
+        "sync_inventory": {"rate": 5, "burst": 10},
+        "move_slot": {"rate": 10, "burst": 20},
+        "update_color": {"rate": 1, "burst": 3}
+    },
+    "rate_limit_kick": 0  # Kick a client with this many messages dropped within 10 seconds (0 = never)
 }
 
 DEFAULT_COMMANDS = {
@@ -66,7 +407,12 @@ DEFAULT_COMMANDS = {
     "stop": 3,
     "respawn": 0,
     "tp": 0,
-    "give": 0
+    "give": 0,
+    "ping": 0,
+    "perf": 3,
+    "profile": 3,
+    "memsnap": 3,
+    "capture": 3
 }
 
 # =========================
@@ -166,7 +512,43 @@ else:
 
 clients = {}  # player_id -> socket
 player_positions = {}  # player_id -> (x, y)
-lock = threading.Lock()
+player_rtt = {}  # player_id -> [smoothed rtt, rtt variation] in seconds
+last_seen = {}  # player_id -> time.monotonic() of the last message
+player_features = {}  # player_id -> set of protocol features both sides support
+slot_seq = {}  # player_id -> sequence number of the last slot_update sent
+last_edit = {}  # player_id -> seq of the last break/place handled, echoed in slot_update
+resume_tokens = {}  # player_id -> token handed out in welcome
+pending_leave = {}  # player_id -> time.monotonic() when their dropped session expires
+lock = TimedLock("state")
+
+def connected_clients():
+    return [({}, len(clients))]
+
+def queued_frames():
+    """Frames waiting in each player's write buffer"""
+    depths = []
+    for pid, sock in list(clients.items()):
+        codec = codecs.get(sock)
+        if codec:
+            depths.append(({"player": pid}, len(codec.out) // 2))
+    return depths
+
+def unsent_bytes():
+    """Bytes the kernel still holds for each player's socket (Linux only)"""
+    if fcntl is None or not hasattr(termios, "TIOCOUTQ"):
+        return []
+    depths = []
+    for pid, sock in list(clients.items()):
+        try:
+            raw = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0")
+            depths.append(({"player": pid}, struct.unpack("I", raw)[0]))
+        except (OSError, ValueError):
+            pass
+    return depths
+
+metrics.declare("server_connected_clients", "gauge", "Open player connections", connected_clients)
+metrics.declare("server_outbound_queued_frames", "gauge", "Frames queued in a player's write buffer", queued_frames)
+metrics.declare("server_socket_unsent_bytes", "gauge", "Bytes in a player's kernel send queue", unsent_bytes)
 
 # =========================
 # PERMISSIONS
@@ -205,13 +587,74 @@ def unpunish(pid):
 # WORLD
 # =========================
 
+# Every block change bumps the version, recent ones are kept for resuming clients
+EDIT_LOG_SIZE = 4096
+world_version = 0
+edit_log = deque(maxlen=EDIT_LOG_SIZE)  # (version, x, y, block)
+
+# Clients cache the world on disk and send a hash per chunk at login, only stale chunks are sent back
+CHUNK_SIZE = 16
+chunk_hashes = {}  # "cx,cy" -> crc32 of the chunk, dropped when a block in it changes
+
+def save_file(path, data, name):
+    """Write a JSON data file and record how long it took"""
+    start = time.perf_counter()
+    text = json.dumps(data)
+    with open(path, "w") as f:
+        f.write(text)
+    metrics.observe("server_save_seconds", time.perf_counter() - start, file=name)
+    metrics.set("server_save_bytes", len(text), file=name)
+
 def save_world():
-    with open(WORLD_PATH, "w") as f:
-        json.dump(world, f)
+    save_file(WORLD_PATH, world, "world")
+
+def set_block(x, y, block):
+    """Change one block and log it, returns the new world version"""
+    global world_version
+    with lock:
+        world[y][x] = block
+        world_version += 1
+        chunk_hashes.pop(f"{x // CHUNK_SIZE},{y // CHUNK_SIZE}", None)
+        edit_log.append((world_version, x, y, block))
+        return world_version
+
+def edits_since(version):
+    """[[x, y, block], ...] changed after version, or None if the log does not reach back that far (caller holds lock)"""
+    if version > world_version:
+        return None
+    if version < world_version and (not edit_log or edit_log[0][0] > version + 1):
+        return None
+    changed = {}
+    for v, x, y, block in edit_log:
+        if v > version:
+            changed[(x, y)] = block
+    return [[x, y, block] for (x, y), block in changed.items()]
+
+def chunk_rows(cx, cy):
+    """The blocks of one chunk, row by row (edge chunks are smaller)"""
+    x0 = cx * CHUNK_SIZE
+    return [row[x0:x0 + CHUNK_SIZE] for row in world[cy * CHUNK_SIZE:(cy + 1) * CHUNK_SIZE]]
+
+def chunk_hash(rows):
+    """crc32 of a chunk, the client computes the same thing for its cached copy"""
+    return zlib.crc32("\n".join(",".join(row) for row in rows).encode())
+
+def stale_chunks(hashes):
+    """{"cx,cy": rows} for every chunk whose hash differs from the client's cached one"""
+    stale = {}
+    with lock:
+        for cy in range((len(world) + CHUNK_SIZE - 1) // CHUNK_SIZE):
+            for cx in range((len(world[0]) + CHUNK_SIZE - 1) // CHUNK_SIZE):
+                key = f"{cx},{cy}"
+                rows = chunk_rows(cx, cy)
+                if key not in chunk_hashes:
+                    chunk_hashes[key] = chunk_hash(rows)
+                if hashes.get(key) != chunk_hashes[key]:
+                    stale[key] = rows
+    return stale
 
 def save_players():
-    with open(PLAYERS_PATH, "w") as f:
-        json.dump(player_data, f)
+    save_file(PLAYERS_PATH, player_data, "players")
 
 # =========================
 # PLAYER ACTIONS
@@ -224,11 +667,21 @@ def kick(pid, reason="Kicked"):
                 "type": "disconnect",
                 "reason": reason
             })
+            flush(clients[pid])
             clients[pid].close()
         except:
             pass
         clients.pop(pid, None)
 
+def drop_client(pid):
+    """Cut off a player that stopped responding, waking its client_thread"""
+    sock = clients.get(pid)
+    if sock:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
 def set_perm(pid, level):
     permissions[pid] = level
     with open("permission.json", "w") as f:
@@ -239,24 +692,678 @@ def set_perm(pid, level):
 # =========================
 
 def broadcast(msg, exclude=None):
+    start = time.perf_counter()
+    sent = 0
     with lock:
         for pid, sock in clients.items():
             if pid != exclude:
                 try:
                     send_msg(sock, msg)
+                    sent += 1
                 except:
                     pass
+    metrics.observe("server_broadcast_seconds", time.perf_counter() - start, type=type_label(msg.get("type")))
+    metrics.inc("server_broadcast_recipients_total", sent, type=type_label(msg.get("type")))
+
+# =========================
+# INVENTORY
+# =========================
+
+# Optional protocol extensions, agreed on at login
+SERVER_FEATURES = ["slot_delta", "block_ack", "world_chunks"]
+if config.get("compression", True):
+    SERVER_FEATURES.append("zlib")
+if config.get("udp", True):
+    SERVER_FEATURES.append("udp")
+
+STACK_SIZE = 64
+
+SLOT_KINDS = {"h": "hotbar", "i": "inventory"}
+
+def get_slots(pid, kind):
+    """A player's hotbar or inventory list (old players get an empty inventory)"""
+    if kind == "inventory" and "inventory" not in player_data[pid]:
+        player_data[pid]["inventory"] = [None] * 21
+    return player_data[pid][kind]
+
+def parse_slot(pid, ref):
+    """Turn a slot reference like "h3" or "i12" into (list, index), or None"""
+    try:
+        slots = get_slots(pid, SLOT_KINDS[ref[0]])
+        index = int(ref[1:])
+    except:
+        return None
+    if 0 <= index < len(slots):
+        return slots, index
+    return None
+
+def add_items(pid, block_type, quantity, kinds=("hotbar", "inventory")):
+    """Stack items into existing slots first, then empty ones. Returns (added, changed slot refs)"""
+    original_quantity = quantity
+    changed = []
+    
+    # Try to stack in existing slots (max 64 per slot)
+    for kind in kinds:
+        for i, slot in enumerate(get_slots(pid, kind)):
+            if slot and slot["block"] == block_type and quantity > 0 and slot["count"] < STACK_SIZE:
+                add_amount = min(quantity, STACK_SIZE - slot["count"])
+                slot["count"] += add_amount
+                quantity -= add_amount
+                changed.append(kind[0] + str(i))
+    
+    # Fill empty slots with remaining quantity (max 64 per slot)
+    for kind in kinds:
+        slots = get_slots(pid, kind)
+        for i, slot in enumerate(slots):
+            if slot is None and quantity > 0:
+                add_amount = min(quantity, STACK_SIZE)
+                slots[i] = {"block": block_type, "count": add_amount}
+                quantity -= add_amount
+                changed.append(kind[0] + str(i))
+    
+    return original_quantity - quantity, changed
+
+def slot_contents(pid, refs):
+    """{ref: item} for every valid slot reference"""
+    slots = {}
+    for ref in refs:
+        found = parse_slot(pid, ref)
+        if found:
+            slots[ref] = found[0][found[1]]
+    return slots
+
+def send_slots(pid, refs):
+    """Tell a player about changed slots, as a delta or as full lists for old clients"""
+    sock = clients.get(pid)
+    if not sock or not refs:
+        return
+    try:
+        if "slot_delta" in player_features.get(pid, ()):
+            slot_seq[pid] = slot_seq.get(pid, 0) + 1
+            send_msg(sock, {
+                "type": "slot_update",
+                "seq": slot_seq[pid],
+                "slots": slot_contents(pid, refs),
+                "edit": last_edit.get(pid, 0)
+            })
+        else:
+            if any(ref[0] == "h" for ref in refs):
+                send_msg(sock, {"type": "hotbar_update", "hotbar": get_slots(pid, "hotbar")})
+            if any(ref[0] == "i" for ref in refs):
+                send_msg(sock, {"type": "inventory_update", "inventory": get_slots(pid, "inventory")})
+    except:
+        pass
+
+def ack_edit(pid, msg, ok, x, y, slots=None):
+    """Confirm or reject a predicted break/place, with the real block so the client can roll back"""
+    sock = clients.get(pid)
+    if not sock or msg.get("seq") is None or "block_ack" not in player_features.get(pid, ()):
+        return
+    ack = {"type": "block_ack", "seq": msg["seq"], "ok": ok, "x": x, "y": y}
+    if 0 <= y < len(world) and 0 <= x < len(world[0]):
+        ack["block"] = world[y][x]
+    if not ok and slots:
+        ack["slots"] = slot_contents(pid, slots)
+    try:
+        send_msg(sock, ack)
+    except:
+        pass
+
+def sync_inventory(pid, msg):
+    """Take the client's whole hotbar and inventory as they are"""
+    player_data[pid]["hotbar"] = msg.get("hotbar", [None] * 7)
+    player_data[pid]["inventory"] = msg.get("inventory", [None] * 21)
+    save_players()
+
+def move_slot(pid, src, dst):
+    """Swap two slots, returns False if either reference is bad"""
+    a = parse_slot(pid, src)
+    b = parse_slot(pid, dst)
+    if a is None or b is None:
+        return False
+    (a_list, a_index), (b_list, b_index) = a, b
+    a_list[a_index], b_list[b_index] = b_list[b_index], a_list[a_index]
+    return True
+
+# =========================
+# SESSIONS
+# =========================
+
+def end_session(pid):
+    """Forget a dropped player for good and tell everyone they left"""
+    with lock:
+        if pid in clients:
+            return  # They came back
+        pending_leave.pop(pid, None)
+        resume_tokens.pop(pid, None)
+        player_positions.pop(pid, None)
+    
+    broadcast({
+        "type": "player_leave",
+        "id": pid
+    })
+    
+    print(f"[SERVER] Player {pid} disconnected")
+
+# =========================
+# UDP CHANNEL
+# =========================
+
+# Positions are latest-wins, so they can skip TCP's head-of-line blocking.
+# Datagrams are JSON with the session's udp token and a sequence number, older ones are dropped.
+udp_sock = None  # Bound at startup if "udp" is enabled
+udp_tokens = {}  # token -> player_id, handed out in welcome
+udp_addrs = {}  # player_id -> address their datagrams come from
+udp_seq_in = {}  # player_id -> newest sequence number received
+udp_seq_out = {}  # player_id -> last sequence number sent
+
+def new_udp_token(pid):
+    """Start a fresh UDP session for a player, returns its token"""
+    forget_udp(pid)
+    token = uuid.uuid4().hex
+    udp_tokens[token] = pid
+    return token
+
+def forget_udp(pid):
+    for token in [t for t, owner in udp_tokens.items() if owner == pid]:
+        udp_tokens.pop(token, None)
+    udp_addrs.pop(pid, None)
+    udp_seq_in.pop(pid, None)
+    udp_seq_out.pop(pid, None)
+
+def udp_send(pid, msg):
+    """Send one datagram, returns False if the player has no working UDP channel"""
+    addr = udp_addrs.get(pid)
+    if addr is None:
+        return False
+    udp_seq_out[pid] = udp_seq_out.get(pid, 0) + 1
+    try:
+        udp_sock.sendto(json.dumps(dict(msg, s=udp_seq_out[pid])).encode('utf-8'), addr)
+    except OSError:
+        return False
+    metrics.inc("server_udp_datagrams_total", direction="out")
+    return True
+
+def move_player(pid, x, y):
+    """Store a player's position and pass it on, over UDP where the receiver has it"""
+    with lock:
+        player_positions[pid] = (x, y)
+        player_data[pid]["x"] = x
+        player_data[pid]["y"] = y
+        targets = [(other, sock) for other, sock in clients.items() if other != pid]
+    
+    msg = {"type": "player_move", "id": pid, "x": x, "y": y}
+    for other, sock in targets:
+        if not udp_send(other, msg):
+            try:
+                send_msg(sock, msg)
+            except:
+                pass
+
+def udp_listener():
+    while True:
+        try:
+            data, addr = udp_sock.recvfrom(2048)
+            metrics.inc("server_udp_datagrams_total", direction="in")
+            msg = json.loads(data.decode('utf-8'))
+            pid = udp_tokens.get(msg.get("t"))
+            if pid is None or pid not in clients:
+                continue
+            seq = msg.get("s", 0)
+            if seq <= udp_seq_in.get(pid, 0):
+                continue  # Late or duplicated, a newer position already arrived
+            udp_seq_in[pid] = seq
+            udp_addrs[pid] = addr
+            if capture:
+                capture.datagram(clients.get(pid), data)
+            
+            if msg.get("type") == "hello":
+                # Tells the client datagrams get through both ways
+                udp_send(pid, {"type": "hello"})
+            elif msg.get("type") == "move":
+                if rate_allowed(pid, "move"):
+                    held_messages.get(pid, {}).pop("move", None)
+                    move_player(pid, msg["x"], msg["y"])
+                elif rate_limited(pid, msg):
+                    print(f"[SERVER] Kicking {pid} for flooding")
+                    kick(pid, "Sending messages too fast")
+        except:
+            pass  # Garbage from the internet, or a player that just left
+
+# =========================
+# RATE LIMITS
+# =========================
+
+# Only the newest of these matters, so over the limit they are held instead of dropped
+COALESCED_TYPES = ("move", "sync_inventory")
+RATE_KICK_WINDOW = 10  # Seconds over which dropped messages count towards rate_limit_kick
+
+class TokenBucket:
+    """Allows rate messages per second on average, in bursts of up to burst"""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait(self, now):
+        """Seconds until the next token"""
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        return max(0.0, (1 - tokens) / self.rate)
+
+rate_buckets = {}  # player_id -> {message type: TokenBucket}
+rate_strikes = {}  # player_id -> [window start, messages dropped since]
+held_messages = {}  # player_id -> {message type: newest message held back by the limit}
+release_timers = {}  # player_id -> threading.Timer that applies their held messages
+
+def rate_allowed(pid, kind):
+    """Take a token for one inbound message, False if the player is over the limit for its type"""
+    limit = config.get("rate_limits", DEFAULT_CONFIG["rate_limits"]).get(kind)
+    if not limit:
+        return True
+    buckets = rate_buckets.setdefault(pid, {})
+    bucket = buckets.get(kind)
+    if bucket is None:
+        bucket = buckets[kind] = TokenBucket(limit["rate"], limit["burst"])
+    return bucket.take(time.monotonic())
+
+def rate_limited(pid, msg):
+    """Hold or drop a message over the limit, returns True once the player should be kicked for flooding"""
+    kind = msg.get("type")
+    if kind in COALESCED_TYPES:
+        held_messages.setdefault(pid, {})[kind] = msg
+        schedule_release(pid)
+    metrics.inc("server_rate_limited_total", type=type_label(kind))
+    now = time.monotonic()
+    strikes = rate_strikes.get(pid)
+    if strikes is None or now - strikes[0] > RATE_KICK_WINDOW:
+        strikes = rate_strikes[pid] = [now, 0]
+    strikes[1] += 1
+    kick_after = config.get("rate_limit_kick", 0)
+    return bool(kick_after) and strikes[1] >= kick_after
+
+def schedule_release(pid):
+    """Apply a player's held messages as soon as one of their buckets has a token again"""
+    if pid in release_timers:
+        return
+    now = time.monotonic()
+    buckets = rate_buckets.get(pid, {})
+    waits = [buckets[kind].wait(now) for kind in held_messages.get(pid, {}) if kind in buckets]
+    timer = threading.Timer(min(waits, default=0.0), release_held, (pid,))
+    timer.daemon = True
+    release_timers[pid] = timer
+    timer.start()
+
+def release_held(pid):
+    release_timers.pop(pid, None)
+    held = held_messages.get(pid)
+    if not held:
+        return
+    if pid not in clients:
+        held_messages.pop(pid, None)
+        return
+    begin_batch()
+    try:
+        for kind in COALESCED_TYPES:
+            # A newer message of the same type may have been let through meanwhile
+            if kind in held and rate_allowed(pid, kind):
+                msg = held.pop(kind, None)
+                if msg is None:
+                    continue
+                if kind == "move":
+                    move_player(pid, msg["x"], msg["y"])
+                else:
+                    sync_inventory(pid, msg)
+    except:
+        pass
+    finally:
+        flush_batch()
+    if held:
+        schedule_release(pid)
+
+def forget_rate_limits(pid):
+    timer = release_timers.pop(pid, None)
+    if timer:
+        timer.cancel()
+    rate_buckets.pop(pid, None)
+    rate_strikes.pop(pid, None)
+    held_messages.pop(pid, None)
+
+# =========================
+# LATENCY
+# =========================
+
+def update_rtt(pid, sample):
+    """Smooth a player's RTT and jitter the way TCP does (RFC 6298)"""
+    rtt = player_rtt.get(pid)
+    if rtt is None:
+        player_rtt[pid] = [sample, sample / 2]
+    else:
+        rtt[1] += (abs(rtt[0] - sample) - rtt[1]) / 4
+        rtt[0] += (sample - rtt[0]) / 8
+
+def heartbeat():
+    """Ping every player, drop the silent ones and share everyone's ping"""
+    while True:
+        time.sleep(config.get("ping_interval", 2))
+        now = time.monotonic()
+        tick_start = time.perf_counter()
+        timeout = config.get("ping_timeout", 60)
+        
+        begin_batch()
+        broadcast({"type": "ping", "t": now})
+        
+        with lock:
+            silent = [pid for pid, seen in last_seen.items() if now - seen > timeout]
+            pings = {pid: int(rtt[0] * 1000) for pid, rtt in player_rtt.items()}
+            expired = [pid for pid, deadline in pending_leave.items() if now > deadline]
+        for pid in silent:
+            print(f"[SERVER] Player {pid} timed out")
+            drop_client(pid)
+        for pid in expired:
+            end_session(pid)
+        if pings:
+            broadcast({"type": "player_pings", "pings": pings})
+        flush_batch()
+        if capture:
+            capture.flush()
+        metrics.observe("server_tick_seconds", time.perf_counter() - tick_start)
+
+# =========================
+# PERFORMANCE TOOLS
+# =========================
+
+PROFILES_DIR = "profiles"
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 600
+
+perf_baseline = {}  # (histogram name, labels) -> (sum, count) at the last /perf
+
+def perf_window(name):
+    """{first label value: (seconds, count)} for a histogram since the last /perf"""
+    window = {}
+    for labels, (total, count) in metrics.totals(name).items():
+        old_total, old_count = perf_baseline.get((name, labels), (0.0, 0))
+        perf_baseline[(name, labels)] = (total, count)
+        if count > old_count:
+            window[labels[0][1] if labels else ""] = (total - old_total, count - old_count)
+    return window
+
+def process_rss():
+    """Resident memory in bytes (peak RSS where /proc is missing), or None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def perf_report():
+    """Lines for /perf, timings cover the time since the previous /perf"""
+    lines = []
+    handlers = perf_window("server_handler_seconds")
+    busiest = sorted(handlers.items(), key=lambda item: item[1][0], reverse=True)[:5]
+    lines.append("Handlers: " + (", ".join(
+        f"{kind} {count}x {total / count * 1000:.1f} ms" for kind, (total, count) in busiest) or "idle"))
+    timings = []
+    for name, label in (("server_tick_seconds", "tick"),
+                        ("server_broadcast_seconds", "broadcast"),
+                        ("server_lock_wait_seconds", "lock wait")):
+        window = perf_window(name).values()
+        count = sum(c for t, c in window)
+        if count:
+            timings.append(f"{label} {sum(t for t, c in window) / count * 1000:.2f} ms avg ({count}x)")
+    if timings:
+        lines.append("Timings: " + ", ".join(timings))
+
+    now = time.monotonic()
+    players = []
+    for pid, sock in list(clients.items()):
+        codec = codecs.get(sock)
+        rtt = player_rtt.get(pid)
+        entry = f"{pid} {int(rtt[0] * 1000)} ms" if rtt else f"{pid} ? ms"
+        if codec:
+            elapsed = max(now - codec.started, 1e-6)
+            entry += f" in {codec.wire_in / elapsed / 1024:.1f} / out {codec.wire_out / elapsed / 1024:.1f} KB/s"
+        players.append(entry)
+    lines.append("Players: " + (", ".join(players) or "none"))
+
+    rss = process_rss()
+    lines.append(f"Threads: {threading.active_count()}, RSS: {rss / 1048576:.1f} MB" if rss else
+                 f"Threads: {threading.active_count()}, RSS: unknown")
+    sizes = metrics.values_of("server_save_bytes")
+    lines.append(f"World: {len(world[0]) if world else 0}x{len(world)} blocks, {sizes.get('world', 0) // 1024} KB saved, "
+                 f"{len(edit_log)} logged edits; players.json: {len(player_data)} players, {sizes.get('players', 0) // 1024} KB")
+    return lines
+
+# cProfile only sees the thread that enabled it (before 3.12), sampling covers every client thread
+class SamplingProfiler:
+    """Samples every thread's stack and writes the totals as a pstats .prof file"""
+    INTERVAL = 0.005
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.stats = {}  # (file, line, function) -> [sample count, self time, total time, {caller: [count, self, total]}]
+        self.samples = 0
+        self.started = time.monotonic()
+        self.stop_event = threading.Event()
+        self.path = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        me = threading.get_ident()
+        last = time.perf_counter()
+        deadline = self.started + self.seconds
+        while not self.stop_event.wait(self.INTERVAL) and time.monotonic() < deadline:
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.record(frame, elapsed)
+            self.samples += 1
+        self.write()
+
+    def record(self, frame, elapsed):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        seen = set()
+        for depth, func in enumerate(stack):
+            entry = self.stats.setdefault(func, [0, 0.0, 0.0, {}])
+            leaf = depth == 0
+            if func not in seen:  # Recursion only counts once towards total time
+                seen.add(func)
+                entry[0] += 1
+                entry[2] += elapsed
+            if leaf:
+                entry[1] += elapsed
+            if depth + 1 < len(stack):
+                caller = entry[3].setdefault(stack[depth + 1], [0, 0.0, 0.0])
+                caller[0] += 1
+                caller[1] += elapsed if leaf else 0.0
+                caller[2] += elapsed
+
+    def write(self):
+        """Dump in the marshal layout pstats.Stats (and snakeviz, etc.) reads"""
+        stats = {}
+        for func, (count, tottime, cumtime, callers) in self.stats.items():
+            stats[func] = (count, count, tottime, cumtime,
+                           {caller: (c, c, t, ct) for caller, (c, t, ct) in callers.items()})
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        self.path = os.path.join(PROFILES_DIR, time.strftime("server-%Y%m%d-%H%M%S.prof"))
+        with open(self.path, "wb") as f:
+            marshal.dump(stats, f)
+        print(f"[SERVER] Wrote {self.samples} profile samples to {self.path}")
+
+profiler = None  # Running SamplingProfiler
+
+def memory_snapshot():
+    """Start tracemalloc on the first call, afterwards diff against the previous snapshot"""
+    global memsnap_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        memsnap_baseline = tracemalloc.take_snapshot()
+        return ["Started tracing allocations, run /memsnap again to see what grew and /memsnap stop when done."]
+    snapshot = tracemalloc.take_snapshot()
+    diff = snapshot.compare_to(memsnap_baseline, "lineno")
+    memsnap_baseline = snapshot
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path = os.path.join(PROFILES_DIR, time.strftime("memsnap-%Y%m%d-%H%M%S.txt"))
+    with open(path, "w") as f:
+        f.write("\n".join(str(stat) for stat in diff))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced {current / 1048576:.1f} MB (peak {peak / 1048576:.1f} MB), full diff in {path}"]
+    for stat in diff[:5]:
+        frame = stat.traceback[0]
+        lines.append(f"{os.path.basename(frame.filename)}:{frame.lineno} {stat.size_diff / 1024:+.1f} KB ({stat.count_diff:+d} blocks)")
+    return lines
+
+def stop_memory_snapshot():
+    """Stop tracemalloc, every allocation pays for recording its traceback while it runs"""
+    global memsnap_baseline
+    if not tracemalloc.is_tracing():
+        return "Allocations are not being traced."
+    tracemalloc.stop()
+    memsnap_baseline = None
+    return "Stopped tracing allocations."
+
+memsnap_baseline = None
+
+# =========================
+# CAPTURE
+# =========================
+
+# A capture is a gzip stream: CAPTURE_MAGIC, then records of
+# (seconds since start, connection number, kind, payload length) + payload.
+# It opens and closes with a CAP_STATE snapshot so replay.py can rebuild the
+# starting world and check where the replay ended up.
+CAPTURES_DIR = "captures"
+CAPTURE_MAGIC = b"NTCAP1\n"
+CAPTURE_RECORD = struct.Struct("!dIBI")
+CAP_OPEN = 0  # New connection, payload is {"addr": ...}
+CAP_FRAME = 1  # Decompressed JSON payload of an inbound frame
+CAP_CLOSE = 2
+CAP_UDP = 3  # Accepted datagram, filed under the player's TCP connection
+CAP_CONSOLE = 4  # Console command line, connection 0
+CAP_STATE = 5  # World, players, permissions and config, connection 0
+CAP_DROP = 6  # The connection's previous frame was dropped by its rate limit
+
+class Capture:
+    """Records inbound traffic of every connection opened after it started"""
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "wb", compresslevel=6)
+        self.lock = threading.Lock()
+        self.conns = {}  # socket -> connection number
+        self.next_conn = 1
+        self.records = 0
+        self.started = time.monotonic()
+        self.file.write(CAPTURE_MAGIC)
+        self.write_state()
+
+    def write(self, conn, kind, payload):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(CAPTURE_RECORD.pack(time.monotonic() - self.started, conn, kind, len(payload)))
+            self.file.write(payload)
+            self.records += 1
+
+    def open(self, sock, addr):
+        with self.lock:
+            conn = self.next_conn
+            self.next_conn += 1
+            self.conns[sock] = conn
+        self.write(conn, CAP_OPEN, json.dumps({"addr": f"{addr[0]}:{addr[1]}"}).encode('utf-8'))
+
+    def frame(self, sock, payload):
+        conn = self.conns.get(sock)
+        if conn:
+            self.write(conn, CAP_FRAME, payload)
+
+    def datagram(self, sock, data):
+        conn = self.conns.get(sock)
+        if conn:
+            self.write(conn, CAP_UDP, data)
+
+    def drop(self, sock):
+        conn = self.conns.get(sock)
+        if conn:
+            self.write(conn, CAP_DROP, b"")
+
+    def close(self, sock):
+        conn = self.conns.pop(sock, None)
+        if conn:
+            self.write(conn, CAP_CLOSE, b"")
+
+    def console(self, cmdline):
+        self.write(0, CAP_CONSOLE, cmdline.encode('utf-8'))
+
+    def write_state(self):
+        # Copy under the lock, the slow dump of a big world happens after
+        with lock:
+            state = {
+                "world": [row[:] for row in world],
+                "world_version": world_version,
+                "player_data": json.loads(json.dumps(player_data)),
+                "permissions": dict(permissions),
+                "blacklist": dict(blacklist),
+                "commands": dict(command_perms),
+                "config": dict(config)
+            }
+        self.write(0, CAP_STATE, json.dumps(state).encode('utf-8'))
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def stop(self):
+        self.write_state()
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+capture = None  # Running Capture
+
+def start_capture():
+    """Start a new capture file, returns its path"""
+    global capture
+    os.makedirs(CAPTURES_DIR, exist_ok=True)
+    path = os.path.join(CAPTURES_DIR, time.strftime("%Y%m%d-%H%M%S.ntcap"))
+    capture = Capture(path)
+    return path
 
 # =========================
 # COMMAND HANDLER
 # =========================
 
 def handle_command(sender, cmdline):
+    global profiler, capture
     parts = cmdline.split()
     if not parts:
         return None
     cmd = parts[0][1:]
 
+    # Player commands are captured as chat frames, console ones need their own record
+    if sender == "CONSOLE" and capture and cmd not in ("capture", "stop"):
+        capture.console(cmdline)
+
     if cmd not in command_perms:
         return f"the nonexistent command '{cmd}' is not alive currently."
 
@@ -372,45 +1479,91 @@ def handle_command(sender, cmdline):
             
             # Add to player's hotbar (first empty slot or stack)
             if sender in player_data:
-                hotbar = player_data[sender]["hotbar"]
-                original_quantity = quantity
-                
-                # Try to stack in existing slots (max 64 per slot)
-                for i, slot in enumerate(hotbar):
-                    if slot and slot["block"] == block_type and quantity > 0:
-                        space_available = 64 - slot["count"]
-                        if space_available > 0:
-                            add_amount = min(quantity, space_available)
-                            slot["count"] += add_amount
-                            quantity -= add_amount
-                
-                # Fill empty slots with remaining quantity (max 64 per slot)
-                for i, slot in enumerate(hotbar):
-                    if slot is None and quantity > 0:
-                        add_amount = min(quantity, 64)
-                        hotbar[i] = {"block": block_type, "count": add_amount}
-                        quantity -= add_amount
+                added, changed = add_items(sender, block_type, quantity, kinds=("hotbar",))
                 
                 # Save and update client once at the end
-                if original_quantity > quantity:  # Something was added
+                if added:
                     save_players()
-                    if sender in clients:
-                        send_msg(clients[sender], {
-                            "type": "hotbar_update",
-                            "hotbar": hotbar
-                        })
+                    send_slots(sender, changed)
                     
-                    added = original_quantity - quantity
-                    if quantity > 0:
-                        return f"Added {added}/{original_quantity} {block_type}. Hotbar full, {quantity} items couldn't fit."
+                    if added < quantity:
+                        return f"Added {added}/{quantity} {block_type}. Hotbar full, {quantity - added} items couldn't fit."
                     return f"Added {added} {block_type} to your hotbar."
                 
                 return "Hotbar is the full bro!"
             
             return "Error giving the person the items."
 
+        elif cmd == "ping":
+            targets = parts[1:] or sorted(clients)
+            if not targets:
+                return "Nobody is online to ping."
+            results = []
+            for target in targets:
+                rtt = player_rtt.get(target)
+                if rtt:
+                    results.append(f"{target} {int(rtt[0] * 1000)} ms (+/- {int(rtt[1] * 1000)})")
+                else:
+                    results.append(f"{target} unknown")
+            return "Ping: " + ", ".join(results)
+
+        elif cmd == "perf":
+            separator = "\n" if sender == "CONSOLE" else " | "
+            return separator.join(perf_report())
+
+        elif cmd == "profile":
+            action = parts[1] if len(parts) > 1 else ""
+            running = profiler is not None and profiler.thread.is_alive()
+            if action == "start":
+                if running:
+                    return "A profile is already running, /profile stop first."
+                try:
+                    seconds = float(parts[2]) if len(parts) > 2 else PROFILE_DEFAULT_SECONDS
+                except ValueError:
+                    return "Usage: /profile start [seconds]"
+                seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+                profiler = SamplingProfiler(seconds)
+                profiler.thread.start()
+                return f"Profiling all threads for {seconds:g} s."
+            elif action == "stop":
+                if not running:
+                    return "No profile is running."
+                profiler.stop_event.set()
+                profiler.thread.join()
+                return f"Wrote {profiler.samples} samples to {profiler.path}"
+            return "Usage: /profile start [seconds] | /profile stop"
+
+        elif cmd == "memsnap":
+            if len(parts) > 1:
+                if parts[1] == "stop":
+                    return stop_memory_snapshot()
+                return "Usage: /memsnap | /memsnap stop"
+            separator = "\n" if sender == "CONSOLE" else " | "
+            return separator.join(memory_snapshot())
+
+        elif cmd == "capture":
+            action = parts[1] if len(parts) > 1 else ""
+            if action == "start":
+                if capture:
+                    return f"Already capturing to {capture.path}"
+                path = start_capture()
+                if clients:
+                    return f"Capturing to {path}. The {len(clients)} players already online are only recorded once they rejoin."
+                return f"Capturing to {path}"
+            elif action == "stop":
+                if not capture:
+                    return "No capture is running."
+                done, capture = capture, None
+                done.stop()
+                return f"Saved {done.records} records to {done.path}"
+            if capture:
+                return f"Capturing to {capture.path}, {capture.records} records so far. /capture stop to finish it."
+            return "Usage: /capture start | /capture stop"
+
         elif cmd == "stop":
             print("[SERVER] stopping the awesome sauce server...")
+            if capture:
+                capture.stop()
             save_world()
             save_players()
             save_blacklist()
@@ -432,9 +1585,14 @@ def handle_command(sender, cmdline):
 def client_thread(client, addr):
     pid = None
     is_refresh = True  # Assume it's a refresh until proven otherwise
+    leaving = False  # Client said goodbye, no point holding the session
+    codecs[client] = StreamCodec()
+    reader = FrameReader(client)
+    if capture:
+        capture.open(client, addr)
     try:
         # Receive player ID from client
-        msg = recv_msg(client)
+        msg = recv_msg(reader)
         if not msg or msg.get("type") != "login":
             client.close()
             return
@@ -442,6 +1600,10 @@ def client_thread(client, addr):
         pid = msg["id"]
         password = msg.get("password", "")
         color = msg.get("color", "blue")
+        features = set(msg.get("features", [])) & set(SERVER_FEATURES)
+        if "zlib" in features:
+            # The welcome is the biggest frame of all, compress it too
+            codecs[client].enable()
         
         # Check password
         server_password = str(config.get("password_server", 0))
@@ -461,11 +1623,26 @@ def client_thread(client, addr):
             client.close()
             return
 
+        # A client coming back from a dropped connection only needs the blocks it missed
+        resume = msg.get("resume") or {}
+
         with lock:
+            # Read the edit log and register the socket together, so every later edit is broadcast to it
+            edits = None
+            if resume.get("token") and resume_tokens.get(pid) == resume["token"]:
+                edits = edits_since(resume.get("world_version", -1))
+            resumed = edits is not None
+            welcome_version = world_version
+            old_client = clients.get(pid)
             clients[pid] = client
+            last_seen[pid] = time.monotonic()
+            player_features[pid] = features
+            pending_leave.pop(pid, None)
             
             # Initialize player data if not exists
-            if pid not in player_data:
+            if resumed:
+                pass  # Same session as before the drop
+            elif pid not in player_data:
                 player_data[pid] = {
                     "x": 10,
                     "y": 3,
@@ -482,25 +1659,53 @@ def client_thread(client, addr):
                     player_data[pid]["inventory"] = [None] * 21
                 save_players()
             
+            if not resumed:
+                resume_tokens[pid] = uuid.uuid4().hex
             player_positions[pid] = (player_data[pid]["x"], player_data[pid]["y"])
+        
+        # The old connection may not have noticed it is dead yet
+        if old_client is not None and old_client is not client:
+            try:
+                old_client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
         # Send welcome packet
+        welcome = {
+            "type": "welcome",
+            "id": pid,
+            "motd": config["server-motd"],
+            "server": config["server-name"],
+            "world_version": welcome_version,
+            "world_name": WORLD_NAME,
+            "x": player_data[pid]["x"],
+            "y": player_data[pid]["y"],
+            "hotbar": player_data[pid]["hotbar"],
+            "inventory": player_data[pid].get("inventory", [None] * 21),  # Send inventory!
+            "level": get_level(pid),
+            "color": player_data[pid].get("color", "blue"),
+            "max_players": config["max_players"],
+            "current_players": len(clients),
+            "features": sorted(features),
+            "resume_token": resume_tokens[pid]
+        }
+        if "udp" in features:
+            welcome["udp_token"] = new_udp_token(pid)
+            welcome["udp_port"] = config["port"]
+        if resumed:
+            welcome["resumed"] = True
+            welcome["edits"] = edits
+            is_refresh = False
+            print(f"[SERVER] Player {pid} resumed their session ({len(edits)} missed block changes)")
+        else:
+            cache = msg.get("chunk_cache") or {}
+            if "world_chunks" in features and cache.get("world") == WORLD_NAME:
+                welcome["world_size"] = [len(world[0]), len(world)]
+                welcome["chunks"] = stale_chunks(cache.get("hashes") or {})
+            else:
+                welcome["world"] = world
         try:
-            send_msg(client, {
-                "type": "welcome",
-                "id": pid,
-                "motd": config["server-motd"],
-                "server": config["server-name"],
-                "world": world,
-                "x": player_data[pid]["x"],
-                "y": player_data[pid]["y"],
-                "hotbar": player_data[pid]["hotbar"],
-                "inventory": player_data[pid].get("inventory", [None] * 21),  # Send inventory!
-                "level": get_level(pid),
-                "color": player_data[pid].get("color", "blue"),
-                "max_players": config["max_players"],
-                "current_players": len(clients)
-            })
+            send_msg(client, welcome)
         except:
             with lock:
                 clients.pop(pid, None)
@@ -508,6 +1713,9 @@ def client_thread(client, addr):
             client.close()
             return
 
+        # The player list and join broadcast go out in one write per socket
+        begin_batch()
+
         # Send all other players' positions and colors
         with lock:
             for other_pid, pos in player_positions.items():
@@ -523,20 +1731,65 @@ def client_thread(client, addr):
                     except:
                         pass
 
-        # Broadcast new player joined
-        broadcast({
-            "type": "player_join",
-            "id": pid,
-            "x": player_positions[pid][0],
-            "y": player_positions[pid][1],
-            "color": player_data[pid].get("color", "blue")
-        }, exclude=pid)
+        # Broadcast new player joined (the others never saw a resumed player leave)
+        if not resumed:
+            broadcast({
+                "type": "player_join",
+                "id": pid,
+                "x": player_positions[pid][0],
+                "y": player_positions[pid][1],
+                "color": player_data[pid].get("color", "blue")
+            }, exclude=pid)
+
+        flush_batch()
 
         while True:
+            msg = None
             try:
-                msg = recv_msg(client)
+                msg = recv_msg(reader)
                 if not msg:
                     break
+                last_seen[pid] = time.monotonic()
+                handler_start = time.perf_counter()
+                begin_batch()
+
+                # Latency probes are answered before anything else
+                if msg.get("type") == "ping":
+                    send_msg(client, {"type": "pong", "t": msg.get("t")})
+                    continue
+                elif msg.get("type") == "pong":
+                    update_rtt(pid, time.monotonic() - msg.get("t", 0))
+                    continue
+                elif msg.get("type") == "leave":
+                    # Deliberate quit, skip the resume grace window
+                    leaving = True
+                    break
+
+                # Flood protection, before any of the work a message can cause
+                if not rate_allowed(pid, msg["type"]):
+                    if msg["type"] in ("break_block", "place_block"):
+                        # Reject it so the client rolls back its prediction
+                        if "seq" in msg:
+                            last_edit[pid] = msg["seq"]
+                        slots = ["h" + str(msg.get("slot"))] if msg["type"] == "place_block" else None
+                        ack_edit(pid, msg, False, msg["x"], msg["y"], slots)
+                    elif msg["type"] == "chat":
+                        send_msg(client, {
+                            "type": "chat",
+                            "from": "SERVER",
+                            "level": 999,
+                            "message": "You are sending messages too fast, that one was not sent."
+                        })
+                    if capture and msg["type"] not in COALESCED_TYPES:
+                        capture.drop(client)
+                    if rate_limited(pid, msg):
+                        print(f"[SERVER] Kicking {pid} for flooding")
+                        kick(pid, "Sending messages too fast")
+                        break
+                    continue
+                if msg["type"] in COALESCED_TYPES:
+                    # Anything held back is older than this
+                    held_messages.get(pid, {}).pop(msg["type"], None)
 
                 # If we receive any message, it's not just a refresh
                 if is_refresh:
@@ -573,19 +1826,7 @@ def client_thread(client, addr):
                             })
 
                 elif msg["type"] == "move":
-                    x, y = msg["x"], msg["y"]
-                    with lock:
-                        player_positions[pid] = (x, y)
-                        player_data[pid]["x"] = x
-                        player_data[pid]["y"] = y
-                    
-                    # Broadcast position update
-                    broadcast({
-                        "type": "player_move",
-                        "id": pid,
-                        "x": x,
-                        "y": y
-                    }, exclude=pid)
+                    move_player(pid, msg["x"], msg["y"])
 
                 elif msg["type"] == "update_color":
                     color = msg.get("color", "blue")
@@ -607,124 +1848,129 @@ def client_thread(client, addr):
 
                 elif msg["type"] == "break_block":
                     x, y = msg["x"], msg["y"]
+                    ok = False
+                    if "seq" in msg:
+                        last_edit[pid] = msg["seq"]
                     if 0 <= y < len(world) and 0 <= x < len(world[0]):
                         broken_block = world[y][x]
                         # Cannot break bedrock or air
                         if broken_block != "air" and broken_block != "bedrock":
-                            world[y][x] = "air"
+                            ok = True
+                            version = set_block(x, y, "air")
                             save_world()
                             
-                            # Add to player's hotbar (with 64 stack limit)
-                            hotbar = player_data[pid]["hotbar"]
-                            inventory = player_data[pid].get("inventory", [None] * 21)
-                            added = False
-                            
-                            # Try to stack in existing hotbar slot (max 64)
-                            for slot in hotbar:
-                                if slot and slot["block"] == broken_block and slot["count"] < 64:
-                                    slot["count"] += 1
-                                    added = True
-                                    break
-                            
-                            # Try to stack in existing inventory slot (max 64)
-                            if not added:
-                                for slot in inventory:
-                                    if slot and slot["block"] == broken_block and slot["count"] < 64:
-                                        slot["count"] += 1
-                                        added = True
-                                        break
-                            
-                            # Try empty hotbar slot
-                            if not added:
-                                for i, slot in enumerate(hotbar):
-                                    if slot is None:
-                                        hotbar[i] = {"block": broken_block, "count": 1}
-                                        added = True
-                                        break
-                            
-                            # Try empty inventory slot
-                            if not added:
-                                for i, slot in enumerate(inventory):
-                                    if slot is None:
-                                        inventory[i] = {"block": broken_block, "count": 1}
-                                        added = True
-                                        break
-                            
-                            player_data[pid]["inventory"] = inventory
+                            # Add to player's hotbar, then inventory (with 64 stack limit)
+                            added, changed = add_items(pid, broken_block, 1)
                             save_players()
                             
-                            # Send updated hotbar AND inventory to player
-                            send_msg(client, {
-                                "type": "hotbar_update",
-                                "hotbar": hotbar
-                            })
-                            send_msg(client, {
-                                "type": "inventory_update",
-                                "inventory": inventory
-                            })
+                            # Send the changed slot to player
+                            send_slots(pid, changed)
                             
                             # Broadcast block update
                             broadcast({
                                 "type": "update_block",
                                 "x": x,
                                 "y": y,
-                                "block": "air"
+                                "block": "air",
+                                "v": version
                             })
+                    
+                    # Confirm or reject the client's prediction
+                    ack_edit(pid, msg, ok, x, y)
 
                 elif msg["type"] == "place_block":
                     x, y = msg["x"], msg["y"]
                     slot_index = msg["slot"]
+                    ok = False
+                    if "seq" in msg:
+                        last_edit[pid] = msg["seq"]
                     
                     if 0 <= y < len(world) and 0 <= x < len(world[0]):
                         if world[y][x] in ["air", "ladder"]:
                             hotbar = player_data[pid]["hotbar"]
                             if 0 <= slot_index < len(hotbar) and hotbar[slot_index]:
+                                ok = True
                                 block_type = hotbar[slot_index]["block"]
                                 hotbar[slot_index]["count"] -= 1
                                 
                                 if hotbar[slot_index]["count"] <= 0:
                                     hotbar[slot_index] = None
                                 
-                                world[y][x] = block_type
+                                version = set_block(x, y, block_type)
                                 save_world()
                                 save_players()
                                 
-                                # Send updated hotbar to player
-                                send_msg(client, {
-                                    "type": "hotbar_update",
-                                    "hotbar": hotbar
-                                })
+                                # Send updated slot to player
+                                send_slots(pid, ["h" + str(slot_index)])
                                 
                                 # Broadcast block update
                                 broadcast({
                                     "type": "update_block",
                                     "x": x,
                                     "y": y,
-                                    "block": block_type
+                                    "block": block_type,
+                                    "v": version
                                 })
+                    
+                    # Confirm or reject the client's prediction
+                    ack_edit(pid, msg, ok, x, y, ["h" + str(slot_index)])
                 
                 elif msg["type"] == "sync_inventory":
                     # Client is syncing inventory after drag&drop
-                    hotbar = msg.get("hotbar", [None] * 7)
-                    inventory = msg.get("inventory", [None] * 21)
-                    
-                    player_data[pid]["hotbar"] = hotbar
-                    player_data[pid]["inventory"] = inventory
-                    save_players()
+                    sync_inventory(pid, msg)
+                
+                elif msg["type"] == "move_slot":
+                    # Client dragged an item from one slot to another (swap)
+                    src, dst = msg.get("from", ""), msg.get("to", "")
+                    if move_slot(pid, src, dst):
+                        save_players()
+                        send_msg(client, {"type": "slot_ack", "seq": msg.get("seq"), "ok": True})
+                    else:
+                        # Send back whatever we have so the client can undo its move
+                        send_msg(client, {
+                            "type": "slot_ack",
+                            "seq": msg.get("seq"),
+                            "ok": False,
+                            "slots": slot_contents(pid, (src, dst))
+                        })
 
             except:
                 break
+            finally:
+                flush_batch()
+                if msg:
+                    metrics.observe("server_handler_seconds", time.perf_counter() - handler_start, type=type_label(msg.get("type")))
 
     except Exception as e:
         print(f"[SERVER] Error with client: {e}")
     finally:
-        if pid:
-            with lock:
+        held = False
+        with lock:
+            # A resumed session owns the player now, leave everything to it
+            superseded = clients.get(pid) not in (None, client)
+            if pid and not superseded:
+                # Kicked players were already removed from clients and cannot resume
+                held = pid in clients and not is_refresh and not leaving and config.get("resume_grace", 30) > 0
                 clients.pop(pid, None)
-                player_positions.pop(pid, None)
-            
-            # Only log disconnect and broadcast if they were actually playing
-            if not is_refresh:
+                player_rtt.pop(pid, None)
+                last_seen.pop(pid, None)
+                player_features.pop(pid, None)
+                slot_seq.pop(pid, None)
+                last_edit.pop(pid, None)
+                forget_udp(pid)
+                forget_rate_limits(pid)
+                if held:
+                    # Keep them in the world for a moment in case they reconnect
+                    pending_leave[pid] = time.monotonic() + config.get("resume_grace", 30)
+                else:
+                    player_positions.pop(pid, None)
+                    resume_tokens.pop(pid, None)
+        
+        # Only log disconnect and broadcast if they were actually playing
+        if pid and not superseded and not is_refresh:
+            if held:
+                print(f"[SERVER] Player {pid} lost connection, holding their session for {config.get('resume_grace', 30)} s")
+            else:
                 # Broadcast player left
                 broadcast({
                     "type": "player_leave",
@@ -733,6 +1979,13 @@ def client_thread(client, addr):
                 
                 print(f"[SERVER] Player {pid} disconnected")
         
+        codec = codecs.pop(client, None)
+        if pid and not is_refresh and codec and codec.compressor:
+            print(f"[SERVER] {pid} compression: {(codec.raw_in + codec.raw_out) // 1024} KB -> "
+                  f"{(codec.wire_in + codec.wire_out) // 1024} KB ({codec.ratio():.1f}x, {codec.seconds * 1000:.0f} ms CPU), "
+                  f"{codec.frames_out} frames in {codec.writes} writes")
+        if capture:
+            capture.close(client)
         client.close()
 
 # =========================
@@ -818,15 +2071,41 @@ def console():
 # START SERVER
 # =========================
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind((config["host"], config["port"]))
-server.listen(config["max_players"])
-
-print(f"[SERVER] {config['server-name']} started on {config['host']}:{config['port']}")
+# Importing the module (bench.py) only loads the config, world and state
+if __name__ == "__main__":
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((config["host"], config["port"]))
+    server.listen(config["max_players"])
 
-threading.Thread(target=console, daemon=True).start()
+    print(f"[SERVER] {config['server-name']} started on {config['host']}:{config['port']}")
 
-while True:
-    c, a = server.accept()
-    threading.Thread(target=client_thread, args=(c, a), daemon=True).start()
+    if "udp" in SERVER_FEATURES:
+        try:
+            udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp_sock.bind((config["host"], config["port"]))
+            threading.Thread(target=udp_listener, daemon=True).start()
+        except OSError as e:
+            print(f"[SERVER] UDP channel disabled: {e}")
+            SERVER_FEATURES.remove("udp")
+
+    if config.get("metrics_port", 0):
+        try:
+            metrics_server = ThreadingHTTPServer((config.get("metrics_host", "127.0.0.1"), config["metrics_port"]), MetricsHandler)
+            metrics_server.daemon_threads = True
+            threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+            print(f"[SERVER] Metrics on http://{config.get('metrics_host', '127.0.0.1')}:{config['metrics_port']}/metrics")
+        except OSError as e:
+            print(f"[SERVER] Metrics endpoint disabled: {e}")
+
+    if config.get("capture", False):
+        print(f"[SERVER] Capturing inbound traffic to {start_capture()}")
+
+    threading.Thread(target=console, daemon=True).start()
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    while True:
+        c, a = server.accept()
+        # Writes are already coalesced per handler, Nagle would only add latency
+        c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=client_thread, args=(c, a), daemon=True).start()
@@ -0,0 +1,245 @@
+import math
+
+# =========================
+# CONSTANTS
+# =========================
+
+# Tile flags stored in the bitmap
+AIR = 0
+SOLID = 1
+LADDER = 2
+
+# Anything not listed here is solid
+BLOCK_FLAGS = {
+    "air": AIR,
+    "ladder": LADDER,
+}
+
+# Player box, in blocks. x is the center, y is the top of the head.
+PLAYER_HALF_WIDTH = 0.4
+PLAYER_BLOCKS_TALL = 2
+
+# Movement tuning, in blocks per second
+MOVE_SPEED = 100
+CLIMB_SPEED = 189
+GRAVITY = 50  # The old game loop added 25 twice per frame
+MAX_FALL_SPEED = 15
+JUMP_VELOCITY = -12
+
+# Keeps touching edges from counting as overlaps
+EPSILON = 1e-4
+
+# Fixed simulation rate, independent of the render frame rate
+PHYSICS_HZ = 120
+# Longest frame the simulation will catch up on (window drags, hitches)
+MAX_FRAME_TIME = 0.25
+
+def block_flag(block):
+    """Get the tile flag for a block name"""
+    return BLOCK_FLAGS.get(block, SOLID)
+
+# =========================
+# TILE MAP
+# =========================
+class TileMap:
+    """Solid/ladder bitmap of the world, one byte per block"""
+
+    def __init__(self, world):
+        self.height = len(world)
+        self.width = len(world[0]) if world else 0
+        self.cells = bytearray(b"".join(
+            bytes(BLOCK_FLAGS.get(block, SOLID) for block in row) for row in world
+        ))
+
+    def set_block(self, x, y, block):
+        """Keep the bitmap in sync with an update_block"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.cells[y * self.width + x] = block_flag(block)
+
+    def flag(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return AIR
+
+    def is_solid(self, x, y):
+        return self.flag(x, y) == SOLID
+
+    def is_ladder(self, x, y):
+        return self.flag(x, y) == LADDER
+
+# =========================
+# PLAYER STATE
+# =========================
+class PlayerState:
+    """Position and velocity of one player, in blocks"""
+    __slots__ = ("x", "y", "vx", "vy", "on_ground", "on_ladder")
+
+    def __init__(self, x=10.0, y=3.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.vx = 0.0
+        self.vy = 0.0
+        self.on_ground = False
+        self.on_ladder = False
+
+    def teleport(self, x, y):
+        """Move without carrying any velocity over (respawn, /tp)"""
+        self.x = float(x)
+        self.y = float(y)
+        self.vx = 0.0
+        self.vy = 0.0
+        self.on_ground = False
+
+class Inputs:
+    """Held movement keys for one step"""
+    __slots__ = ("left", "right", "jump", "climb_up", "climb_down")
+
+    def __init__(self, left=False, right=False, jump=False, climb_up=False, climb_down=False):
+        self.left = left
+        self.right = right
+        self.jump = jump
+        self.climb_up = climb_up
+        self.climb_down = climb_down
+
+# =========================
+# COLLISION
+# =========================
+def _column_blocked(tiles, col, top, bottom):
+    """Check if any solid tile in a column overlaps the span top..bottom"""
+    for row in range(math.floor(top + EPSILON), math.ceil(bottom - EPSILON)):
+        if tiles.is_solid(col, row):
+            return True
+    return False
+
+def _row_blocked(tiles, row, left, right):
+    """Check if any solid tile in a row overlaps the span left..right"""
+    for col in range(math.floor(left + EPSILON), math.ceil(right - EPSILON)):
+        if tiles.is_solid(col, row):
+            return True
+    return False
+
+def _sweep_x(state, tiles, dx):
+    """Move horizontally, stopping at the first solid column crossed"""
+    top = state.y
+    bottom = state.y + PLAYER_BLOCKS_TALL
+    if dx > 0:
+        edge = state.x + PLAYER_HALF_WIDTH
+        first = math.ceil(edge - EPSILON)
+        last = math.ceil(edge + dx - EPSILON) - 1
+        for col in range(first, last + 1):
+            if _column_blocked(tiles, col, top, bottom):
+                state.x = col - PLAYER_HALF_WIDTH
+                state.vx = 0.0
+                return
+    elif dx < 0:
+        edge = state.x - PLAYER_HALF_WIDTH
+        first = math.floor(edge + EPSILON) - 1
+        last = math.floor(edge + dx + EPSILON)
+        for col in range(first, last - 1, -1):
+            if _column_blocked(tiles, col, top, bottom):
+                state.x = col + 1 + PLAYER_HALF_WIDTH
+                state.vx = 0.0
+                return
+    state.x += dx
+
+def _sweep_y(state, tiles, dy):
+    """Move vertically, landing on or bumping into the first solid row crossed"""
+    left = state.x - PLAYER_HALF_WIDTH
+    right = state.x + PLAYER_HALF_WIDTH
+    if dy > 0:
+        edge = state.y + PLAYER_BLOCKS_TALL
+        first = math.ceil(edge - EPSILON)
+        last = math.ceil(edge + dy - EPSILON) - 1
+        for row in range(first, last + 1):
+            if _row_blocked(tiles, row, left, right):
+                state.y = float(row - PLAYER_BLOCKS_TALL)
+                state.vy = 0.0
+                state.on_ground = True
+                return
+    elif dy < 0:
+        edge = state.y
+        first = math.floor(edge + EPSILON) - 1
+        last = math.floor(edge + dy + EPSILON)
+        for row in range(first, last - 1, -1):
+            if _row_blocked(tiles, row, left, right):
+                state.y = float(row + 1)
+                state.vy = 0.0
+                return
+    state.y += dy
+
+# =========================
+# STEP
+# =========================
+def step(state, inputs, dt, tiles):
+    """Advance one player by dt seconds against the tile map"""
+    col = int(state.x)
+    row = int(state.y)
+    state.on_ladder = tiles.is_ladder(col, row) or tiles.is_ladder(col, row + 1)
+
+    if inputs.left:
+        state.vx = -MOVE_SPEED
+    elif inputs.right:
+        state.vx = MOVE_SPEED
+    else:
+        state.vx = 0.0
+
+    if state.on_ladder:
+        # Ladders hold the player in place unless climbing
+        if inputs.climb_up:
+            dy = -CLIMB_SPEED * dt
+        elif inputs.climb_down:
+            dy = CLIMB_SPEED * dt
+        else:
+            dy = 0.0
+        state.vy = 0.0
+    else:
+        state.vy = min(state.vy + GRAVITY * dt, MAX_FALL_SPEED)
+        if inputs.jump and state.on_ground:
+            state.vy = JUMP_VELOCITY
+        dy = state.vy * dt
+
+    state.on_ground = False
+    _sweep_x(state, tiles, state.vx * dt)
+    _sweep_y(state, tiles, dy)
+
+    # Keep the player inside the world
+    state.x = max(0.5, min(state.x, tiles.width - 1.5))
+    state.y = max(0.0, min(state.y, tiles.height - 2.5))
+
+# =========================
+# FIXED TIMESTEP
+# =========================
+class FixedStepper:
+    """Runs step() at a fixed rate and interpolates between the last two steps"""
+
+    def __init__(self, state, hz=PHYSICS_HZ):
+        self.state = state
+        self.dt = 1.0 / hz
+        self.accumulator = 0.0
+        self.prev_x = state.x
+        self.prev_y = state.y
+
+    def advance(self, frame_time, inputs, tiles):
+        """Run as many fixed steps as frame_time covers, returns the number of steps"""
+        self.accumulator += min(frame_time, MAX_FRAME_TIME)
+        steps = 0
+        while self.accumulator >= self.dt:
+            self.prev_x = self.state.x
+            self.prev_y = self.state.y
+            step(self.state, inputs, self.dt, tiles)
+            self.accumulator -= self.dt
+            steps += 1
+        return steps
+
+    def reset(self):
+        """Forget the previous step after a teleport so it is not interpolated"""
+        self.accumulator = 0.0
+        self.prev_x = self.state.x
+        self.prev_y = self.state.y
+
+    def render_position(self):
+        """Position blended between the last two steps for drawing"""
+        alpha = self.accumulator / self.dt
+        x = self.prev_x + (self.state.x - self.prev_x) * alpha
+        y = self.prev_y + (self.state.y - self.prev_y) * alpha
+        return x, y
@@ -0,0 +1,473 @@
+"""Replays a server capture (/capture, or "capture" in config.json) against a fresh server and checks the end state"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+# =========================
+# CONFIG
+# =========================
+
+# Capture format, must match moddedserver.py
+CAPTURE_MAGIC = b"NTCAP1\n"
+CAPTURE_RECORD = struct.Struct("!dIBI")  # seconds since start, connection, kind, payload length
+CAP_OPEN = 0
+CAP_FRAME = 1
+CAP_CLOSE = 2
+CAP_UDP = 3
+CAP_CONSOLE = 4
+CAP_STATE = 5
+CAP_DROP = 6
+
+COMPRESSED = 0x80000000  # Length prefix flag for zlib frames, same as the server
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "moddedserver.py")
+STARTUP_TIMEOUT = 30  # Seconds to wait for the server to listen (big worlds load slowly)
+SYNC_TIMEOUT = 30  # Seconds to wait for a pong when checking the server caught up
+MAX_DIFFS = 10  # Mismatches listed per kind
+
+# =========================
+# CAPTURE FILE
+# =========================
+
+def read_capture(path):
+    """[(seconds, connection, kind, payload), ...] in recorded order"""
+    with open(path, "rb") as f:
+        # Not gzip.open, a capture cut off by a killed server has no end marker but its flushed part still decodes
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read())
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not a capture file")
+    records = []
+    offset = len(CAPTURE_MAGIC)
+    while offset + CAPTURE_RECORD.size <= len(data):
+        t, conn, kind, length = CAPTURE_RECORD.unpack_from(data, offset)
+        offset += CAPTURE_RECORD.size
+        if offset + length > len(data):
+            break  # Cut off by a server that died mid-write
+        records.append((t, conn, kind, data[offset:offset + length]))
+        offset += length
+    return records
+
+def final_state(path):
+    """The last state snapshot in a capture"""
+    states = [payload for _, _, kind, payload in read_capture(path) if kind == CAP_STATE]
+    return json.loads(states[-1]) if states else None
+
+def compare_states(expected, actual):
+    """Human readable differences in the world and player data, empty if they match"""
+    diffs = []
+    old_world, new_world = expected["world"], actual["world"]
+    if len(old_world) != len(new_world) or (old_world and len(old_world[0]) != len(new_world[0])):
+        diffs.append(f"world size differs: {len(old_world[0])}x{len(old_world)} vs {len(new_world[0])}x{len(new_world)}")
+    else:
+        blocks = [(x, y, old, new_world[y][x])
+                  for y, row in enumerate(old_world) for x, old in enumerate(row) if old != new_world[y][x]]
+        for x, y, old, new in blocks[:MAX_DIFFS]:
+            diffs.append(f"block {x},{y}: expected {old}, got {new}")
+        if len(blocks) > MAX_DIFFS:
+            diffs.append(f"... {len(blocks) - MAX_DIFFS} more blocks differ")
+    old_players, new_players = expected["player_data"], actual["player_data"]
+    players = []
+    for pid in sorted(set(old_players) | set(new_players)):
+        if pid not in new_players:
+            players.append(f"player {pid} missing")
+        elif pid not in old_players:
+            players.append(f"player {pid} should not exist")
+        else:
+            for key in sorted(set(old_players[pid]) | set(new_players[pid])):
+                if old_players[pid].get(key) != new_players[pid].get(key):
+                    players.append(f"player {pid} {key}: expected {old_players[pid].get(key)!r}, got {new_players[pid].get(key)!r}")
+    diffs += players[:MAX_DIFFS]
+    if len(players) > MAX_DIFFS:
+        diffs.append(f"... {len(players) - MAX_DIFFS} more player differences")
+    return diffs
+
+# =========================
+# SERVER
+# =========================
+
+def free_port():
+    """A port that is free for both TCP and UDP right now"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp:
+            tcp.bind(("127.0.0.1", 0))
+            port = tcp.getsockname()[1]
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+                    udp.bind(("127.0.0.1", port))
+                return port
+            except OSError:
+                continue
+
+def prepare_workdir(workdir, state, port):
+    """Lay out the starting files of the captured server, listening on port"""
+    config = dict(state["config"])
+    config.update({
+        "host": "127.0.0.1",
+        "port": port,
+        "capture": False,
+        "metrics_port": 0,
+        "console_mode": "pterodactyl",  # Reads commands from our stdin line by line
+        "rate_limits": {},  # Faster than 1x every client would look like a flood
+    })
+    world_dir = os.path.join(workdir, "worlds", config["world-name"])
+    os.makedirs(world_dir, exist_ok=True)
+    files = {
+        os.path.join(workdir, "config.json"): config,
+        os.path.join(workdir, "permission.json"): state["permissions"],
+        os.path.join(workdir, "blacklist.json"): state["blacklist"],
+        os.path.join(workdir, "commands.json"): state["commands"],
+        os.path.join(world_dir, "world.json"): state["world"],
+        os.path.join(world_dir, "players.json"): state["player_data"],
+    }
+    for path, data in files.items():
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+class Server:
+    """A moddedserver.py subprocess driven through its console"""
+    def __init__(self, args, workdir, port):
+        self.args = args
+        self.workdir = workdir
+        self.port = port
+        self.proc = None
+        self.lines = asyncio.Queue()
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", self.args.server, cwd=self.workdir,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        asyncio.ensure_future(self.read_output())
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                return
+            except OSError:
+                if self.proc.returncode is not None or time.monotonic() > deadline:
+                    raise RuntimeError("server did not start, run with --verbose to see its output")
+                await asyncio.sleep(0.1)
+
+    async def read_output(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', 'replace').rstrip()
+            if self.args.verbose:
+                print(f"  | {line}", file=sys.stderr)
+            self.lines.put_nowait(line)
+
+    async def command(self, cmdline):
+        self.proc.stdin.write(cmdline.encode('utf-8') + b"\n")
+        await self.proc.stdin.drain()
+
+    async def snapshot(self):
+        """Take the server's current state through a throwaway capture"""
+        while not self.lines.empty():
+            self.lines.get_nowait()
+        await self.command("/capture start")
+        await self.command("/capture stop")
+        while True:
+            line = await asyncio.wait_for(self.lines.get(), timeout=STARTUP_TIMEOUT)
+            if line.startswith("[SERVER] Saved ") and " records to " in line:
+                return final_state(os.path.join(self.workdir, line.split(" records to ", 1)[1]))
+
+    async def stop(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.terminate()
+            await self.proc.wait()
+
+# =========================
+# CONNECTIONS
+# =========================
+
+class Connection:
+    """One captured client connection, replayed frame by frame"""
+    def __init__(self, conn_id, resume_tokens):
+        self.conn_id = conn_id
+        self.resume_tokens = resume_tokens  # player_id -> token from the replay server's latest welcome
+        self.reader = None
+        self.writer = None
+        self.decompressor = zlib.decompressobj()
+        self.welcomed = asyncio.Event()
+        self.pid = None
+        self.udp_token = None
+        self.udp_port = None
+        self.udp = None  # Datagram socket, opened on the first captured datagram
+        self.pongs = {}  # ping t -> future
+        self.next_ping = 0
+        self.open = False
+        self.listener = None
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.open = True
+        self.listener = asyncio.ensure_future(self.listen())
+
+    async def send(self, payload):
+        if not self.open:
+            return False
+        try:
+            self.writer.write(struct.pack('!I', len(payload)) + payload)
+            await self.writer.drain()
+            return True
+        except (OSError, ConnectionError):
+            self.open = False
+            return False
+
+    async def listen(self):
+        """Drain everything the server sends, answering its pings like a client would"""
+        try:
+            while True:
+                header = await self.reader.readexactly(4)
+                length = struct.unpack('!I', header)[0]
+                payload = await self.reader.readexactly(length & ~COMPRESSED)
+                if length & COMPRESSED:
+                    payload = self.decompressor.decompress(payload)
+                msg = json.loads(payload)
+                kind = msg.get("type")
+                if kind == "welcome":
+                    self.pid = msg.get("id")
+                    self.udp_token = msg.get("udp_token")
+                    self.udp_port = msg.get("udp_port")
+                    self.resume_tokens[self.pid] = msg.get("resume_token")
+                    self.welcomed.set()
+                elif kind == "ping":
+                    await self.send(json.dumps({"type": "pong", "t": msg.get("t")}).encode('utf-8'))
+                elif kind == "pong":
+                    future = self.pongs.pop(msg.get("t"), None)
+                    if future and not future.done():
+                        future.set_result(True)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        self.open = False
+        for future in self.pongs.values():
+            if not future.done():
+                future.set_result(False)
+        self.close()
+
+    async def sync(self):
+        """Wait until the server has handled everything sent so far on this connection"""
+        if not self.open:
+            return
+        self.next_ping += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pongs[self.next_ping] = future
+        if await self.send(json.dumps({"type": "ping", "t": self.next_ping}).encode('utf-8')):
+            await asyncio.wait_for(future, timeout=SYNC_TIMEOUT)
+
+    def finish(self):
+        """Hang up like the client did, the server still reads everything sent before our FIN"""
+        if self.open:
+            self.open = False
+            try:
+                self.writer.write_eof()
+            except (OSError, ConnectionError):
+                pass
+
+    def close(self):
+        """Drop the socket (with unread data in it, the server gets a reset instead of a clean close)"""
+        self.open = False
+        if self.writer:
+            self.writer.close()
+        if self.udp:
+            self.udp.close()
+
+# =========================
+# REPLAY
+# =========================
+
+async def replay(args):
+    records = read_capture(args.capture)
+    if not records or records[0][2] != CAP_STATE:
+        raise ValueError("capture does not start with a state snapshot")
+    start_state = json.loads(records[0][3])
+    expected = None
+    if len(records) > 1 and records[-1][2] == CAP_STATE:
+        expected = json.loads(records[-1][3])
+    records = records[1:-1] if expected else records[1:]
+    # Captured pongs answered the original server's pings, ours are answered live
+    records = [r for r in records if not (r[2] == CAP_FRAME and frame_type(r[3]) == "pong")]
+    records = without_dropped(records)
+
+    scratch = None
+    workdir = args.workdir
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        scratch = tempfile.TemporaryDirectory(prefix="nighttree-replay-")
+        workdir = scratch.name
+    port = free_port()
+    prepare_workdir(workdir, start_state, port)
+    server = Server(args, workdir, port)
+    await server.start()
+
+    conns = {}
+    resume_tokens = {}
+    counts = {"connections": 0, "frames": 0, "datagrams": 0, "console": 0, "unsent": 0}
+    speed = 0 if args.speed == "max" else float(args.speed)
+    # Without pacing, frames from different connections race each other on the server
+    lockstep = speed == 0 if args.lockstep is None else args.lockstep
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        for t, conn_id, kind, payload in records:
+            if speed:
+                delay = start + t / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            conn = conns.get(conn_id)
+            if kind == CAP_OPEN:
+                conn = conns[conn_id] = Connection(conn_id, resume_tokens)
+                await conn.connect(port)
+                counts["connections"] += 1
+            elif kind == CAP_FRAME and conn:
+                if frame_type(payload) == "login":
+                    payload = rewrite_login(payload, resume_tokens, start_state["world_version"])
+                if await conn.send(payload):
+                    counts["frames"] += 1
+                else:
+                    counts["unsent"] += 1
+                if lockstep:
+                    await conn.sync()
+            elif kind == CAP_UDP and conn:
+                if await send_datagram(conn, payload, port, lockstep):
+                    counts["datagrams"] += 1
+                else:
+                    counts["unsent"] += 1
+            elif kind == CAP_CLOSE and conn:
+                conn.finish()
+            elif kind == CAP_CONSOLE:
+                await server.command(payload.decode('utf-8'))
+                counts["console"] += 1
+
+        # Wait for the server to catch up, that is part of how long the replay took
+        await asyncio.gather(*(conn.sync() for conn in conns.values() if conn.open))
+        closing = [conn.listener for conn in conns.values() if not conn.open and not conn.listener.done()]
+        if closing:
+            await asyncio.wait(closing, timeout=SYNC_TIMEOUT)
+        elapsed = loop.time() - start
+        await asyncio.sleep(args.settle)
+        actual = await server.snapshot() if expected else None
+    finally:
+        for conn in conns.values():
+            conn.close()
+        await server.stop()
+        if scratch:
+            scratch.cleanup()
+
+    captured = records[-1][0] if records else 0.0
+    summary = {
+        "capture_seconds": round(captured, 3),
+        "replay_seconds": round(elapsed, 3),
+        "speedup": round(captured / elapsed, 2) if elapsed else None,
+        "frames_per_s": round(counts["frames"] / elapsed, 1) if elapsed else None,
+        **counts,
+        "checked": expected is not None,
+        "differences": compare_states(expected, actual) if expected else [],
+    }
+    return summary
+
+def without_dropped(records):
+    """Leave out frames the original server's rate limits dropped, the replay server runs without limits"""
+    kept = []
+    last_frame = {}  # connection -> index in kept of its latest frame
+    for record in records:
+        t, conn_id, kind, payload = record
+        if kind == CAP_DROP:
+            index = last_frame.pop(conn_id, None)
+            if index is not None:
+                kept[index] = None
+            continue
+        if kind == CAP_FRAME:
+            last_frame[conn_id] = len(kept)
+        kept.append(record)
+    return [record for record in kept if record is not None]
+
+def frame_type(payload):
+    """The type of a captured frame, or None if it is not a JSON message"""
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return None
+    return msg.get("type") if isinstance(msg, dict) else None
+
+def rewrite_login(payload, resume_tokens, start_version):
+    """Point a captured resume at the replay server's own token and world versions"""
+    msg = json.loads(payload)
+    resume = msg.get("resume")
+    if not resume:
+        return payload
+    if msg.get("id") in resume_tokens:
+        resume["token"] = resume_tokens[msg["id"]]
+    if "world_version" in resume:
+        resume["world_version"] -= start_version
+    return json.dumps(msg).encode('utf-8')
+
+async def send_datagram(conn, payload, port, lockstep=False):
+    """Resend a captured datagram under this session's token, or as a TCP move without UDP or in lockstep"""
+    try:
+        await asyncio.wait_for(conn.welcomed.wait(), timeout=SYNC_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    msg = json.loads(payload)
+    if lockstep or not conn.udp_token:
+        # A datagram can overtake the TCP frames around it, a TCP move keeps the captured order
+        if msg.get("type") != "move":
+            return True
+        if not await conn.send(json.dumps({"type": "move", "x": msg["x"], "y": msg["y"]}).encode('utf-8')):
+            return False
+        if lockstep:
+            await conn.sync()
+        return True
+    msg["t"] = conn.udp_token
+    if conn.udp is None:
+        conn.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        conn.udp.setblocking(False)
+    try:
+        conn.udp.sendto(json.dumps(msg).encode('utf-8'), ("127.0.0.1", conn.udp_port or port))
+    except OSError:
+        return False
+    return True
+
+# =========================
+# RUN
+# =========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a Night Tree server capture against a fresh server")
+    parser.add_argument("capture", help="a .ntcap file from the server's captures/ directory")
+    parser.add_argument("--speed", default="1", help='playback speed, e.g. 1, 10 or "max"')
+    parser.add_argument("--lockstep", action=argparse.BooleanOptionalAction, default=None,
+                        help="wait for the server to handle each frame before the next, so connections cannot race "
+                             '(default: on with --speed max, off otherwise)')
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait after the last record before checking")
+    parser.add_argument("--server", default=SERVER_PATH, help="server script to replay against")
+    parser.add_argument("--workdir", help="run the server here and keep its files, instead of a temporary directory")
+    parser.add_argument("--verbose", action="store_true", help="show the server's output")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = asyncio.run(replay(args))
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            if key != "differences":
+                print(f"{key}: {value}")
+        if not summary["checked"]:
+            print("No final snapshot in the capture (stopped without /capture stop), end state not checked.")
+        elif summary["differences"]:
+            print("End state differs from the capture:")
+            for line in summary["differences"]:
+                print(f"  {line}")
+        else:
+            print("End state matches the capture.")
+    sys.exit(1 if summary["differences"] else 0)